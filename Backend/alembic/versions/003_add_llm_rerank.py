@@ -0,0 +1,28 @@
+"""add rerank config to llm
+
+Revision ID: 003_add_llm_rerank
+Revises: 002_complete_category_migration
+Create Date: 2026-10-18 09:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = '003_add_llm_rerank'
+down_revision: Union[str, None] = '002_complete_category_migration'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Bật/tắt bước rerank bằng cross-encoder và số chunk ứng viên trước khi rerank
+    op.add_column('llm', sa.Column('rerank_enabled', sa.Boolean(), nullable=False, server_default=sa.false()))
+    op.add_column('llm', sa.Column('rerank_candidates', sa.Integer(), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('llm', 'rerank_candidates')
+    op.drop_column('llm', 'rerank_enabled')
@@ -0,0 +1,145 @@
+"""
+Đo trade-off recall / latency / bộ nhớ khi giảm số chiều embedding (EMBEDDING_DIMENSIONS)
+trên chính collection ChromaDB đang dùng, trước khi chuyển sang vector ngắn hơn.
+
+- text-embedding-3-* và gemini-embedding-001 đều train kiểu Matryoshka: vector cắt ngắn
+  + chuẩn hóa lại tương đương vector provider trả về với dimensions/output_dimensionality
+  -> không cần gọi API để embed lại toàn bộ tài liệu
+- Ground truth = top-k tìm exact ở số chiều đầy đủ
+- Latency đo trên 1 collection HNSW tạm (in-memory) dựng lại ở từng số chiều
+
+Chạy:
+    python benchmark_embedding_dimensions.py --dims 256,512,768,1024,1536 --top-k 5
+    python benchmark_embedding_dimensions.py --queries-file questions.txt   (câu hỏi thật, cần key embedding trong DB)
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import chromadb
+from chromadb.config import Settings
+
+from config.chromadb_config import get_or_create_collection
+
+
+def normalize(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.where(norms == 0, 1.0, norms)
+
+
+def truncate(matrix: np.ndarray, dims: int) -> np.ndarray:
+    return normalize(matrix[:, :dims])
+
+
+def exact_top_k(corpus: np.ndarray, queries: np.ndarray, top_k: int, exclude=None) -> np.ndarray:
+    scores = queries @ corpus.T
+    if exclude is not None:
+        scores[np.arange(len(queries)), exclude] = -np.inf
+    return np.argsort(-scores, axis=1)[:, :top_k]
+
+
+def recall_at_k(truth: np.ndarray, found: np.ndarray) -> float:
+    hits = [len(set(t) & set(f)) / len(t) for t, f in zip(truth, found)]
+    return float(np.mean(hits))
+
+
+def hnsw_latency(corpus: np.ndarray, queries: np.ndarray, top_k: int) -> dict:
+    client = chromadb.EphemeralClient(settings=Settings(anonymized_telemetry=False, allow_reset=True))
+    collection = client.create_collection(
+        name=f"bench_{corpus.shape[1]}_{int(time.time() * 1000)}",
+        metadata={"hnsw:space": "cosine"}
+    )
+    ids = [str(i) for i in range(len(corpus))]
+    for start in range(0, len(corpus), 1000):
+        collection.add(ids=ids[start:start + 1000], embeddings=corpus[start:start + 1000].tolist())
+
+    timings = []
+    for query in queries:
+        started = time.perf_counter()
+        collection.query(query_embeddings=[query.tolist()], n_results=top_k, include=[])
+        timings.append((time.perf_counter() - started) * 1000)
+
+    client.delete_collection(collection.name)
+    return {"p50_ms": float(np.percentile(timings, 50)), "p95_ms": float(np.percentile(timings, 95))}
+
+
+async def embed_queries_from_file(path: str) -> np.ndarray:
+    from config.database import AsyncSessionLocal
+    from config.get_embedding import get_embedding_chatgpt, get_embedding_gemini
+    from llm.help_llm import get_embedding_keys
+
+    with open(path, encoding="utf-8") as f:
+        questions = [line.strip() for line in f if line.strip()]
+
+    async with AsyncSessionLocal() as db:
+        embedding_model_name, embedding_keys = await get_embedding_keys(db)
+
+    embed = get_embedding_gemini if "gemini" in embedding_model_name.lower() else get_embedding_chatgpt
+    # Luôn lấy vector đầy đủ, sau đó cắt ngắn giống corpus
+    vectors = await embed(questions, api_key=embedding_keys[0], dimensions=None)
+    return np.asarray(vectors, dtype=np.float32)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Benchmark số chiều embedding trên collection hiện tại")
+    parser.add_argument("--collection", default="document_chunks")
+    parser.add_argument("--dims", default="256,512,768,1024,1536")
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--sample", type=int, default=200, help="Số chunk lấy làm câu hỏi khi không có --queries-file")
+    parser.add_argument("--queries-file", default=None)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    collection = get_or_create_collection(args.collection)
+    data = collection.get(include=["embeddings"])
+    if data["embeddings"] is None or len(data["embeddings"]) == 0:
+        print("Collection không có dữ liệu")
+        return
+
+    corpus_full = normalize(np.asarray(data["embeddings"], dtype=np.float32))
+    n_chunks, full_dims = corpus_full.shape
+    print(f"Collection '{args.collection}': {n_chunks} chunks x {full_dims} chiều")
+
+    exclude = None
+    if args.queries_file:
+        queries_raw = await embed_queries_from_file(args.queries_file)
+        if queries_raw.shape[1] != full_dims:
+            print(f"Vector câu hỏi có {queries_raw.shape[1]} chiều, collection có {full_dims} chiều")
+            return
+        print(f"Câu hỏi: {len(queries_raw)} câu từ {args.queries_file}")
+    else:
+        # Không có câu hỏi thật: dùng chính các chunk làm câu hỏi (bỏ qua kết quả trùng chính nó)
+        rng = np.random.default_rng(args.seed)
+        exclude = rng.choice(n_chunks, size=min(args.sample, n_chunks), replace=False)
+        queries_raw = corpus_full[exclude]
+        print(f"Câu hỏi: {len(exclude)} chunk ngẫu nhiên")
+
+    queries_full = normalize(queries_raw)
+    truth = exact_top_k(corpus_full, queries_full, args.top_k, exclude)
+
+    dims_list = sorted({int(d) for d in args.dims.split(",") if int(d) < full_dims}) + [full_dims]
+
+    print(f"\n{'dims':>6} | {'recall@' + str(args.top_k):>9} | {'p50 ms':>7} | {'p95 ms':>7} | {'vectors MB':>10}")
+    print("-" * 52)
+    for dims in dims_list:
+        corpus = truncate(corpus_full, dims)
+        queries = truncate(queries_raw, dims)
+        recall = recall_at_k(truth, exact_top_k(corpus, queries, args.top_k, exclude))
+        latency = hnsw_latency(corpus, queries, args.top_k)
+        vector_mb = n_chunks * dims * 4 / (1024 * 1024)
+        print(
+            f"{dims:>6} | {recall:>9.4f} | {latency['p50_ms']:>7.2f} | {latency['p95_ms']:>7.2f} | {vector_mb:>10.2f}"
+        )
+
+    print("\nChọn số chiều nhỏ nhất có recall chấp nhận được rồi đặt EMBEDDING_DIMENSIONS và embed lại tài liệu.")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,146 @@
+"""
+Đo độ trễ event loop khi nhiều cuộc chat đồng thời đọc / ghi cache session trên hot path
+(get session -> check reply -> page active -> ghi lại session), so sánh:
+- sync:  helper cache_* dùng client Redis đồng bộ (mỗi lệnh chặn cả event loop)
+- async: helper async_* (event loop vẫn phục vụ request khác trong lúc chờ Redis)
+- batch: async_get_session_cache_bundle (session + check reply + page active trong 1 MGET)
+
+Độ trễ event loop = thời gian 1 tác vụ sleep(interval) thức dậy muộn hơn dự kiến,
+cũng là thời gian mọi request khác (websocket, webhook) bị treo.
+L1 cache không bật trong script này (không chạy invalidation listener) -> mọi lệnh đều tới Redis.
+
+Chạy (cần Redis):
+    python benchmark_event_loop_lag.py --chats 200 --rounds 20
+    REDIS_URL=redis://remote-host:6379/0 python benchmark_event_loop_lag.py   (Redis qua mạng)
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from config.redis_cache import redis_cache
+from helper.help_redis import (
+    get_cached_session_data,
+    cache_session_data,
+    get_cached_check_reply_result,
+    get_cached_page_active_status,
+    async_get_cached_session_data,
+    async_cache_session_data,
+    async_get_cached_check_reply_result,
+    async_get_cached_page_active_status,
+    async_get_session_cache_bundle,
+    get_session_cache_key,
+    get_check_reply_cache_key,
+    get_page_active_cache_key
+)
+
+# session_id giả, không đụng dữ liệu thật
+SESSION_ID_START = 980000000
+PAGE_ID = "benchmark-page"
+
+
+def session_data(session_id: int) -> dict:
+    return {
+        "id": session_id,
+        "name": f"F-{session_id}",
+        "status": "true",
+        "channel": "facebook",
+        "page_id": PAGE_ID,
+        "current_receiver": "Bot",
+        "previous_receiver": None,
+        "time": None
+    }
+
+
+async def sync_chat(session_id: int):
+    get_cached_session_data(session_id)
+    get_cached_check_reply_result(session_id)
+    get_cached_page_active_status("facebook", PAGE_ID)
+    cache_session_data(session_id, session_data(session_id))
+
+
+async def async_chat(session_id: int):
+    await async_get_cached_session_data(session_id)
+    await async_get_cached_check_reply_result(session_id)
+    await async_get_cached_page_active_status("facebook", PAGE_ID)
+    await async_cache_session_data(session_id, session_data(session_id))
+
+
+async def batch_chat(session_id: int):
+    await async_get_session_cache_bundle(session_id, "facebook", PAGE_ID)
+    await async_cache_session_data(session_id, session_data(session_id))
+
+
+async def measure(chat, chats: int, rounds: int, interval: float) -> dict:
+    lags = []
+    running = True
+
+    async def monitor():
+        while running:
+            expected = time.perf_counter() + interval
+            await asyncio.sleep(interval)
+            lags.append(max(0.0, time.perf_counter() - expected) * 1000)
+
+    monitor_task = asyncio.create_task(monitor())
+    started = time.perf_counter()
+    for _ in range(rounds):
+        await asyncio.gather(*[chat(SESSION_ID_START + i) for i in range(chats)])
+        # Nhường event loop giữa các đợt (giống request đến liên tục)
+        await asyncio.sleep(0)
+    elapsed = time.perf_counter() - started
+    running = False
+    await monitor_task
+
+    lags = np.asarray(lags or [0.0])
+    return {
+        "total_s": elapsed,
+        "chats_per_s": chats * rounds / elapsed,
+        "lag_p50_ms": float(np.percentile(lags, 50)),
+        "lag_p99_ms": float(np.percentile(lags, 99)),
+        "lag_max_ms": float(lags.max()),
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Benchmark độ trễ event loop: helper cache sync vs async")
+    parser.add_argument("--chats", type=int, default=200, help="Số cuộc chat đồng thời mỗi đợt")
+    parser.add_argument("--rounds", type=int, default=20)
+    parser.add_argument("--interval-ms", type=float, default=5)
+    args = parser.parse_args()
+
+    if await redis_cache.get_async_client() is None or redis_cache.get_sync_client() is None:
+        print("Redis không chạy")
+        return
+
+    keys = [get_page_active_cache_key("facebook", PAGE_ID)] + [
+        key
+        for i in range(args.chats)
+        for key in (get_session_cache_key(SESSION_ID_START + i), get_check_reply_cache_key(SESSION_ID_START + i))
+    ]
+
+    results = {}
+    try:
+        for name, chat in (("sync", sync_chat), ("async", async_chat), ("batch", batch_chat)):
+            await measure(chat, args.chats, 1, args.interval_ms / 1000)  # warmup kết nối
+            results[name] = await measure(chat, args.chats, args.rounds, args.interval_ms / 1000)
+    finally:
+        await (await redis_cache.get_async_client()).delete(*keys)
+
+    print(f"\n{args.chats} chat đồng thời x {args.rounds} đợt, mỗi chat 4 lệnh Redis (batch: 2)")
+    print(f"{'mode':>6} | {'chat/s':>8} | {'lag p50 ms':>10} | {'lag p99 ms':>10} | {'lag max ms':>10}")
+    print("-" * 58)
+    for name, r in results.items():
+        print(
+            f"{name:>6} | {r['chats_per_s']:>8.0f} | {r['lag_p50_ms']:>10.2f} | "
+            f"{r['lag_p99_ms']:>10.2f} | {r['lag_max_ms']:>10.2f}"
+        )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,138 @@
+"""
+BM25 index (lexical) trên cùng tập chunk với ChromaDB
+- Bắt được các token chính xác mà vector search hay bỏ sót: mã biểu mẫu (CC01),
+  số nghị định (100/2015/NĐ-CP), mức phí (70.000)...
+- Hiểu tiếng Việt có dấu / không dấu: mỗi token được index cả dạng gốc và dạng bỏ dấu
+- Cập nhật tăng dần qua add_chunks / delete_chunks
+"""
+
+import math
+import re
+import unicodedata
+from collections import Counter, defaultdict
+from typing import Callable, Dict, List, Optional, Tuple
+
+_WORD = re.compile(r"\w+", re.UNICODE)
+# Token ghép: số hiệu văn bản, mức phí, mã có dấu nối (100/2015/nđ-cp, 70.000, cc-01)
+_COMPOUND = re.compile(r"\w+(?:[./-]\w+)+", re.UNICODE)
+
+
+def fold_diacritics(text: str) -> str:
+    """Bỏ dấu tiếng Việt: "thủ tục" -> "thu tuc", "đ" -> "d" """
+    text = text.replace("đ", "d").replace("Đ", "D")
+    decomposed = unicodedata.normalize("NFD", text)
+    return "".join(ch for ch in decomposed if unicodedata.category(ch) != "Mn")
+
+
+def tokenize(text: str) -> List[str]:
+    text = unicodedata.normalize("NFC", text or "").lower()
+    tokens = _WORD.findall(text) + _COMPOUND.findall(text)
+    folded = [fold_diacritics(token) for token in tokens]
+    return tokens + [token for token, original in zip(folded, tokens) if token != original]
+
+
+class BM25Index:
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self._reset()
+
+    def _reset(self) -> None:
+        self.built = False
+        self._docs: Dict[str, Tuple[str, dict, int]] = {}       # id -> (text, metadata, length)
+        self._postings: Dict[str, Dict[str, int]] = defaultdict(dict)  # token -> {id: tf}
+        self._doc_tokens: Dict[str, List[str]] = {}              # id -> token phân biệt (để xóa)
+        self._by_knowledge: Dict[str, set] = defaultdict(set)    # knowledge_id -> {id}
+        self._total_length = 0
+
+    def __len__(self) -> int:
+        return len(self._docs)
+
+    # ================== CẬP NHẬT ==================
+    def add(self, doc_id: str, text: str, metadata: Optional[dict] = None) -> None:
+        if doc_id in self._docs:
+            self.remove(doc_id)
+
+        metadata = metadata or {}
+        tf = Counter(tokenize(text))
+        length = sum(tf.values())
+
+        self._docs[doc_id] = (text, metadata, length)
+        self._doc_tokens[doc_id] = list(tf)
+        for token, count in tf.items():
+            self._postings[token][doc_id] = count
+        if metadata.get("knowledge_id") is not None:
+            self._by_knowledge[str(metadata["knowledge_id"])].add(doc_id)
+        self._total_length += length
+
+    def remove(self, doc_id: str) -> None:
+        doc = self._docs.pop(doc_id, None)
+        if doc is None:
+            return
+        _, metadata, length = doc
+        for token in self._doc_tokens.pop(doc_id, []):
+            postings = self._postings.get(token)
+            if postings is not None:
+                postings.pop(doc_id, None)
+                if not postings:
+                    del self._postings[token]
+        knowledge_id = metadata.get("knowledge_id")
+        if knowledge_id is not None:
+            self._by_knowledge[str(knowledge_id)].discard(doc_id)
+        self._total_length -= length
+
+    def remove_knowledge(self, knowledge_id: str) -> None:
+        for doc_id in list(self._by_knowledge.pop(str(knowledge_id), ())):
+            self.remove(doc_id)
+
+    def update_metadata(self, knowledge_id: str, updates: dict) -> None:
+        for doc_id in self._by_knowledge.get(str(knowledge_id), ()):
+            text, metadata, length = self._docs[doc_id]
+            self._docs[doc_id] = (text, {**metadata, **updates}, length)
+
+    def rebuild(self, ids: List[str], documents: List[str], metadatas: List[dict]) -> None:
+        self._reset()
+        for doc_id, text, metadata in zip(ids, documents, metadatas):
+            self.add(doc_id, text or "", metadata or {})
+        self.built = True
+
+    # ================== TÌM KIẾM ==================
+    def search(
+        self,
+        query: str,
+        top_k: int,
+        metadata_filter: Optional[Callable[[dict], bool]] = None
+    ) -> List[Tuple[str, float]]:
+        if not self._docs:
+            return []
+
+        n_docs = len(self._docs)
+        avg_length = self._total_length / n_docs or 1.0
+        scores: Dict[str, float] = defaultdict(float)
+
+        for token in set(tokenize(query)):
+            postings = self._postings.get(token)
+            if not postings:
+                continue
+            idf = math.log(1 + (n_docs - len(postings) + 0.5) / (len(postings) + 0.5))
+            for doc_id, tf in postings.items():
+                _, metadata, length = self._docs[doc_id]
+                if metadata_filter is not None and not metadata_filter(metadata):
+                    continue
+                norm = tf + self.k1 * (1 - self.b + self.b * length / avg_length)
+                scores[doc_id] += idf * tf * (self.k1 + 1) / norm
+
+        return sorted(scores.items(), key=lambda item: item[1], reverse=True)[:top_k]
+
+    def get(self, doc_id: str) -> Optional[Tuple[str, dict]]:
+        doc = self._docs.get(doc_id)
+        return (doc[0], doc[1]) if doc else None
+
+
+def reciprocal_rank_fusion(rankings: List[List[str]], k: int = 60) -> List[Tuple[str, float]]:
+    """Gộp nhiều danh sách xếp hạng: score = sum(1 / (k + rank))"""
+    scores: Dict[str, float] = defaultdict(float)
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking, start=1):
+            scores[doc_id] += 1.0 / (k + rank)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
@@ -1,11 +1,47 @@
+import asyncio
+import json
 import chromadb
 from chromadb.config import Settings
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from functools import partial
 import logging
 import os
-from typing import List, Dict, Optional
+import time
+from typing import Any, Callable, List, Dict, Optional, Sequence
+from config.bm25_index import BM25Index, reciprocal_rank_fusion
+from config.redis_cache import async_cache_eval
 
 logger = logging.getLogger(__name__)
 
+# "hybrid" = vector + BM25 (gộp bằng reciprocal rank fusion), "vector" = chỉ cosine
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "hybrid")
+# Số ứng viên mỗi nhánh lấy ra trước khi fusion = top_k * hệ số này
+HYBRID_CANDIDATE_MULTIPLIER = int(os.getenv("HYBRID_CANDIDATE_MULTIPLIER", 3))
+RRF_K = int(os.getenv("RRF_K", 60))
+
+# BM25 index theo collection (build lazy từ ChromaDB ở lần search đầu tiên)
+# Đồng bộ giữa các worker qua Redis:
+# - bm25_version:{collection}  số lần thay đổi chunk của collection (INCR)
+# - bm25_changes:{collection}  LIST "{version}|{json}" các chunk id / knowledge_id đã đổi,
+#   giữ BM25_CHANGE_LOG_SIZE phần tử cuối -> worker khác chỉ đọc lại từ Chroma phần đã đổi,
+#   tụt quá xa (log đã bị cắt) mới build lại toàn bộ
+bm25_indexes: Dict[str, BM25Index] = {}
+# Version mà index của worker này đã áp dụng tới (None = build khi Redis không dùng được)
+bm25_versions: Dict[str, Optional[int]] = {}
+_bm25_synced_at: Dict[str, float] = {}
+_bm25_locks: Dict[str, asyncio.Lock] = {}
+# Kiểm tra thay đổi từ worker khác tối đa 1 lần / khoảng này (giây) mỗi collection
+BM25_SYNC_INTERVAL = float(os.getenv("BM25_SYNC_INTERVAL", 1.0))
+BM25_CHANGE_LOG_SIZE = int(os.getenv("BM25_CHANGE_LOG_SIZE", 1000))
+
+# Chroma client là sync -> mọi thao tác I/O chạy trên thread pool riêng, không chặn event loop
+CHROMA_THREADS = int(os.getenv("CHROMA_THREADS", 4))
+_chroma_executor = ThreadPoolExecutor(max_workers=CHROMA_THREADS, thread_name_prefix="chroma")
+
+# Cache handle collection: tránh gọi get_or_create_collection mỗi lần thao tác
+_collections: Dict[str, Any] = {}
+
 
 
 # Khởi tạo ChromaDB client
@@ -29,24 +65,259 @@ except Exception as e:
     raise
 
 
-def get_or_create_collection(collection_name: str = "document_chunks"):
+# ================== ACTIVE INDEX ==================
+# Collection đang phục vụ search + model embedding đã tạo ra nó.
+# Đổi model embedding -> re-index sang collection mới (services/reindex_service.py),
+# xong mới chuyển active sang collection mới (ghi file atomic, mọi worker cùng đọc).
+DEFAULT_COLLECTION = "document_chunks"
+ACTIVE_INDEX_PATH = os.path.join(CHROMA_DATA_PATH, "active_index.json")
+
+_active_index: Dict[str, Any] = {}
+_active_index_mtime: Optional[float] = None
+
+
+def get_active_index() -> Dict[str, Any]:
+    """{"collection", "embedding_model_detail_id", "embedding_model", "switched_at"} (đọc lại khi file đổi)"""
+    global _active_index, _active_index_mtime
+    try:
+        mtime = os.stat(ACTIVE_INDEX_PATH).st_mtime
+    except FileNotFoundError:
+        return {"collection": DEFAULT_COLLECTION, "embedding_model_detail_id": None, "embedding_model": None}
+
+    if mtime != _active_index_mtime:
+        try:
+            with open(ACTIVE_INDEX_PATH, encoding="utf-8") as f:
+                _active_index = json.load(f)
+            _active_index_mtime = mtime
+        except (OSError, json.JSONDecodeError) as e:
+            logger.error(f"❌ Không đọc được {ACTIVE_INDEX_PATH}: {e}")
+    return {"collection": DEFAULT_COLLECTION, **_active_index}
+
+
+def get_active_collection_name() -> str:
+    return get_active_index().get("collection") or DEFAULT_COLLECTION
+
+
+def write_json_atomic(path: str, data: Dict) -> None:
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def set_active_index(collection_name: str, embedding_model_detail_id: Optional[int], embedding_model: Optional[str]) -> Dict:
+    """Chuyển search sang collection khác (atomic: os.replace)"""
+    state = {
+        "collection": collection_name,
+        "embedding_model_detail_id": embedding_model_detail_id,
+        "embedding_model": embedding_model,
+        "switched_at": datetime.now().isoformat(),
+    }
+    write_json_atomic(ACTIVE_INDEX_PATH, state)
+    logger.info(f"✅ Active index -> '{collection_name}' (embedding_model_detail_id={embedding_model_detail_id})")
+    return state
+
+
+def list_collection_names() -> List[str]:
+    return [c if isinstance(c, str) else c.name for c in chroma_client.list_collections()]
+
+
+def drop_collection(collection_name: str) -> None:
+    if collection_name == get_active_collection_name():
+        raise ValueError(f"Không thể xóa collection đang active: {collection_name}")
+    chroma_client.delete_collection(collection_name)
+    reset_collection_cache(collection_name)
+    bm25_indexes.pop(collection_name, None)
+    bm25_versions.pop(collection_name, None)
+    _bm25_synced_at.pop(collection_name, None)
+    logger.info(f"🗑️ Đã xóa collection '{collection_name}'")
+
+
+def get_or_create_collection(collection_name: Optional[str] = None):
+
+    collection_name = collection_name or get_active_collection_name()
+    collection = _collections.get(collection_name)
+    if collection is not None:
+        return collection
 
     try:
         collection = chroma_client.get_or_create_collection(
             name=collection_name,
             metadata={"hnsw:space": "cosine"}  
         )
+        _collections[collection_name] = collection
         return collection
     except Exception as e:
         logger.error(f"Error getting/creating collection: {str(e)}")
         raise
 
 
+def reset_collection_cache(collection_name: Optional[str] = None) -> None:
+    """Bỏ handle đã cache (gọi sau khi xóa / tạo lại collection)"""
+    if collection_name is None:
+        _collections.clear()
+    else:
+        _collections.pop(collection_name, None)
+
+
+async def run_in_chroma(func: Callable, *args, **kwargs):
+    """Chạy 1 thao tác ChromaDB (sync) trên thread pool của vector store"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_chroma_executor, partial(func, *args, **kwargs))
+
+
+def build_chunk_filter(category_ids: Optional[List[int]] = None) -> Dict:
+    """Filter metadata cho query: chỉ lấy chunk của tài liệu đang active (+ theo category nếu có)"""
+    conditions = [{"is_active": True}]
+    if category_ids:
+        conditions.append({"category_id": {"$in": [int(c) for c in category_ids]}})
+    return conditions[0] if len(conditions) == 1 else {"$and": conditions}
+
+
+def match_chunk_filter(metadata: Dict, category_ids: Optional[List[int]] = None) -> bool:
+    """Cùng điều kiện với build_chunk_filter, dùng cho BM25 index trong RAM"""
+    if metadata.get("is_active") is not True:
+        return False
+    return not category_ids or metadata.get("category_id") in set(category_ids)
+
+
+def bm25_version_key(collection_name: str) -> str:
+    return f"bm25_version:{collection_name}"
+
+
+def bm25_changes_key(collection_name: str) -> str:
+    return f"bm25_changes:{collection_name}"
+
+
+# KEYS: version_key, changes_key; ARGV: json thay đổi, số phần tử log giữ lại
+# Trả về version mới
+BM25_RECORD_SCRIPT = """
+local version = redis.call('INCR', KEYS[1])
+redis.call('RPUSH', KEYS[2], version .. '|' .. ARGV[1])
+redis.call('LTRIM', KEYS[2], -tonumber(ARGV[2]), -1)
+return version
+"""
+
+# KEYS: version_key, changes_key; ARGV: version worker đã áp dụng
+# Trả về {version hiện tại, các thay đổi sau version đã áp dụng...}; log đã bị cắt thì thay đổi
+# đầu tiên không phải applied + 1 -> worker tự build lại toàn bộ
+BM25_CHANGES_SCRIPT = """
+local version = tonumber(redis.call('GET', KEYS[1]) or '0')
+local applied = tonumber(ARGV[1])
+local result = {version}
+if applied < 0 or version <= applied then
+    return result
+end
+local changes = redis.call('LRANGE', KEYS[2], applied - version, -1)
+for i = 1, #changes do
+    result[i + 1] = changes[i]
+end
+return result
+"""
+
+
+async def record_bm25_change(
+    collection_name: str,
+    ids: Sequence[str] = (),
+    knowledge_ids: Sequence[str] = ()
+) -> None:
+    """
+    Ghi lại chunk đã đổi cho worker khác (gọi sau khi đã ghi Chroma + cập nhật index của worker này)
+    Worker khác đọc lại từ Chroma đúng các chunk / tài liệu này thay vì build lại toàn bộ
+    """
+    change = json.dumps({"ids": list(ids), "knowledge_ids": [str(kid) for kid in knowledge_ids]})
+    version = await async_cache_eval(
+        BM25_RECORD_SCRIPT,
+        keys=[bm25_version_key(collection_name), bm25_changes_key(collection_name)],
+        args=[change, BM25_CHANGE_LOG_SIZE]
+    )
+    # Index của worker này đã có thay đổi vừa ghi: nếu trước đó đã đồng bộ tới version - 1 thì không cần đọc lại
+    if version is not None and bm25_versions.get(collection_name) == int(version) - 1:
+        bm25_versions[collection_name] = int(version)
+
+
+async def _apply_bm25_changes(collection, index: BM25Index, changes: List[str]) -> None:
+    """Đọc lại từ Chroma các chunk / tài liệu đã đổi (thêm, sửa, xóa, đổi metadata đều xử lý như nhau)"""
+    ids, knowledge_ids = set(), set()
+    for change in changes:
+        data = json.loads(change.split("|", 1)[1])
+        ids.update(data.get("ids") or [])
+        knowledge_ids.update(data.get("knowledge_ids") or [])
+
+    for knowledge_id in knowledge_ids:
+        index.remove_knowledge(knowledge_id)
+    for chunk_id in ids:
+        index.remove(chunk_id)
+
+    batches = [{"ids": batch} for batch in _batched(sorted(ids))]
+    batches += [
+        {"where": {"knowledge_id": batch[0]} if len(batch) == 1 else {"knowledge_id": {"$in": batch}}}
+        for batch in _batched(sorted(knowledge_ids))
+    ]
+    for query in batches:
+        results = await run_in_chroma(collection.get, include=["documents", "metadatas"], **query)
+        for chunk_id, document, metadata in zip(results["ids"], results["documents"], results["metadatas"]):
+            index.add(chunk_id, document or "", metadata or {})
+
+
+def _batched(items: List[str]) -> List[List[str]]:
+    return [items[start:start + DELETE_BULK_MAX_IDS] for start in range(0, len(items), DELETE_BULK_MAX_IDS)]
+
+
+async def _sync_bm25_index(collection, collection_name: str, index: BM25Index) -> None:
+    applied = bm25_versions.get(collection_name)
+    result = await async_cache_eval(
+        BM25_CHANGES_SCRIPT,
+        keys=[bm25_version_key(collection_name), bm25_changes_key(collection_name)],
+        args=[applied if index.built and applied is not None else -1]
+    )
+
+    if index.built:
+        if result is None:
+            # Redis không dùng được: chỉ phát hiện được thay đổi làm lệch số chunk
+            if len(index) == await run_in_chroma(collection.count):
+                return
+        else:
+            version, changes = int(result[0]), list(result[1:])
+            if applied is not None and version == applied:
+                return
+            contiguous = bool(changes) and int(changes[0].split("|", 1)[0]) == (applied or 0) + 1
+            if applied is not None and version > applied and contiguous:
+                await _apply_bm25_changes(collection, index, changes)
+                bm25_versions[collection_name] = version
+                logger.info(f"🔄 BM25 index '{collection_name}': áp dụng {len(changes)} thay đổi (v{version})")
+                return
+
+    # Build lần đầu / tụt quá xa log thay đổi / version bị reset: build lại toàn bộ
+    # (version đọc trước khi lấy dữ liệu: thay đổi xảy ra trong lúc build sẽ được áp dụng lần sau)
+    results = await run_in_chroma(collection.get, include=["documents", "metadatas"])
+    index.rebuild(results["ids"], results["documents"], results["metadatas"])
+    bm25_versions[collection_name] = int(result[0]) if result is not None else None
+    logger.info(f"✅ Đã build BM25 index cho '{collection_name}' ({len(index)} chunks)")
+
+
+async def get_bm25_index(collection, collection_name: str) -> BM25Index:
+    index = bm25_indexes.setdefault(collection_name, BM25Index())
+    if index.built and time.monotonic() - _bm25_synced_at.get(collection_name, 0) < BM25_SYNC_INTERVAL:
+        return index
+
+    # 1 coroutine đồng bộ / build mỗi collection, các request khác chờ rồi dùng luôn kết quả
+    async with _bm25_locks.setdefault(collection_name, asyncio.Lock()):
+        if index.built and time.monotonic() - _bm25_synced_at.get(collection_name, 0) < BM25_SYNC_INTERVAL:
+            return index
+        await _sync_bm25_index(collection, collection_name, index)
+        _bm25_synced_at[collection_name] = time.monotonic()
+    return index
+
+
 async def add_chunks(
     chunks: List[Dict],
-    collection_name: str = "document_chunks"
+    collection_name: Optional[str] = None
 ) -> bool:
     try:
+        collection_name = collection_name or get_active_collection_name()
         collection = get_or_create_collection(collection_name)
 
         ids = [chunk['id'] for chunk in chunks]
@@ -54,12 +325,20 @@ async def add_chunks(
         embeddings = [chunk['embedding'] for chunk in chunks]
         metadatas = [chunk.get('metadata', {}) for chunk in chunks]
 
-        collection.add(
+        await run_in_chroma(
+            collection.add,
             ids=ids,
-            documents=documents,            embeddings=embeddings,
+            documents=documents,
+            embeddings=embeddings,
             metadatas=metadatas
         )
 
+        index = bm25_indexes.get(collection_name)
+        if index is not None and index.built:
+            for chunk_id, document, metadata in zip(ids, documents, metadatas):
+                index.add(chunk_id, document, metadata)
+        await record_bm25_change(collection_name, ids=ids)
+
         logger.info(f"✅ Đã thêm {len(ids)} documents vào ChromaDB collection '{collection_name}'")
         return True
 
@@ -74,20 +353,20 @@ async def add_chunks(
     
 async def delete_chunks(
     knowledge_id: str,
-    collection_name: str = "document_chunks"
+    collection_name: Optional[str] = None
 ) -> bool:
 
     try:
+        collection_name = collection_name or get_active_collection_name()
         collection = get_or_create_collection(collection_name)
 
-        results = collection.get(where={"knowledge_id": knowledge_id})
-
-        if results and results['ids']:
-            collection.delete(ids=results['ids'])
-            logger.info(f"✅ Đã xóa {len(results['ids'])} documents của knowledge_id='{knowledge_id}' từ ChromaDB")
-        else:
-            logger.info(f"ℹ️ Không tìm thấy documents nào với knowledge_id='{knowledge_id}'")
-        
+        # Xóa trực tiếp theo where phía Chroma: 1 lần gọi, không cần get ids trước
+        await run_in_chroma(collection.delete, where={"knowledge_id": knowledge_id})
+        index = bm25_indexes.get(collection_name)
+        if index is not None:
+            index.remove_knowledge(knowledge_id)
+        await record_bm25_change(collection_name, knowledge_ids=[knowledge_id])
+        logger.info(f"✅ Đã xóa documents của knowledge_id='{knowledge_id}' từ ChromaDB")
 
         return True
 
@@ -96,12 +375,111 @@ async def delete_chunks(
         return False
 
 
+# Giới hạn số phần tử trong 1 filter $in (tránh vượt giới hạn tham số SQL của SQLite)
+DELETE_BULK_MAX_IDS = 500
+
+
+async def delete_chunks_bulk(
+    knowledge_ids: List[str],
+    collection_name: Optional[str] = None
+) -> bool:
+    """Xóa chunk của nhiều tài liệu bằng 1 lệnh delete where knowledge_id $in [...]"""
+    knowledge_ids = list(dict.fromkeys(str(kid) for kid in knowledge_ids))
+    if not knowledge_ids:
+        return True
+
+    try:
+        collection_name = collection_name or get_active_collection_name()
+        collection = get_or_create_collection(collection_name)
+
+        for start in range(0, len(knowledge_ids), DELETE_BULK_MAX_IDS):
+            batch = knowledge_ids[start:start + DELETE_BULK_MAX_IDS]
+            where = {"knowledge_id": batch[0]} if len(batch) == 1 else {"knowledge_id": {"$in": batch}}
+            await run_in_chroma(collection.delete, where=where)
+
+        index = bm25_indexes.get(collection_name)
+        if index is not None:
+            for knowledge_id in knowledge_ids:
+                index.remove_knowledge(knowledge_id)
+        await record_bm25_change(collection_name, knowledge_ids=knowledge_ids)
+
+        logger.info(f"✅ Đã xóa chunks của {len(knowledge_ids)} tài liệu từ ChromaDB")
+        return True
+
+    except Exception as e:
+        logger.error(f"❌ Lỗi khi xóa hàng loạt documents từ ChromaDB: {str(e)}")
+        return False
+
+
+async def get_knowledge_chunks(
+    knowledge_id: str,
+    include: Sequence[str] = ("metadatas", "embeddings"),
+    collection_name: Optional[str] = None
+) -> Dict:
+    """Lấy toàn bộ chunk (id + metadata/embedding) của 1 tài liệu"""
+    collection_name = collection_name or get_active_collection_name()
+    collection = get_or_create_collection(collection_name)
+    return await run_in_chroma(collection.get, where={"knowledge_id": knowledge_id}, include=list(include))
+
+
+async def delete_chunk_ids(
+    ids: List[str],
+    collection_name: Optional[str] = None
+) -> int:
+    """Xóa các chunk theo id (dùng khi cập nhật tăng dần 1 tài liệu)"""
+    if not ids:
+        return 0
+    collection_name = collection_name or get_active_collection_name()
+    collection = get_or_create_collection(collection_name)
+    await run_in_chroma(collection.delete, ids=list(ids))
+    index = bm25_indexes.get(collection_name)
+    if index is not None:
+        for chunk_id in ids:
+            index.remove(chunk_id)
+    await record_bm25_change(collection_name, ids=ids)
+    return len(ids)
+
+
+async def update_chunks_metadata(
+    knowledge_id: str,
+    updates: Dict,
+    collection_name: Optional[str] = None
+) -> int:
+    """Cập nhật metadata (vd: is_active, category_id) cho toàn bộ chunk của 1 tài liệu, không embed lại"""
+    try:
+        collection_name = collection_name or get_active_collection_name()
+        collection = get_or_create_collection(collection_name)
+
+        results = await run_in_chroma(collection.get, where={"knowledge_id": knowledge_id}, include=["metadatas"])
+        if not results or not results['ids']:
+            return 0
+
+        await run_in_chroma(
+            collection.update,
+            ids=results['ids'],
+            metadatas=[{**(meta or {}), **updates} for meta in results['metadatas']]
+        )
+
+        index = bm25_indexes.get(collection_name)
+        if index is not None:
+            index.update_metadata(knowledge_id, updates)
+        await record_bm25_change(collection_name, knowledge_ids=[knowledge_id])
+
+        logger.info(f"✅ Đã cập nhật metadata {updates} cho {len(results['ids'])} chunks của knowledge_id='{knowledge_id}'")
+        return len(results['ids'])
+
+    except Exception as e:
+        logger.error(f"❌ Lỗi khi cập nhật metadata chunks: {str(e)}")
+        raise
+
+
 async def update_chunks(
     knowledge_id: str,
     new_chunks: List[Dict],
-    collection_name: str = "document_chunks"
+    collection_name: Optional[str] = None
 ) -> bool:
     try:
+        collection_name = collection_name or get_active_collection_name()
         # Xóa các chunk cũ
         await delete_chunks(knowledge_id, collection_name)
         # Thêm các chunk mới
@@ -113,9 +491,10 @@ async def update_chunks(
         raise
 
 
-def list_chunks(collection_name: str = "document_chunks") -> List[Dict]:
+def list_chunks(collection_name: Optional[str] = None) -> List[Dict]:
    
     try:
+        collection_name = collection_name or get_active_collection_name()
         collection = get_or_create_collection(collection_name)
         results = collection.get(include=["documents", "metadatas"])
         return results
@@ -124,21 +503,61 @@ def list_chunks(collection_name: str = "document_chunks") -> List[Dict]:
         raise
 
 
+async def async_list_chunks(collection_name: Optional[str] = None) -> Dict:
+    return await run_in_chroma(list_chunks, collection_name)
+
+
+async def warmup_collections(collection_names: Optional[Sequence[str]] = None) -> None:
+    """
+    Load sẵn HNSW index (và BM25 index nếu dùng hybrid) lúc startup
+    -> query đầu tiên sau khi deploy không phải chờ đọc index từ đĩa
+    """
+    for collection_name in collection_names or [get_active_collection_name()]:
+        try:
+            collection = await run_in_chroma(get_or_create_collection, collection_name)
+            sample = await run_in_chroma(collection.peek, 1)
+            embeddings = sample.get("embeddings") if sample else None
+            if embeddings is None or len(embeddings) == 0:
+                continue
+
+            await run_in_chroma(
+                collection.query,
+                query_embeddings=[list(embeddings[0])],
+                n_results=1,
+                include=[]
+            )
+            if RETRIEVAL_MODE == "hybrid":
+                await get_bm25_index(collection, collection_name)
+            logger.info(f"✅ Đã warmup collection '{collection_name}'")
+        except Exception as e:
+            logger.warning(f"⚠️ Warmup collection '{collection_name}' failed: {e}")
+
+
 
 
 
 async def search_chunks(
     query_embedding: List[float],
     top_k: int,
-    collection_name: str = "document_chunks"
+    collection_name: Optional[str] = None,
+    query_text: Optional[str] = None,
+    mode: Optional[str] = None,
+    category_ids: Optional[List[int]] = None
 ) -> List[Dict]:
     
     try:
+        collection_name = collection_name or get_active_collection_name()
         collection = get_or_create_collection(collection_name)
+        mode = mode or RETRIEVAL_MODE
+        hybrid = mode == "hybrid" and bool(query_text)
+        n_candidates = top_k * HYBRID_CANDIDATE_MULTIPLIER if hybrid else top_k
 
-        results = collection.query(
+        # Filter ngay trong query -> tài liệu bị tắt không chiếm slot top-k
+        results = await run_in_chroma(
+            collection.query,
             query_embeddings=[query_embedding],
-            n_results=top_k,
+            n_results=n_candidates,
+            where=build_chunk_filter(category_ids),
             include=["documents", "distances", "metadatas"]
         )
 
@@ -146,12 +565,36 @@ async def search_chunks(
         if results and results['documents'] and results['documents'][0]:
             for idx in range(len(results['documents'][0])):
                 formatted_results.append({
+                    "id": results['ids'][0][idx],
                     "text": results['documents'][0][idx],
                     "distance": results['distances'][0][idx] if results['distances'] else None,
                     "metadata": results['metadatas'][0][idx] if results['metadatas'] else {}
                 })
 
-        return formatted_results
+        if not hybrid:
+            return formatted_results
+
+        # Hybrid: gộp xếp hạng vector + BM25 bằng reciprocal rank fusion
+        index = await get_bm25_index(collection, collection_name)
+        lexical_ids = [
+            doc_id for doc_id, _ in index.search(
+                query_text,
+                n_candidates,
+                metadata_filter=lambda metadata: match_chunk_filter(metadata, category_ids)
+            )
+        ]
+        by_id = {item["id"]: item for item in formatted_results}
+        fused = reciprocal_rank_fusion([list(by_id), lexical_ids], k=RRF_K)
+
+        hybrid_results = []
+        for doc_id, score in fused[:top_k]:
+            item = by_id.get(doc_id)
+            if item is None:
+                text, metadata = index.get(doc_id)
+                item = {"id": doc_id, "text": text, "distance": None, "metadata": metadata}
+            hybrid_results.append({**item, "score": score})
+
+        return hybrid_results
 
     except Exception as e:
         logger.error(f"❌ Lỗi khi search với metadata trong ChromaDB: {str(e)}")
@@ -0,0 +1,123 @@
+"""
+Cache 2 tầng cho embedding của câu hỏi
+- L1: LRU trong process (không tốn round trip)
+- L2: Redis (dùng chung giữa các worker) thông qua RedisCache
+Key = câu hỏi đã chuẩn hoá + tên model embedding
+"""
+
+import base64
+import hashlib
+import logging
+import os
+import re
+import unicodedata
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from config.redis_cache import redis_cache
+from config.redis_codec import redis_codec
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_query(text: str) -> str:
+    """Chuẩn hoá câu hỏi: NFC, chữ thường, gộp khoảng trắng, bỏ dấu câu cuối câu"""
+    text = unicodedata.normalize("NFC", text or "")
+    text = re.sub(r"\s+", " ", text.lower()).strip()
+    return text.rstrip(" ?!.…")
+
+
+def encode_vector(vector) -> str:
+    """Vector float32 -> base64 (gọn hơn ~4 lần so với JSON list float)"""
+    return base64.b64encode(np.asarray(vector, dtype=np.float32).tobytes()).decode("ascii")
+
+
+def decode_vector(data: str) -> np.ndarray:
+    return np.frombuffer(base64.b64decode(data), dtype=np.float32)
+
+
+class EmbeddingCache:
+    def __init__(self):
+        self.l1_max_size = int(os.getenv("EMBEDDING_CACHE_L1_SIZE", 2048))
+        self.ttl = int(os.getenv("EMBEDDING_CACHE_TTL", 7 * 86400))
+
+        self._l1: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._stats = {"l1_hits": 0, "l2_hits": 0, "misses": 0}
+
+    def build_key(self, query: str, model: str) -> str:
+        digest = hashlib.sha1(normalize_query(query).encode("utf-8")).hexdigest()
+        return f"embedding:{model}:{digest}"
+
+    # ================== L1 ==================
+    def _l1_get(self, key: str) -> Optional[np.ndarray]:
+        vector = self._l1.get(key)
+        if vector is not None:
+            self._l1.move_to_end(key)
+        return vector
+
+    def _l1_set(self, key: str, vector: np.ndarray) -> None:
+        self._l1[key] = vector
+        self._l1.move_to_end(key)
+        while len(self._l1) > self.l1_max_size:
+            self._l1.popitem(last=False)
+
+    # ================== PUBLIC API ==================
+    async def get(self, query: str, model: str) -> Optional[List[float]]:
+        key = self.build_key(query, model)
+
+        vector = self._l1_get(key)
+        if vector is not None:
+            self._stats["l1_hits"] += 1
+            return vector.tolist()
+
+        cached = await redis_cache.async_get(key)
+        try:
+            if isinstance(cached, np.ndarray) and cached.size:
+                # Codec f32: RedisCache trả về thẳng vector float32
+                vector = cached
+            elif isinstance(cached, dict) and cached.get("v"):
+                # Entry định dạng cũ (base64 trong JSON)
+                vector = decode_vector(cached["v"])
+            elif isinstance(cached, list) and cached:
+                # REDIS_CODECS không có embedding=f32: vector được ghi thành JSON list
+                vector = np.asarray(cached, dtype=np.float32)
+            else:
+                vector = None
+            if vector is not None:
+                self._l1_set(key, vector)
+                self._stats["l2_hits"] += 1
+                return vector.tolist()
+        except Exception as e:
+            logger.error(f"Error decoding cached embedding {key}: {e}")
+
+        self._stats["misses"] += 1
+        return None
+
+    async def set(self, query: str, model: str, vector: List[float]) -> None:
+        if not vector:
+            return
+
+        key = self.build_key(query, model)
+        array = np.asarray(vector, dtype=np.float32)
+        self._l1_set(key, array)
+        # Namespace "embedding" dùng codec f32 (bytes thô) trong RedisCache (không cấu hình f32 -> JSON list)
+        value = array if redis_codec.enabled else {"v": encode_vector(array), "d": int(array.shape[0])}
+        await redis_cache.async_set(key, value, ttl=self.ttl)
+
+    def stats(self) -> Dict:
+        total = sum(self._stats.values())
+        hits = self._stats["l1_hits"] + self._stats["l2_hits"]
+        return {
+            **self._stats,
+            "l1_size": len(self._l1),
+            "hit_ratio": round(hits / total, 4) if total else 0.0,
+        }
+
+    def clear_local(self) -> None:
+        self._l1.clear()
+
+
+# ================== SINGLETON ==================
+embedding_cache = EmbeddingCache()
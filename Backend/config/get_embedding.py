@@ -1,41 +1,90 @@
 import os
 import asyncio
-import google.generativeai as genai
-from typing import List, Union
-from openai import AsyncOpenAI
+import logging
+import random
+import time
+from google.ai import generativelanguage as glm
+from typing import Callable, List, Optional, Union
+from config.llm_clients import llm_clients
+from llm.key_health import report_key_result
+from llm.rate_limiter import acquire_key
+from llm.context_packer import count_tokens
 
 
+GEMINI_EMBEDDING_MODEL = "models/gemini-embedding-001"
+OPENAI_EMBEDDING_MODEL = "text-embedding-3-large"
+
+# Số chiều vector đầu ra (provider tự cắt ngắn, vd 768/1024/1536); 0 = giữ kích thước đầy đủ
+# Đổi giá trị này cần embed lại toàn bộ tài liệu (collection cũ có số chiều khác)
+EMBEDDING_DIMENSIONS = int(os.getenv("EMBEDDING_DIMENSIONS", 0)) or None
+
+# Giới hạn số text trong 1 request batchEmbedContents của Gemini
+GEMINI_EMBEDDING_MAX_BATCH = 100
+
+# Micro-batch cho embedding tài liệu lúc ingest
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", 64))
+EMBEDDING_BATCH_MAX_CHARS = int(os.getenv("EMBEDDING_BATCH_MAX_CHARS", 60000))
+EMBEDDING_MAX_CONCURRENCY = int(os.getenv("EMBEDDING_MAX_CONCURRENCY", 4))
+EMBEDDING_MAX_RETRIES = int(os.getenv("EMBEDDING_MAX_RETRIES", 3))
+
+logger = logging.getLogger(__name__)
+
+
+def resolve_embedding_model(embedding_model_name: str, dimensions: Optional[int] = EMBEDDING_DIMENSIONS) -> str:
+    """
+    Định danh model embedding thực tế từ tên LLMDetail ("gemini"/"gpt"), kèm số chiều nếu có
+    (dùng làm khóa cache / metadata -> vector khác số chiều không bao giờ bị dùng lẫn)
+    """
+    model = GEMINI_EMBEDDING_MODEL if "gemini" in (embedding_model_name or "").lower() else OPENAI_EMBEDDING_MODEL
+    return f"{model}@{dimensions}" if dimensions else model
+
 
 async def get_embedding_gemini(
     text_input: Union[str, List[str]], 
-    api_key: str
+    api_key: str,
+    dimensions: Optional[int] = EMBEDDING_DIMENSIONS
 ) -> Union[List[float], List[List[float]], None]:
     
    
     try:
-        genai.configure(api_key=api_key)
-        loop = asyncio.get_event_loop()
-
-        def embed_call():
-            return genai.embed_content(
-                model="models/gemini-embedding-001",
-                content=text_input
-            )
+        # Client riêng theo key -> các request dùng key khác nhau không giẫm lên nhau
+        client = llm_clients.get_gemini_client(api_key)
+        started_at = time.perf_counter()
+        # output_dimensionality: Gemini tự cắt ngắn vector (Matryoshka)
+        options = {"output_dimensionality": dimensions} if dimensions else {}
 
-        response = await loop.run_in_executor(None, embed_call)
-
-        embeddings = response.get("embedding")
-        if not embeddings:
-            return [] if isinstance(text_input, list) else []
-
-        
         if isinstance(text_input, str):
-            return list(embeddings)
-
-        return [list(vec) for vec in embeddings]
+            response = await client.embed_content(request=glm.EmbedContentRequest(
+                model=GEMINI_EMBEDDING_MODEL,
+                content=glm.Content(parts=[glm.Part(text=text_input)]),
+                **options
+            ))
+            report_key_result(api_key, ok=True, latency_ms=(time.perf_counter() - started_at) * 1000)
+            return list(response.embedding.values)
+
+        vectors = []
+        for start in range(0, len(text_input), GEMINI_EMBEDDING_MAX_BATCH):
+            batch = text_input[start:start + GEMINI_EMBEDDING_MAX_BATCH]
+            response = await client.batch_embed_contents(request=glm.BatchEmbedContentsRequest(
+                model=GEMINI_EMBEDDING_MODEL,
+                requests=[
+                    glm.EmbedContentRequest(
+                        model=GEMINI_EMBEDDING_MODEL,
+                        content=glm.Content(parts=[glm.Part(text=text)]),
+                        **options
+                    )
+                    for text in batch
+                ]
+            ))
+            vectors.extend(list(embedding.values) for embedding in response.embeddings)
+
+        # Batch ingest: không ghi latency (phụ thuộc kích thước batch)
+        report_key_result(api_key, ok=True)
+        return vectors
 
     except Exception as e:
         print(f"❌ Gemini embedding error: {e}")
+        report_key_result(api_key, ok=False, error=e)
         return [] if isinstance(text_input, list) else []
 
 
@@ -43,19 +92,28 @@ async def get_embedding_gemini(
 
 async def get_embedding_chatgpt(
     text_input: Union[str, List[str]],
-    api_key: str
+    api_key: str,
+    dimensions: Optional[int] = EMBEDDING_DIMENSIONS
 ) -> Union[List[float], List[List[float]]]:
 
   
     try:
-        client = AsyncOpenAI(api_key=api_key)
+        client = llm_clients.get_openai_client(api_key)
+        started_at = time.perf_counter()
 
+        # text-embedding-3-*: tham số dimensions -> API trả về vector đã cắt ngắn + chuẩn hóa
+        options = {"dimensions": dimensions} if dimensions else {}
         response = await client.embeddings.create(
-            model="text-embedding-3-large",
-            input=text_input
+            model=OPENAI_EMBEDDING_MODEL,
+            input=text_input,
+            **options
         )
 
         vectors = [list(item.embedding) for item in response.data]
+        report_key_result(
+            api_key, ok=True,
+            latency_ms=(time.perf_counter() - started_at) * 1000 if isinstance(text_input, str) else None
+        )
 
         # Single
         if isinstance(text_input, str):
@@ -66,4 +124,79 @@ async def get_embedding_chatgpt(
 
     except Exception as e:
         print(f"❌ ChatGPT embedding error: {e}")
-        return [] if isinstance(text_input, list) else []
\ No newline at end of file
+        report_key_result(api_key, ok=False, error=e)
+        return [] if isinstance(text_input, list) else []
+
+
+def split_micro_batches(texts: List[str], batch_size: int, max_batch_chars: int) -> List[List[str]]:
+    """Chia texts thành các batch giới hạn theo số lượng và tổng số ký tự (giữ nguyên thứ tự)"""
+    batches = []
+    current = []
+    current_chars = 0
+    for text in texts:
+        if current and (len(current) >= batch_size or current_chars + len(text) > max_batch_chars):
+            batches.append(current)
+            current = []
+            current_chars = 0
+        current.append(text)
+        current_chars += len(text)
+    if current:
+        batches.append(current)
+    return batches
+
+
+async def get_embeddings_batched(
+    texts: List[str],
+    api_keys: List[str],
+    embedding_model_name: str,
+    batch_size: int = EMBEDDING_BATCH_SIZE,
+    max_batch_chars: int = EMBEDDING_BATCH_MAX_CHARS,
+    max_concurrency: int = EMBEDDING_MAX_CONCURRENCY,
+    max_retries: int = EMBEDDING_MAX_RETRIES,
+    on_progress: Optional[Callable[[int, int], None]] = None
+) -> List[List[float]]:
+    """
+    Embedding nhiều chunk: chia micro-batch, chia đều các batch cho tất cả key embedding,
+    chạy song song có giới hạn, retry + backoff theo từng batch.
+    Mỗi lần gọi trừ 1 request + số token của batch vào bucket embedding dùng chung (rate_limiter).
+    Kết quả giữ đúng thứ tự của texts. Raise Exception nếu 1 batch thất bại sau khi retry.
+    """
+    if not texts:
+        return []
+    if not api_keys:
+        raise ValueError("Không có API key embedding")
+
+    embed = get_embedding_gemini if "gemini" in embedding_model_name.lower() else get_embedding_chatgpt
+    batches = split_micro_batches(texts, batch_size, max_batch_chars)
+    results: List[Optional[List[List[float]]]] = [None] * len(batches)
+    semaphore = asyncio.Semaphore(max_concurrency)
+    done = 0
+
+    async def run_batch(index: int, batch: List[str]):
+        nonlocal done
+        async with semaphore:
+            batch_tokens = sum(count_tokens(text) for text in batch)
+            for attempt in range(max_retries + 1):
+                # Mỗi lần retry chuyển sang key kế tiếp (key hết lượt -> rate limiter chọn key khác)
+                api_key = api_keys[(index + attempt) % len(api_keys)]
+                api_key = await acquire_key("embedding", api_key, batch_tokens, api_keys)
+                vectors = await embed(batch, api_key=api_key)
+                if vectors and len(vectors) == len(batch):
+                    results[index] = vectors
+                    break
+                if attempt < max_retries:
+                    delay = min(2 ** attempt, 30) + random.uniform(0, 0.5)
+                    logger.warning(f"Embedding batch {index + 1}/{len(batches)} lỗi, thử lại sau {delay:.1f}s")
+                    await asyncio.sleep(delay)
+            else:
+                raise Exception(f"Embedding batch {index + 1}/{len(batches)} thất bại sau {max_retries + 1} lần")
+
+        done += len(batch)
+        if on_progress:
+            on_progress(done, len(texts))
+        else:
+            logger.info(f"Embedding: {done}/{len(texts)} chunks")
+
+    await asyncio.gather(*[run_batch(i, batch) for i, batch in enumerate(batches)])
+
+    return [vector for batch_vectors in results for vector in batch_vectors]
@@ -0,0 +1,21 @@
+"""
+Version của knowledge base (Redis key kb_version), đổi sau mỗi thay đổi KB ở bất kỳ worker nào
+-> câu trả lời đã lưu trong semantic cache với version cũ không được dùng lại
+"""
+
+import uuid
+from typing import Optional
+
+from config.redis_cache import redis_cache
+
+KB_VERSION_KEY = "kb_version"
+KB_VERSION_TTL = 30 * 86400
+
+
+async def get_kb_version() -> Optional[str]:
+    return await redis_cache.async_get(KB_VERSION_KEY)
+
+
+async def bump_kb_version() -> None:
+    """Gọi sau mỗi thay đổi knowledge base -> toàn bộ câu trả lời đã cache bị vô hiệu"""
+    await redis_cache.async_set(KB_VERSION_KEY, f"kb-{uuid.uuid4().hex}", ttl=KB_VERSION_TTL)
@@ -0,0 +1,92 @@
+"""
+Registry client LLM/embedding dùng chung cho cả process
+- Mỗi API key có 1 client riêng, tạo 1 lần và tái sử dụng
+- Tất cả client OpenAI dùng chung 1 connection pool HTTP (keep-alive, TLS session)
+- Client Gemini là instance riêng theo key (không dùng genai.configure() toàn cục),
+  nên các request với key khác nhau chạy song song an toàn
+"""
+
+import asyncio
+import logging
+import os
+from typing import Dict, Iterable, Optional
+
+import httpx
+from google.ai import generativelanguage as glm
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+
+logger = logging.getLogger(__name__)
+
+
+class LLMClientRegistry:
+    def __init__(self):
+        self.max_connections = int(os.getenv("LLM_HTTP_MAX_CONNECTIONS", 100))
+        self.max_keepalive = int(os.getenv("LLM_HTTP_MAX_KEEPALIVE", 20))
+        self.keepalive_expiry = float(os.getenv("LLM_HTTP_KEEPALIVE_EXPIRY", 60))
+
+        self._http_client: Optional[httpx.AsyncClient] = None
+        self._openai_clients: Dict[str, AsyncOpenAI] = {}
+        self._gemini_clients: Dict[str, glm.GenerativeServiceAsyncClient] = {}
+
+    # ================== HTTP POOL ==================
+    def _get_http_client(self) -> httpx.AsyncClient:
+        if self._http_client is None or self._http_client.is_closed:
+            self._http_client = DefaultAsyncHttpxClient(
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_keepalive,
+                    keepalive_expiry=self.keepalive_expiry,
+                )
+            )
+        return self._http_client
+
+    # ================== OPENAI ==================
+    def get_openai_client(self, api_key: str) -> AsyncOpenAI:
+        client = self._openai_clients.get(api_key)
+        if client is None:
+            client = AsyncOpenAI(api_key=api_key, http_client=self._get_http_client())
+            self._openai_clients[api_key] = client
+        return client
+
+    # ================== GEMINI ==================
+    def _create_gemini_client(self, api_key: str) -> glm.GenerativeServiceAsyncClient:
+        return glm.GenerativeServiceAsyncClient(client_options={"api_key": api_key})
+
+    def get_gemini_client(self, api_key: str) -> glm.GenerativeServiceAsyncClient:
+        client = self._gemini_clients.get(api_key)
+        if client is None:
+            client = self._create_gemini_client(api_key)
+            self._gemini_clients[api_key] = client
+        return client
+
+    # ================== LIFECYCLE ==================
+    async def warmup(self, openai_keys: Iterable[str]) -> None:
+        """Tạo sẵn client và mở sẵn kết nối TLS tới provider lúc startup"""
+        keys = [key for key in dict.fromkeys(openai_keys) if key]
+        if not keys:
+            return
+
+        async def _warm(api_key: str):
+            try:
+                await self.get_openai_client(api_key).models.list()
+            except Exception as e:
+                logger.warning(f"OpenAI client warmup failed: {e}")
+
+        await asyncio.gather(*[_warm(key) for key in keys])
+        logger.info(f"✅ Warmed up {len(keys)} OpenAI clients")
+
+    async def close(self) -> None:
+        self._openai_clients.clear()
+        for client in self._gemini_clients.values():
+            try:
+                await client.transport.close()
+            except Exception as e:
+                logger.warning(f"Error closing Gemini client: {e}")
+        self._gemini_clients.clear()
+        if self._http_client is not None and not self._http_client.is_closed:
+            await self._http_client.aclose()
+        self._http_client = None
+
+
+# ================== SINGLETON ==================
+llm_clients = LLMClientRegistry()
@@ -1,16 +1,26 @@
 import redis
 import json
 import asyncio
+import threading
+import time
+import uuid
+from collections import OrderedDict
 from redis import asyncio as aioredis
-from typing import Any, Optional
+from typing import Any, Dict, List, Optional, Tuple
 from dotenv import load_dotenv
 import os
 import logging
+from config.redis_codec import redis_codec
 
 load_dotenv()
 
 logger = logging.getLogger(__name__)
 
+# Kênh pub/sub báo cho các worker khác bỏ bản L1 của key vừa ghi / xóa
+INVALIDATION_CHANNEL = "cache_invalidate"
+# Namespace (phần trước dấu ":" đầu tiên) của các key đọc nhiều, ít thay đổi -> giữ thêm bản trong process
+DEFAULT_L1_NAMESPACES = "model_info,list_keys,session,session_by_name,check_repply,page_active"
+
 
 class RedisCache:
     def __init__(self):
@@ -24,74 +34,276 @@ class RedisCache:
         self._sync_client: Optional[redis.Redis] = None
         # Async Redis client
         self._async_client: Optional[aioredis.Redis] = None
+        # Client trả về bytes cho get/set qua codec (giá trị nhị phân: msgpack, vector float32)
+        self._sync_binary_client: Optional[redis.Redis] = None
+        self._async_binary_client: Optional[aioredis.Redis] = None
+        # Lua script đã register (EVALSHA, tự load lại khi Redis báo NOSCRIPT)
+        self._scripts: Dict[str, Any] = {}
 
         # Default TTL (Time To Live) - 1 hour
         self.default_ttl = int(os.getenv("REDIS_DEFAULT_TTL", 3600))
 
+        # L1 trong process (TTL + LRU) phía trước Redis, đồng bộ giữa các worker qua pub/sub
+        # Chỉ dùng khi listener invalidation đang chạy (start_invalidation_listener)
+        self.l1_enabled = os.getenv("REDIS_L1_ENABLED", "true").lower() in ("1", "true", "yes")
+        self.l1_namespaces = {
+            ns.strip() for ns in os.getenv("REDIS_L1_NAMESPACES", DEFAULT_L1_NAMESPACES).split(",") if ns.strip()
+        }
+        # TTL ngắn: giới hạn độ cũ nếu lỡ mất 1 message invalidation
+        self.l1_ttl = float(os.getenv("REDIS_L1_TTL", 30))
+        self.l1_max_size = int(os.getenv("REDIS_L1_MAX_SIZE", 5000))
+        self._l1: "OrderedDict[str, Tuple[float, bytes]]" = OrderedDict()
+        self._l1_lock = threading.Lock()
+        self._l1_active = False
+        # Tăng mỗi lần invalidate: bỏ qua việc nạp L1 bằng giá trị đọc trước lúc có invalidation
+        self._l1_generation = 0
+        self._l1_stats: Dict[str, Dict[str, int]] = {}
+        self._instance_id = uuid.uuid4().hex
+        self._listener_task: Optional[asyncio.Task] = None
+
     # ================== SYNC CLIENT ==================
+    def _connect_sync(self, decode_responses: bool) -> Optional[redis.Redis]:
+        try:
+            client = redis.Redis(
+                host=self.redis_host,
+                port=self.redis_port,
+                db=self.redis_db,
+                password=self.redis_password,
+                decode_responses=decode_responses,
+                socket_connect_timeout=5,
+                socket_timeout=5,
+                retry_on_timeout=True,
+                health_check_interval=30,
+            )
+            # Test connection
+            client.ping()
+            logger.info("Redis sync connection established successfully")
+            return client
+        except Exception as e:
+            logger.error(f"Failed to connect to Redis sync: {e}")
+            return None
+
     def get_sync_client(self) -> redis.Redis:
         if self._sync_client is None:
-            try:
-                self._sync_client = redis.Redis(
-                    host=self.redis_host,
-                    port=self.redis_port,
-                    db=self.redis_db,
-                    password=self.redis_password,
-                    decode_responses=True,
-                    socket_connect_timeout=5,
-                    socket_timeout=5,
-                    retry_on_timeout=True,
-                    health_check_interval=30,
-                )
-                # Test connection
-                self._sync_client.ping()
-                logger.info("Redis sync connection established successfully")
-            except Exception as e:
-                logger.error(f"Failed to connect to Redis sync: {e}")
-                self._sync_client = None
+            self._sync_client = self._connect_sync(decode_responses=True)
         return self._sync_client
 
+    def get_sync_binary_client(self) -> redis.Redis:
+        if self._sync_binary_client is None:
+            self._sync_binary_client = self._connect_sync(decode_responses=False)
+        return self._sync_binary_client
+
     # ================== ASYNC CLIENT ==================
+    async def _connect_async(self, decode_responses: bool) -> Optional[aioredis.Redis]:
+        try:
+            client = aioredis.from_url(
+                self.redis_url,
+                password=self.redis_password,
+                decode_responses=decode_responses,
+                socket_connect_timeout=5,
+                socket_timeout=5,
+                retry_on_timeout=True,
+                health_check_interval=30,
+            )
+            # Test connection
+            await client.ping()
+            logger.info("Redis async connection established successfully")
+            return client
+        except Exception as e:
+            logger.error(f"Failed to connect to Redis async: {e}")
+            return None
+
     async def get_async_client(self) -> aioredis.Redis:
         if self._async_client is None:
+            self._async_client = await self._connect_async(decode_responses=True)
+        return self._async_client
+
+    async def get_async_binary_client(self) -> aioredis.Redis:
+        if self._async_binary_client is None:
+            self._async_binary_client = await self._connect_async(decode_responses=False)
+        return self._async_binary_client
+
+    async def async_close(self) -> None:
+        """Đóng client async + quên script đã register (client gắn với event loop đang chạy)"""
+        for client in (self._async_client, self._async_binary_client):
+            if client is None:
+                continue
             try:
-                self._async_client = aioredis.from_url(
-                    self.redis_url,
-                    password=self.redis_password,
-                    decode_responses=True,
-                    socket_connect_timeout=5,
-                    socket_timeout=5,
-                    retry_on_timeout=True,
-                    health_check_interval=30,
-                )
-                # Test connection
-                await self._async_client.ping()
-                logger.info("Redis async connection established successfully")
+                await (getattr(client, "aclose", None) or client.close)()
             except Exception as e:
-                logger.error(f"Failed to connect to Redis async: {e}")
-                self._async_client = None
-        return self._async_client
+                logger.warning(f"Error closing Redis async client: {e}")
+        self._async_client = None
+        self._async_binary_client = None
+        self._scripts = {}
+
+    # ================== L1 (IN-PROCESS) ==================
+    @staticmethod
+    def _namespace(key: str) -> str:
+        return key.split(":", 1)[0]
+
+    def _l1_tracked(self, key: str) -> bool:
+        # Ghi / xóa key thuộc namespace L1 luôn publish (kể cả khi L1 của worker này đang tắt)
+        return self._namespace(key) in self.l1_namespaces
+
+    def _l1_usable(self, key: str) -> bool:
+        return self.l1_enabled and self._l1_active and self._l1_tracked(key)
+
+    def _record(self, key: str, field: str) -> None:
+        stats = self._l1_stats.setdefault(self._namespace(key), {"hits": 0, "misses": 0, "invalidations": 0})
+        stats[field] += 1
+
+    def _l1_get(self, key: str) -> Optional[bytes]:
+        with self._l1_lock:
+            entry = self._l1.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self._l1.move_to_end(key)
+                self._record(key, "hits")
+                return entry[1]
+            if entry is not None:
+                del self._l1[key]
+            self._record(key, "misses")
+            return None
+
+    def _l1_set(self, key: str, raw: bytes, ttl: Optional[int] = None, generation: Optional[int] = None) -> None:
+        expires_at = time.monotonic() + min(self.l1_ttl, ttl or self.l1_ttl)
+        with self._l1_lock:
+            if generation is not None and generation != self._l1_generation:
+                return
+            self._l1[key] = (expires_at, raw)
+            self._l1.move_to_end(key)
+            while len(self._l1) > self.l1_max_size:
+                self._l1.popitem(last=False)
+
+    def _l1_invalidate(self, key: str) -> None:
+        with self._l1_lock:
+            self._l1_generation += 1
+            if self._l1.pop(key, None) is not None:
+                self._record(key, "invalidations")
+
+    def _l1_clear(self) -> None:
+        with self._l1_lock:
+            self._l1_generation += 1
+            self._l1.clear()
+
+    def _invalidation_message(self, key: str) -> str:
+        return json.dumps({"key": key, "origin": self._instance_id})
+
+    @staticmethod
+    def _decode(value: Optional[bytes]) -> Any:
+        return redis_codec.decode(value)
+
+    async def start_invalidation_listener(self) -> None:
+        """Gọi lúc startup: subscribe kênh invalidation rồi mới bật L1"""
+        if not self.l1_enabled or self._listener_task is not None:
+            return
+        self._listener_task = asyncio.create_task(self._listen_invalidations())
+
+    async def stop_invalidation_listener(self) -> None:
+        if self._listener_task is None:
+            return
+        self._listener_task.cancel()
+        try:
+            await self._listener_task
+        except (asyncio.CancelledError, Exception):
+            pass
+        self._listener_task = None
+
+    async def _listen_invalidations(self) -> None:
+        while True:
+            pubsub = None
+            try:
+                client = await self.get_async_client()
+                if client is None:
+                    await asyncio.sleep(5)
+                    continue
+
+                pubsub = client.pubsub()
+                await pubsub.subscribe(INVALIDATION_CHANNEL)
+                # Có thể đã lỡ message trong lúc mất kết nối -> bỏ toàn bộ L1
+                self._l1_clear()
+                self._l1_active = True
+                logger.info("Redis L1 cache enabled (invalidation listener subscribed)")
+
+                while True:
+                    message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+                    if message is None or message.get("type") != "message":
+                        continue
+                    try:
+                        data = json.loads(message["data"])
+                    except (TypeError, ValueError):
+                        continue
+                    if data.get("origin") != self._instance_id:
+                        self._l1_invalidate(data.get("key", ""))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Redis invalidation listener error: {e}")
+                await asyncio.sleep(1)
+            finally:
+                self._l1_active = False
+                if pubsub is not None:
+                    try:
+                        await pubsub.aclose() if hasattr(pubsub, "aclose") else await pubsub.close()
+                    except Exception:
+                        pass
+
+    def l1_stats(self) -> Dict:
+        with self._l1_lock:
+            namespaces = {}
+            for namespace, stats in self._l1_stats.items():
+                total = stats["hits"] + stats["misses"]
+                namespaces[namespace] = {
+                    **stats,
+                    "hit_ratio": round(stats["hits"] / total, 4) if total else 0.0,
+                }
+            return {
+                "enabled": self.l1_enabled,
+                "active": self._l1_active,
+                "size": len(self._l1),
+                "ttl": self.l1_ttl,
+                "namespaces": namespaces,
+            }
 
     # ================== SYNC OPERATIONS ==================
     def set(self, key: str, value: Any, ttl: Optional[int] = None) -> bool:
         try:
-            client = self.get_sync_client()
+            client = self.get_sync_binary_client()
             if client is None:
                 return False
 
             ttl = ttl or self.default_ttl
 
-            if not isinstance(value, str):
-                value = json.dumps(value, ensure_ascii=False)
-
-            return client.setex(key, ttl, value)
+            # Codec theo namespace của key (JSON / msgpack / float32 / chuỗi)
+            value = redis_codec.encode(key, value)
+
+            if not self._l1_tracked(key):
+                return client.setex(key, ttl, value)
+
+            # Ghi + báo các worker khác trong 1 round trip
+            self._l1_invalidate(key)
+            # Worker khác ghi đè + invalidation tới trong lúc pipeline chạy -> không nạp giá trị cũ vào L1
+            generation = self._l1_generation
+            pipe = client.pipeline(transaction=False)
+            pipe.setex(key, ttl, value)
+            pipe.publish(INVALIDATION_CHANNEL, self._invalidation_message(key))
+            result = pipe.execute()[0]
+            if self._l1_usable(key):
+                self._l1_set(key, value, ttl, generation=generation)
+            return result
         except Exception as e:
             logger.error(f"Error setting cache key {key}: {e}")
             return False
 
     def get(self, key: str) -> Optional[Any]:
         try:
-            client = self.get_sync_client()
+            use_l1 = self._l1_usable(key)
+            if use_l1:
+                value = self._l1_get(key)
+                if value is not None:
+                    return self._decode(value)
+                generation = self._l1_generation
+
+            client = self.get_sync_binary_client()
             if client is None:
                 return None
 
@@ -99,10 +311,9 @@ class RedisCache:
             if value is None:
                 return None
 
-            try:
-                return json.loads(value)
-            except json.JSONDecodeError:
-                return value
+            if use_l1:
+                self._l1_set(key, value, generation=generation)
+            return self._decode(value)
         except Exception as e:
             logger.error(f"Error getting cache key {key}: {e}")
             return None
@@ -112,7 +323,15 @@ class RedisCache:
             client = self.get_sync_client()
             if client is None:
                 return False
-            return bool(client.delete(key))
+
+            if not self._l1_tracked(key):
+                return bool(client.delete(key))
+
+            self._l1_invalidate(key)
+            pipe = client.pipeline(transaction=False)
+            pipe.delete(key)
+            pipe.publish(INVALIDATION_CHANNEL, self._invalidation_message(key))
+            return bool(pipe.execute()[0])
         except Exception as e:
             logger.error(f"Error deleting cache key {key}: {e}")
             return False
@@ -130,23 +349,43 @@ class RedisCache:
     # ================== ASYNC OPERATIONS ==================
     async def async_set(self, key: str, value: Any, ttl: Optional[int] = None) -> bool:
         try:
-            client = await self.get_async_client()
+            client = await self.get_async_binary_client()
             if client is None:
                 return False
 
             ttl = ttl or self.default_ttl
 
-            if not isinstance(value, str):
-                value = json.dumps(value, ensure_ascii=False)
-
-            return await client.setex(key, ttl, value)
+            # Codec theo namespace của key (JSON / msgpack / float32 / chuỗi)
+            value = redis_codec.encode(key, value)
+
+            if not self._l1_tracked(key):
+                return await client.setex(key, ttl, value)
+
+            # Ghi + báo các worker khác trong 1 round trip
+            self._l1_invalidate(key)
+            # Worker khác ghi đè + invalidation tới trong lúc pipeline chạy -> không nạp giá trị cũ vào L1
+            generation = self._l1_generation
+            pipe = client.pipeline(transaction=False)
+            pipe.setex(key, ttl, value)
+            pipe.publish(INVALIDATION_CHANNEL, self._invalidation_message(key))
+            result = (await pipe.execute())[0]
+            if self._l1_usable(key):
+                self._l1_set(key, value, ttl, generation=generation)
+            return result
         except Exception as e:
             logger.error(f"Error async setting cache key {key}: {e}")
             return False
 
     async def async_get(self, key: str) -> Optional[Any]:
         try:
-            client = await self.get_async_client()
+            use_l1 = self._l1_usable(key)
+            if use_l1:
+                value = self._l1_get(key)
+                if value is not None:
+                    return self._decode(value)
+                generation = self._l1_generation
+
+            client = await self.get_async_binary_client()
             if client is None:
                 return None
 
@@ -154,10 +393,9 @@ class RedisCache:
             if value is None:
                 return None
 
-            try:
-                return json.loads(value)
-            except json.JSONDecodeError:
-                return value
+            if use_l1:
+                self._l1_set(key, value, generation=generation)
+            return self._decode(value)
         except Exception as e:
             logger.error(f"Error async getting cache key {key}: {e}")
             return None
@@ -167,7 +405,15 @@ class RedisCache:
             client = await self.get_async_client()
             if client is None:
                 return False
-            return bool(await client.delete(key))
+
+            if not self._l1_tracked(key):
+                return bool(await client.delete(key))
+
+            self._l1_invalidate(key)
+            pipe = client.pipeline(transaction=False)
+            pipe.delete(key)
+            pipe.publish(INVALIDATION_CHANNEL, self._invalidation_message(key))
+            return bool((await pipe.execute())[0])
         except Exception as e:
             logger.error(f"Error async deleting cache key {key}: {e}")
             return False
@@ -182,6 +428,128 @@ class RedisCache:
             logger.error(f"Error async checking cache key {key}: {e}")
             return False
 
+    # ================== ASYNC BATCH OPERATIONS ==================
+    async def async_get_many(self, keys: List[str]) -> Dict[str, Any]:
+        """Đọc nhiều key trong 1 round trip (L1 trước, phần còn lại bằng MGET); key không có -> None"""
+        keys = list(dict.fromkeys(keys))
+        result: Dict[str, Any] = {key: None for key in keys}
+        try:
+            missing = []
+            for key in keys:
+                if self._l1_usable(key):
+                    value = self._l1_get(key)
+                    if value is not None:
+                        result[key] = self._decode(value)
+                        continue
+                missing.append(key)
+            if not missing:
+                return result
+
+            client = await self.get_async_binary_client()
+            if client is None:
+                return result
+
+            generation = self._l1_generation
+            values = await client.mget(missing)
+            for key, value in zip(missing, values):
+                if value is None:
+                    continue
+                if self._l1_usable(key):
+                    self._l1_set(key, value, generation=generation)
+                result[key] = self._decode(value)
+            return result
+        except Exception as e:
+            logger.error(f"Error async getting cache keys {keys}: {e}")
+            return result
+
+    async def async_set_many(
+        self,
+        items: Dict[str, Any],
+        ttl: Optional[int] = None,
+        ttls: Optional[Dict[str, int]] = None
+    ) -> bool:
+        """Ghi nhiều key trong 1 pipeline; ttls: TTL riêng theo key (mặc định ttl / default_ttl)"""
+        if not items:
+            return True
+        try:
+            client = await self.get_async_binary_client()
+            if client is None:
+                return False
+
+            ttls = ttls or {}
+            encoded = {key: redis_codec.encode(key, value) for key, value in items.items()}
+
+            pipe = client.pipeline(transaction=False)
+            for key, value in encoded.items():
+                if self._l1_tracked(key):
+                    self._l1_invalidate(key)
+                pipe.setex(key, ttls.get(key) or ttl or self.default_ttl, value)
+            generation = self._l1_generation
+            for key in encoded:
+                if self._l1_tracked(key):
+                    pipe.publish(INVALIDATION_CHANNEL, self._invalidation_message(key))
+            results = await pipe.execute()
+
+            for key, value in encoded.items():
+                if self._l1_usable(key):
+                    self._l1_set(key, value, ttls.get(key) or ttl, generation=generation)
+            return all(results[:len(encoded)])
+        except Exception as e:
+            logger.error(f"Error async setting cache keys {list(items)}: {e}")
+            return False
+
+    async def async_delete_many(self, keys: List[str]) -> int:
+        """Xóa nhiều key bằng 1 lệnh DEL (kèm publish invalidation trong cùng pipeline)"""
+        keys = list(dict.fromkeys(keys))
+        if not keys:
+            return 0
+        try:
+            client = await self.get_async_binary_client()
+            if client is None:
+                return 0
+
+            pipe = client.pipeline(transaction=False)
+            pipe.delete(*keys)
+            for key in keys:
+                if self._l1_tracked(key):
+                    self._l1_invalidate(key)
+                    pipe.publish(INVALIDATION_CHANNEL, self._invalidation_message(key))
+            return int((await pipe.execute())[0])
+        except Exception as e:
+            logger.error(f"Error async deleting cache keys {keys}: {e}")
+            return 0
+
+    async def async_delete_prefix(self, prefix: str) -> int:
+        """Xóa mọi key bắt đầu bằng prefix (SCAN, không chặn Redis như KEYS)"""
+        try:
+            client = await self.get_async_client()
+            if client is None:
+                return 0
+            keys = [key async for key in client.scan_iter(match=f"{prefix}*", count=500)]
+            deleted = 0
+            for start in range(0, len(keys), 500):
+                deleted += await self.async_delete_many(keys[start:start + 500])
+            return deleted
+        except Exception as e:
+            logger.error(f"Error async deleting cache prefix {prefix}: {e}")
+            return 0
+
+    async def async_eval(self, script: str, keys: List[str], args: List[Any]) -> Optional[Any]:
+        """Chạy Lua script nguyên tử trên Redis (1 round trip), None nếu Redis không dùng được"""
+        try:
+            client = await self.get_async_client()
+            if client is None:
+                return None
+
+            registered = self._scripts.get(script)
+            if registered is None:
+                registered = client.register_script(script)
+                self._scripts[script] = registered
+            return await registered(keys=keys, args=args)
+        except Exception as e:
+            logger.error(f"Error async eval script on keys {keys}: {e}")
+            return None
+
 
 # ================== SINGLETON + HELPERS ==================
 redis_cache = RedisCache()
@@ -217,3 +585,27 @@ async def async_cache_delete(key: str) -> bool:
 
 async def async_cache_exists(key: str) -> bool:
     return await redis_cache.async_exists(key)
+
+
+async def async_cache_get_many(keys: List[str]) -> Dict[str, Any]:
+    return await redis_cache.async_get_many(keys)
+
+
+async def async_cache_set_many(
+    items: Dict[str, Any],
+    ttl: Optional[int] = None,
+    ttls: Optional[Dict[str, int]] = None
+) -> bool:
+    return await redis_cache.async_set_many(items, ttl, ttls)
+
+
+async def async_cache_delete_many(keys: List[str]) -> int:
+    return await redis_cache.async_delete_many(keys)
+
+
+async def async_cache_delete_prefix(prefix: str) -> int:
+    return await redis_cache.async_delete_prefix(prefix)
+
+
+async def async_cache_eval(script: str, keys: List[str], args: List[Any]) -> Optional[Any]:
+    return await redis_cache.async_eval(script, keys, args)
@@ -0,0 +1,187 @@
+"""
+Codec (de)serialize giá trị cho RedisCache, chọn theo namespace của key (phần trước dấu ":")
+- Giá trị mới: header 3 byte = \\x00 + version + tag codec, rồi tới payload
+    j: JSON (orjson nếu có, không thì json chuẩn)
+    m: msgpack (nếu có cài, không thì rơi về JSON)
+    v: vector float32 (bytes thô, đọc ra np.ndarray)
+    s: chuỗi UTF-8 nguyên bản (không đoán kiểu khi đọc)
+- Giá trị cũ (không có header): đọc như trước - thử JSON, lỗi thì trả chuỗi
+- Namespace "raw": ghi đúng định dạng cũ (chuỗi / JSON không header) cho các key mà Lua script
+  đọc / INCR trực tiếp
+Cấu hình: REDIS_CODECS="embedding=f32,list_keys=msgpack", REDIS_CODEC_DEFAULT=json,
+REDIS_CODEC_ENABLED=false để ghi định dạng cũ (khi còn worker bản cũ đọc chung Redis)
+"""
+
+import json
+import logging
+import os
+from typing import Any, Dict, Optional, Union
+
+logger = logging.getLogger(__name__)
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+MAGIC = b"\x00"
+CODEC_VERSION = 1
+HEADER_SIZE = 3
+
+# Key do Lua script quản lý (counter / hash) -> luôn giữ định dạng cũ
+RAW_NAMESPACES = {
+    "llm_key_global_counter",
+    "llm_key_session",
+    "llm_key_scheduler",
+    "llm_key_health",
+    "llm_rate",
+    "bm25_version",
+    "bm25_changes",
+}
+
+DEFAULT_NAMESPACE_CODECS = "embedding=f32,list_keys=msgpack,model_info=msgpack"
+
+
+def _json_default(value: Any) -> Any:
+    """Kiểu JSON không hỗ trợ sẵn: numpy -> list / số, còn lại (datetime, Decimal...) -> chuỗi"""
+    if hasattr(value, "tolist"):
+        return value.tolist()
+    return str(value)
+
+
+class JsonCodec:
+    name = "json"
+    tag = b"j"
+
+    def encode(self, value: Any) -> bytes:
+        if orjson is not None:
+            try:
+                return orjson.dumps(
+                    value,
+                    default=_json_default,
+                    option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+                )
+            except TypeError:
+                pass
+        return json.dumps(value, ensure_ascii=False, default=_json_default).encode("utf-8")
+
+    def decode(self, payload: bytes) -> Any:
+        return orjson.loads(payload) if orjson is not None else json.loads(payload)
+
+
+class MsgpackCodec:
+    name = "msgpack"
+    tag = b"m"
+
+    def encode(self, value: Any) -> bytes:
+        return msgpack.packb(value, use_bin_type=True)
+
+    def decode(self, payload: bytes) -> Any:
+        return msgpack.unpackb(payload, raw=False, strict_map_key=False)
+
+
+class Float32Codec:
+    """Vector float32: bytes thô (4 byte / chiều), nhỏ hơn ~3 lần base64 trong JSON"""
+    name = "f32"
+    tag = b"v"
+
+    def encode(self, value: Any) -> bytes:
+        import numpy as np
+        return np.asarray(value, dtype=np.float32).tobytes()
+
+    def decode(self, payload: bytes) -> Any:
+        import numpy as np
+        return np.frombuffer(payload, dtype=np.float32).copy()
+
+
+class StrCodec:
+    name = "str"
+    tag = b"s"
+
+    def encode(self, value: Any) -> bytes:
+        return value.encode("utf-8")
+
+    def decode(self, payload: bytes) -> Any:
+        return payload.decode("utf-8")
+
+
+_json_codec = JsonCodec()
+_str_codec = StrCodec()
+CODECS = {codec.name: codec for codec in (_json_codec, MsgpackCodec(), Float32Codec(), _str_codec)}
+CODECS_BY_TAG = {codec.tag: codec for codec in CODECS.values()}
+
+
+def _parse_namespace_codecs(spec: str) -> Dict[str, str]:
+    mapping = {}
+    for item in spec.split(","):
+        if "=" not in item:
+            continue
+        namespace, codec_name = (part.strip() for part in item.split("=", 1))
+        if codec_name not in CODECS:
+            logger.warning(f"Redis codec không hỗ trợ '{codec_name}' cho namespace '{namespace}'")
+            continue
+        mapping[namespace] = codec_name
+    return mapping
+
+
+class RedisCodec:
+    def __init__(self):
+        self.enabled = os.getenv("REDIS_CODEC_ENABLED", "true").lower() in ("1", "true", "yes")
+        self.default_codec = os.getenv("REDIS_CODEC_DEFAULT", "json")
+        if self.default_codec not in CODECS:
+            self.default_codec = "json"
+        self.namespace_codecs = _parse_namespace_codecs(os.getenv("REDIS_CODECS", DEFAULT_NAMESPACE_CODECS))
+
+    @staticmethod
+    def namespace(key: str) -> str:
+        return key.split(":", 1)[0]
+
+    def codec_for(self, key: str, value: Any = None):
+        namespace = self.namespace(key)
+        codec = CODECS[self.namespace_codecs.get(namespace, self.default_codec)]
+        if codec.name == "msgpack" and msgpack is None:
+            return _json_codec
+        # Namespace vector nhưng giá trị không phải vector (vd entry định dạng cũ) -> JSON
+        if codec.name == "f32" and not (isinstance(value, (list, tuple)) or hasattr(value, "dtype")):
+            return _json_codec
+        # Chuỗi thuần trong namespace JSON / msgpack: lưu nguyên văn, đọc ra đúng chuỗi
+        if isinstance(value, str) and codec.name in ("json", "msgpack"):
+            return _str_codec
+        return codec
+
+    def encode(self, key: str, value: Any) -> Union[bytes, str]:
+        if not self.enabled or self.namespace(key) in RAW_NAMESPACES:
+            return value if isinstance(value, str) else json.dumps(value, ensure_ascii=False, default=_json_default)
+
+        codec = self.codec_for(key, value)
+        try:
+            payload = codec.encode(value)
+        except Exception as e:
+            # Giá trị codec của namespace không ghi được (vd datetime với msgpack) -> vẫn cache bằng JSON
+            logger.warning(f"Redis codec '{codec.name}' không encode được key {key}, dùng JSON: {e}")
+            codec = _json_codec
+            payload = codec.encode(value)
+        return MAGIC + bytes([CODEC_VERSION]) + codec.tag + payload
+
+    def decode(self, raw: Optional[Union[bytes, str]]) -> Any:
+        if raw is None:
+            return None
+        if isinstance(raw, bytes) and raw[:1] == MAGIC and len(raw) >= HEADER_SIZE and raw[1] == CODEC_VERSION:
+            codec = CODECS_BY_TAG.get(raw[2:3])
+            if codec is not None:
+                return codec.decode(raw[HEADER_SIZE:])
+
+        # Định dạng cũ: JSON hoặc chuỗi
+        text = raw.decode("utf-8", errors="replace") if isinstance(raw, bytes) else raw
+        try:
+            return json.loads(text)
+        except json.JSONDecodeError:
+            return text
+
+
+redis_codec = RedisCodec()
@@ -93,6 +93,22 @@ async def delete_kb_detail_controller(detail_id: int, db: AsyncSession):
     else:
         raise HTTPException(status_code=404, detail="File/Detail not found")
 
+async def update_kb_detail_status_controller(detail_id: int, data: dict, db: AsyncSession):
+    
+    is_active = data.get("is_active")
+    if not isinstance(is_active, bool):
+        raise HTTPException(status_code=400, detail="is_active phải là true/false")
+    
+    detail = await knowledge_base_service.update_kb_detail_status_service(detail_id, is_active, db)
+    if not detail:
+        raise HTTPException(status_code=404, detail="File/Detail not found")
+    
+    return {
+        "message": "File/Detail status updated",
+        "detail_id": detail.id,
+        "is_active": detail.is_active
+    }
+
 async def search_kb_controller(query: str, db: AsyncSession):
     return await knowledge_base_service.search_kb_service(query, db)
 
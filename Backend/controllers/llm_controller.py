@@ -6,7 +6,12 @@ from services.llm_service import (
     get_llm_by_id_service,
     get_all_llms_service
 )
-from llm.help_llm import clear_llm_keys_cache
+from services.reindex_service import start_reindex_service, get_reindex_status_service
+from llm.help_llm import clear_llm_keys_cache, get_rate_limit_status
+from llm.semantic_cache import semantic_cache
+from llm.reranker import reranker
+from config.redis_cache import redis_cache
+from config.embedding_cache import embedding_cache
 
 async def create_llm_controller(data: dict, db: AsyncSession):
     llm_instance = await create_llm_service(data, db)
@@ -28,6 +33,8 @@ async def create_llm_controller(data: dict, db: AsyncSession):
             "chunksize": llm_instance.chunksize,
             "chunkoverlap": llm_instance.chunkoverlap,
             "topk": llm_instance.topk,
+            "rerank_enabled": llm_instance.rerank_enabled,
+            "rerank_candidates": llm_instance.rerank_candidates,
             "created_at": llm_instance.created_at
         }
     }
@@ -38,11 +45,16 @@ async def update_llm_controller(llm_id: int, data: dict, db: AsyncSession):
         return {"message": "LLM not found"}
     
     # Xóa cache nếu cập nhật LLM id=1
+    reindex = None
     if llm_id == 1:
         await clear_llm_keys_cache()
+        # Đổi model embedding -> re-index sang collection mới (chạy nền)
+        if "embedding_model_detail_id" in data:
+            reindex = await start_reindex_service(db)
     
     return {
         "message": "LLM updated",
+        "reindex": reindex,
         "llm": {
             "id": llm_instance.id,
             "prompt": llm_instance.prompt,
@@ -54,6 +66,8 @@ async def update_llm_controller(llm_id: int, data: dict, db: AsyncSession):
             "chunksize": llm_instance.chunksize,
             "chunkoverlap": llm_instance.chunkoverlap,
             "topk": llm_instance.topk,
+            "rerank_enabled": llm_instance.rerank_enabled,
+            "rerank_candidates": llm_instance.rerank_candidates,
             "created_at": llm_instance.created_at
         }
     }
@@ -86,6 +100,8 @@ async def get_llm_by_id_controller(llm_id: int, db: AsyncSession):
         "chunksize": llm_instance.chunksize,
         "chunkoverlap": llm_instance.chunkoverlap,
         "topk": llm_instance.topk,
+        "rerank_enabled": llm_instance.rerank_enabled,
+        "rerank_candidates": llm_instance.rerank_candidates,
         "llm_details": [
             {
                 "id": detail.id,
@@ -121,6 +137,8 @@ async def get_all_llms_controller(db: AsyncSession):
             "chunksize": l.chunksize,
             "chunkoverlap": l.chunkoverlap,
             "topk": l.topk,
+            "rerank_enabled": l.rerank_enabled,
+            "rerank_candidates": l.rerank_candidates,
             "llm_details": [
                 {
                     "id": detail.id,
@@ -142,4 +160,27 @@ async def get_all_llms_controller(db: AsyncSession):
             ]
         }
         for l in llms
-    ]
\ No newline at end of file
+    ]
+
+async def purge_semantic_cache_controller():
+    purged = await semantic_cache.purge()
+    return {"message": "Semantic cache purged", "purged": purged}
+
+async def get_reindex_status_controller():
+    return get_reindex_status_service()
+
+async def start_reindex_controller(data: dict, db: AsyncSession):
+    status = await start_reindex_service(db, force=bool(data.get("force", False)))
+    return {"message": "Re-index status", **status}
+
+async def get_rate_limits_controller(db: AsyncSession):
+    return await get_rate_limit_status(db)
+
+async def get_cache_stats_controller():
+    # Hit ratio của các tầng cache trong worker hiện tại
+    return {
+        "redis_l1": redis_cache.l1_stats(),
+        "embedding": embedding_cache.stats(),
+        "semantic": semantic_cache.stats(),
+        "reranker": reranker.stats()
+    }
@@ -1,13 +1,14 @@
 import os
+import hashlib
 import logging
 from typing import Any, Dict, Optional, List, Union
 import uuid
 
 from langchain_text_splitters import RecursiveCharacterTextSplitter
-from config.get_embedding import get_embedding_gemini, get_embedding_chatgpt
-from llm.help_llm import get_current_model
+from config.get_embedding import get_embeddings_batched, resolve_embedding_model
+from llm.help_llm import get_embedding_keys
 from bs4 import BeautifulSoup
-from config.chromadb_config import add_chunks
+from config.chromadb_config import add_chunks, get_knowledge_chunks, delete_chunk_ids
 from .process_file import extract_text_from_pdf, extract_text_from_docx, extract_text_from_excel
 import json
 
@@ -15,6 +16,29 @@ import json
 logger = logging.getLogger(__name__)
 
 
+def chunk_content_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def build_chunk_metadata(
+    detail_id: int,
+    category_id: Optional[int],
+    is_active: bool = True,
+    content: Optional[str] = None,
+    embedding_model: Optional[str] = None
+) -> Dict:
+    # category_id / is_active dùng để filter ngay trong query ChromaDB
+    metadata = {"knowledge_id": str(detail_id), "is_active": bool(is_active)}
+    if category_id is not None:
+        metadata["category_id"] = int(category_id)
+    # content_hash + embedding_model: cho phép giữ lại vector của chunk không đổi khi sửa tài liệu
+    if content is not None:
+        metadata["content_hash"] = chunk_content_hash(content)
+    if embedding_model:
+        metadata["embedding_model"] = embedding_model
+    return metadata
+
+
 def normalize_metadata(meta: Dict) -> Dict:
     normalized = {}
     for k, v in meta.items():
@@ -24,27 +48,37 @@ def normalize_metadata(meta: Dict) -> Dict:
             normalized[k] = json.dumps(v, ensure_ascii=False)
     return normalized
     
+async def extract_file_text(file_path: str, filename: str) -> Optional[str]:
+    ext = os.path.splitext(filename)[1].lower()
+    if ext == '.pdf':
+        return await extract_text_from_pdf(file_path)
+    if ext in ['.docx', '.doc']:
+        return await extract_text_from_docx(file_path)
+    if ext in ['.xlsx', '.xls']:
+        return await extract_text_from_excel(file_path)
+    logger.error(f"Định dạng file không được hỗ trợ: {ext}")
+    return None
+
+
+def extract_rich_text(raw_content: str) -> str:
+    soup = BeautifulSoup(raw_content or "", "html.parser")
+    return soup.get_text(separator="\n", strip=True)
+
+
 async def process_uploaded_file(
     file_path: str,
     filename: str,
     db,
     chunk_size: int,
     chunk_overlap: int,
-    detail_id: int
+    detail_id: int,
+    category_id: Optional[int] = None,
+    is_active: bool = True
 ) -> bool:
     
     try:
         # 1)Extract text từ file
-        ext = os.path.splitext(filename)[1].lower()
-        if ext == '.pdf':
-            content = await extract_text_from_pdf(file_path)
-        elif ext in ['.docx', '.doc']:
-            content = await extract_text_from_docx(file_path)
-        elif ext in ['.xlsx', '.xls']:
-            content = await extract_text_from_excel(file_path)
-        else:
-            logger.error(f"Định dạng file không được hỗ trợ: {ext}")
-            return False
+        content = await extract_file_text(file_path, filename)
 
         if not content:
             logger.error(f"Không đọc được nội dung từ file {filename}")
@@ -54,11 +88,8 @@ async def process_uploaded_file(
         
         
         
-        # Lấy thông tin model embedding
-        model = await get_current_model(db_session=db, chat_session_id=None)
-        
-        embedding_info = model["embedding"]["name"]
-        embedding_key = model["embedding"]["key"]
+        # Lấy thông tin model embedding + tất cả key embedding
+        embedding_model_name, embedding_keys = await get_embedding_keys(db)
 
         
         
@@ -74,11 +105,13 @@ async def process_uploaded_file(
 
         
         
-        # 3) Batch embedding
-        if "gemini" in embedding_info.lower():
-            all_vectors = await get_embedding_gemini(all_chunks, api_key=embedding_key)
-        else:
-            all_vectors = await get_embedding_chatgpt(all_chunks, api_key=embedding_key)
+        # 3) Batch embedding: micro-batch, chia đều cho các key
+        all_vectors = await get_embeddings_batched(
+            all_chunks,
+            api_keys=embedding_keys,
+            embedding_model_name=embedding_model_name,
+            on_progress=lambda done, total: logger.info(f"[{filename}] Embedding {done}/{total} chunks")
+        )
 
         
         # 4) Chuẩn bị data
@@ -91,7 +124,11 @@ async def process_uploaded_file(
                 "id": f"{filename}_chunk_{idx}",
                 "content": chunk,
                 "embedding": list(emb) if hasattr(emb, "__iter__") else [emb],
-                "metadata": {"knowledge_id": str(detail_id)}
+                "metadata": build_chunk_metadata(
+                    detail_id, category_id, is_active,
+                    content=chunk,
+                    embedding_model=resolve_embedding_model(embedding_model_name)
+                )
             })
         
             
@@ -114,11 +151,12 @@ async def process_rich_text(
     db,
     chunk_size: int,
     chunk_overlap: int,
-    detail_id: int
+    detail_id: int,
+    category_id: Optional[int] = None,
+    is_active: bool = True
 ) -> Dict[str, any]:
     try:
-        soup = BeautifulSoup(raw_content, "html.parser")
-        text_content = soup.get_text(separator="\n", strip=True)
+        text_content = extract_rich_text(raw_content)
         
         if not text_content:
             return False
@@ -138,17 +176,14 @@ async def process_rich_text(
             return False
 
 
-        # Bước 3: Tạo Embeddings (Batch)
-        model = await get_current_model(db_session=db, chat_session_id=None)
-        embedding_info = model["embedding"]
-        embedding_key = embedding_info["key"]
-        
-    
+        # Bước 3: Tạo Embeddings (micro-batch, chia đều cho các key)
+        embedding_model_name, embedding_keys = await get_embedding_keys(db)
         
-        if "gemini" in embedding_info["name"].lower():
-            all_vectors = await get_embedding_gemini(all_chunks, api_key=embedding_key)
-        else:
-            all_vectors = await get_embedding_chatgpt(all_chunks, api_key=embedding_key)
+        all_vectors = await get_embeddings_batched(
+            all_chunks,
+            api_keys=embedding_keys,
+            embedding_model_name=embedding_model_name
+        )
 
         
         # Bước 4: Chuẩn bị data
@@ -162,7 +197,11 @@ async def process_rich_text(
                 'id': chunk_id,
                 'content': text,
                 'embedding': vector,
-                'metadata': {'knowledge_id': str(detail_id)}
+                'metadata': build_chunk_metadata(
+                    detail_id, category_id, is_active,
+                    content=text,
+                    embedding_model=resolve_embedding_model(embedding_model_name)
+                )
             })
             
             
@@ -175,4 +214,141 @@ async def process_rich_text(
 
     except Exception as e:
         print(f"Lỗi xử lý rich text: {str(e)}")
-        return False
\ No newline at end of file
+        return False
+
+
+
+async def update_rich_text_chunks(
+    raw_content: str,
+    db,
+    chunk_size: int,
+    chunk_overlap: int,
+    detail_id: int,
+    category_id: Optional[int] = None,
+    is_active: bool = True
+) -> bool:
+    """
+    Cập nhật tăng dần chunk của 1 tài liệu rich text đã sửa:
+    - Chunk có nội dung (content_hash) không đổi -> giữ nguyên id + vector
+    - Chỉ embed các chunk mới / đã thay đổi, xóa các chunk không còn trong tài liệu
+    """
+    try:
+        text_content = extract_rich_text(raw_content)
+        
+        if not text_content:
+            return False
+
+        text_splitter = RecursiveCharacterTextSplitter(
+            chunk_size=chunk_size,
+            chunk_overlap=chunk_overlap
+        )
+        all_chunks = text_splitter.split_text(text_content)
+        
+        if not all_chunks:
+            return False
+
+        embedding_model_name, embedding_keys = await get_embedding_keys(db)
+        embedding_model = resolve_embedding_model(embedding_model_name)
+
+        # Chunk hiện có: content_hash -> [id] (chỉ dùng lại vector tạo bởi cùng model embedding)
+        existing = await get_knowledge_chunks(str(detail_id), include=["metadatas"])
+        reusable: Dict[str, List[str]] = {}
+        stale_ids = []
+        for chunk_id, meta in zip(existing["ids"], existing["metadatas"]):
+            meta = meta or {}
+            if meta.get("content_hash") and meta.get("embedding_model") == embedding_model:
+                reusable.setdefault(meta["content_hash"], []).append(chunk_id)
+            else:
+                stale_ids.append(chunk_id)
+
+        new_chunks = []
+        for text in all_chunks:
+            kept = reusable.get(chunk_content_hash(text))
+            if kept:
+                kept.pop()
+            else:
+                new_chunks.append(text)
+        stale_ids.extend(chunk_id for ids in reusable.values() for chunk_id in ids)
+
+        # Chỉ embed phần thay đổi
+        if new_chunks:
+            new_vectors = await get_embeddings_batched(
+                new_chunks,
+                api_keys=embedding_keys,
+                embedding_model_name=embedding_model_name
+            )
+            await add_chunks([
+                {
+                    'id': str(uuid.uuid4()),
+                    'content': text,
+                    'embedding': vector,
+                    'metadata': build_chunk_metadata(
+                        detail_id, category_id, is_active,
+                        content=text,
+                        embedding_model=embedding_model
+                    )
+                }
+                for text, vector in zip(new_chunks, new_vectors)
+            ])
+
+        # Thêm chunk mới trước rồi mới xóa chunk cũ -> lỗi giữa chừng không làm mất tài liệu
+        await delete_chunk_ids(stale_ids)
+
+        logger.info(
+            f"Rich text detail_id={detail_id}: giữ {len(all_chunks) - len(new_chunks)}, "
+            f"embed {len(new_chunks)}, xóa {len(stale_ids)} chunks"
+        )
+        return True
+
+    except Exception as e:
+        logger.error(f"Lỗi cập nhật tăng dần rich text detail_id={detail_id}: {str(e)}")
+        return False
+
+
+async def index_document_text(
+    text_content: str,
+    detail_id: int,
+    category_id: Optional[int],
+    is_active: bool,
+    chunk_size: int,
+    chunk_overlap: int,
+    embedding_model_name: str,
+    embedding_keys: List[str],
+    collection_name: str,
+    max_concurrency: Optional[int] = None
+) -> int:
+    """
+    Chunk + embed + lưu 1 tài liệu vào collection chỉ định với model embedding chỉ định
+    (dùng cho re-index sang collection mới). Trả về số chunk đã lưu, raise nếu lỗi.
+    """
+    text_splitter = RecursiveCharacterTextSplitter(
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap
+    )
+    all_chunks = text_splitter.split_text(text_content or "")
+    if not all_chunks:
+        return 0
+
+    options = {"max_concurrency": max_concurrency} if max_concurrency else {}
+    all_vectors = await get_embeddings_batched(
+        all_chunks,
+        api_keys=embedding_keys,
+        embedding_model_name=embedding_model_name,
+        **options
+    )
+
+    embedding_model = resolve_embedding_model(embedding_model_name)
+    await add_chunks([
+        {
+            'id': str(uuid.uuid4()),
+            'content': text,
+            'embedding': list(vector),
+            'metadata': build_chunk_metadata(
+                detail_id, category_id, is_active,
+                content=text,
+                embedding_model=embedding_model
+            )
+        }
+        for text, vector in zip(all_chunks, all_vectors)
+    ], collection_name=collection_name)
+    return len(all_chunks)
@@ -11,22 +11,26 @@ from models.facebook_page import FacebookPage
 from models.telegram_page import TelegramBot
 from models.zalo import ZaloBot
 from helper.help_redis import (
-    get_cached_session_data,
-    cache_session_data,
-    get_cached_session_id_by_name,
-    cache_session_name_mapping,
-    get_cached_check_reply_result,
-    cache_check_reply_result,
-    update_session_cache,
+    async_get_cached_session_data,
+    async_cache_session_data,
+    async_get_cached_session_id_by_name,
+    async_cache_session_name_mapping,
+    async_get_cached_check_reply_result,
+    async_cache_check_reply_result,
+    async_update_session_cache,
     session_to_dict,  # Import session_to_dict từ help_redis
-    get_cached_page_active_status,
-    cache_page_active_status
+    async_get_cached_page_active_status,
+    async_cache_page_active_status,
+    async_get_session_cache_bundle
 )
 
 
-async def get_session_by_id_cached(session_id: int, db) -> dict:
-    # Kiểm tra cache trước (sử dụng helper)
-    cached_session = get_cached_session_data(session_id)
+async def get_session_by_id_cached(session_id: int, db, cached: dict = None) -> dict:
+    # Kiểm tra cache trước (sử dụng helper); cached = bundle đã đọc sẵn (async_get_session_cache_bundle)
+    if cached is not None:
+        cached_session = cached.get('session')
+    else:
+        cached_session = await async_get_cached_session_data(session_id)
     
     if cached_session:
         return cached_session
@@ -40,18 +44,20 @@ async def get_session_by_id_cached(session_id: int, db) -> dict:
     
     # Convert sang dict và cache (sử dụng helper)
     session_data = session_to_dict(session)
-    cache_session_data(session_id, session_data, ttl=300)
+    await async_cache_session_data(session_id, session_data, ttl=300)
+    if cached is not None:
+        cached['session'] = session_data
     
     return session_data
 
 
 async def get_or_create_session_by_name_cached(session_name: str, platform: str, page_id: str, db) -> dict:
     # Kiểm tra cache trước (sử dụng helper)
-    cached_session_id = get_cached_session_id_by_name(session_name)
+    cached_session_id = await async_get_cached_session_id_by_name(session_name)
     
     if cached_session_id:
         # Lấy session data từ cache theo ID (sử dụng helper)
-        session_data = get_cached_session_data(cached_session_id)
+        session_data = await async_get_cached_session_data(cached_session_id)
         if session_data:
             return session_data
     
@@ -76,12 +82,30 @@ async def get_or_create_session_by_name_cached(session_name: str, platform: str,
     session_data = session_to_dict(session)
     
     # Cache session theo cả ID và name
-    cache_session_data(session.id, session_data, ttl=300)
-    cache_session_name_mapping(session_name, session.id, ttl=300)
+    await async_cache_session_data(session.id, session_data, ttl=300)
+    await async_cache_session_name_mapping(session_name, session.id, ttl=300)
     
     return session_data
 
 
+async def get_page_session_state(session_name: str, platform: str, page_id: str, db) -> tuple:
+    """
+    Session của tin nhắn từ page + bundle cache (session, check reply, page active)
+    Cache hit: 2 round trip (name -> id, rồi MGET 3 key)
+    """
+    cached_session_id = await async_get_cached_session_id_by_name(session_name)
+    
+    if cached_session_id:
+        cached = await async_get_session_cache_bundle(cached_session_id, platform, page_id)
+        if cached['session']:
+            return cached['session'], cached
+    
+    session_data = await get_or_create_session_by_name_cached(session_name, platform, page_id, db)
+    cached = await async_get_session_cache_bundle(session_data['id'], platform, page_id)
+    cached['session'] = session_data
+    return session_data, cached
+
+
 def get_platform_prefix(platform: str) -> str:
    
     platform_map = {
@@ -98,17 +122,20 @@ def build_session_name(platform: str, sender_id: str) -> str:
     return f"{prefix}-{sender_id}"
 
 
-async def check_repply_cached(id: int, db):
+async def check_repply_cached(id: int, db, cached: dict = None):
     
     try:
-        # Kiểm tra cache trước (sử dụng helper)
-        cached_result = get_cached_check_reply_result(id)
+        # Kiểm tra cache trước (sử dụng helper); cached = bundle đã đọc sẵn
+        if cached is not None:
+            cached_result = cached.get('check_reply')
+        else:
+            cached_result = await async_get_cached_check_reply_result(id)
         
         if cached_result is not None:
             return cached_result['can_reply']
         
         # Lấy session từ cache hoặc database (sử dụng helper)
-        session_data = await get_session_by_id_cached(id, db)
+        session_data = await get_session_by_id_cached(id, db, cached=cached)
         
         if not session_data:
             return False
@@ -130,7 +157,7 @@ async def check_repply_cached(id: int, db):
                 await db.refresh(session)
                 
                 # Cập nhật cache session (sử dụng helper)
-                update_session_cache(session)
+                await async_update_session_cache(session)
                 can_reply = True
         elif session_status == "true":
             # Bot đang được phép reply
@@ -140,7 +167,7 @@ async def check_repply_cached(id: int, db):
             can_reply = False
         
         # Cache kết quả check_reply trong 300 giây (sử dụng helper)
-        cache_check_reply_result(id, can_reply, ttl=300)
+        await async_cache_check_reply_result(id, can_reply, ttl=300)
         
         return can_reply
         
@@ -150,11 +177,14 @@ async def check_repply_cached(id: int, db):
         return False
 
 
-async def check_page_active_status(platform: str, page_id: str, db) -> bool:
+async def check_page_active_status(platform: str, page_id: str, db, cached: dict = None) -> bool:
     
     try:
-        # Kiểm tra cache trước (sử dụng helper)
-        cached_result = get_cached_page_active_status(platform, page_id)
+        # Kiểm tra cache trước (sử dụng helper); cached = bundle đã đọc sẵn
+        if cached is not None:
+            cached_result = cached.get('page_active')
+        else:
+            cached_result = await async_get_cached_page_active_status(platform, page_id)
         
         if cached_result is not None:
             return cached_result['is_active']
@@ -184,7 +214,7 @@ async def check_page_active_status(platform: str, page_id: str, db) -> bool:
             is_active = bot.is_active if bot else False
         
         # Cache kết quả trong 10 phút (600 giây) - đủ lâu để giảm query nhưng vẫn update nhanh
-        cache_page_active_status(platform, page_id, is_active, ttl=600)
+        await async_cache_page_active_status(platform, page_id, is_active, ttl=600)
         
         return is_active
             
@@ -1,9 +1,20 @@
 """
 Helper functions cho Redis cache operations
 Quản lý tập trung các cache keys và operations liên quan đến chat sessions
+Mỗi operation có 2 bản: sync (script / code sync) và async_* (dùng trong request handler,
+không chặn event loop)
 """
 
-from config.redis_cache import cache_get, cache_set, cache_delete
+from config.redis_cache import (
+    cache_get,
+    cache_set,
+    cache_delete,
+    async_cache_get,
+    async_cache_set,
+    async_cache_delete,
+    async_cache_get_many,
+    async_cache_delete_many
+)
 
 
 # ==================== Helper Functions ====================
@@ -263,3 +274,95 @@ def clear_page_active_cache(platform: str, page_id: str) -> None:
     """
     cache_key = get_page_active_cache_key(platform, page_id)
     cache_delete(cache_key)
+
+
+# ==================== Async Operations ====================
+# Cùng cache key / TTL mặc định với bản sync ở trên
+
+async def async_cache_session_data(session_id: int, session_data: dict, ttl: int = 300) -> None:
+    """Bản async của cache_session_data"""
+    await async_cache_set(get_session_cache_key(session_id), session_data, ttl=ttl)
+
+
+async def async_get_cached_session_data(session_id: int) -> dict:
+    """Bản async của get_cached_session_data"""
+    return await async_cache_get(get_session_cache_key(session_id))
+
+
+async def async_cache_session_name_mapping(session_name: str, session_id: int, ttl: int = 300) -> None:
+    """Bản async của cache_session_name_mapping"""
+    await async_cache_set(get_session_by_name_cache_key(session_name), session_id, ttl=ttl)
+
+
+async def async_get_cached_session_id_by_name(session_name: str) -> int:
+    """Bản async của get_cached_session_id_by_name"""
+    return await async_cache_get(get_session_by_name_cache_key(session_name))
+
+
+async def async_update_session_cache(session, ttl: int = 300) -> None:
+    """Bản async của update_session_cache"""
+    await async_cache_session_data(session.id, session_to_dict(session), ttl=ttl)
+
+
+async def async_clear_session_cache(session_id: int) -> None:
+    """Bản async của clear_session_cache (1 lệnh DEL cho cả 2 key)"""
+    await async_cache_delete_many([get_session_cache_key(session_id), get_check_reply_cache_key(session_id)])
+
+
+async def async_cache_check_reply_result(session_id: int, can_reply: bool, ttl: int = 300) -> None:
+    """Bản async của cache_check_reply_result"""
+    await async_cache_set(get_check_reply_cache_key(session_id), {'can_reply': can_reply}, ttl=ttl)
+
+
+async def async_get_cached_check_reply_result(session_id: int) -> dict:
+    """Bản async của get_cached_check_reply_result"""
+    return await async_cache_get(get_check_reply_cache_key(session_id))
+
+
+async def async_clear_check_reply_cache(session_id: int) -> None:
+    """Bản async của clear_check_reply_cache"""
+    await async_cache_delete(get_check_reply_cache_key(session_id))
+
+
+async def async_clear_all_session_caches(session_id: int) -> None:
+    """Bản async của clear_all_session_caches"""
+    await async_clear_session_cache(session_id)
+
+
+async def async_cache_page_active_status(platform: str, page_id: str, is_active: bool, ttl: int = 600) -> None:
+    """Bản async của cache_page_active_status"""
+    await async_cache_set(get_page_active_cache_key(platform, page_id), {'is_active': is_active}, ttl=ttl)
+
+
+async def async_get_cached_page_active_status(platform: str, page_id: str) -> dict:
+    """Bản async của get_cached_page_active_status"""
+    return await async_cache_get(get_page_active_cache_key(platform, page_id))
+
+
+async def async_clear_page_active_cache(platform: str, page_id: str) -> None:
+    """Bản async của clear_page_active_cache"""
+    await async_cache_delete(get_page_active_cache_key(platform, page_id))
+
+
+async def async_get_session_cache_bundle(session_id: int, platform: str = None, page_id: str = None) -> dict:
+    """
+    Lấy session data, kết quả check reply và trạng thái page (nếu có platform) trong 1 round trip
+    
+    Args:
+        session_id: ID của chat session
+        platform: Tên platform (facebook, telegram, zalo), None nếu không cần trạng thái page
+        page_id: ID của page/bot
+        
+    Returns:
+        dict: {'session': dict | None, 'check_reply': dict | None, 'page_active': dict | None}
+    """
+    session_key = get_session_cache_key(session_id)
+    reply_key = get_check_reply_cache_key(session_id)
+    page_key = get_page_active_cache_key(platform, page_id) if platform else None
+    
+    values = await async_cache_get_many([key for key in (session_key, reply_key, page_key) if key])
+    return {
+        'session': values.get(session_key),
+        'check_reply': values.get(reply_key),
+        'page_active': values.get(page_key) if page_key else None
+    }
@@ -0,0 +1,60 @@
+"""
+Đo thời gian từng stage trong pipeline trả lời của bot
+- Mỗi stage ghi lại thời điểm bắt đầu (tính từ lúc tạo timer) và thời gian chạy
+- Các stage chạy song song vẫn đo riêng -> nhìn log thấy được critical path
+"""
+
+import logging
+import time
+from contextlib import asynccontextmanager
+from typing import Awaitable, Dict, List, TypeVar
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class StageTimer:
+    def __init__(self, name: str):
+        self.name = name
+        self._started = time.perf_counter()
+        self._stages: List[Dict] = []
+
+    def _record(self, stage: str, start: float) -> None:
+        end = time.perf_counter()
+        self._stages.append({
+            "stage": stage,
+            "start_ms": round((start - self._started) * 1000, 1),
+            "duration_ms": round((end - start) * 1000, 1),
+        })
+
+    @asynccontextmanager
+    async def stage(self, stage: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._record(stage, start)
+
+    async def run(self, stage: str, awaitable: Awaitable[T]) -> T:
+        """Await 1 coroutine và ghi lại thời gian của nó (dùng với asyncio.create_task)"""
+        async with self.stage(stage):
+            return await awaitable
+
+    def elapsed_ms(self) -> float:
+        return round((time.perf_counter() - self._started) * 1000, 1)
+
+    def summary(self) -> Dict:
+        return {
+            "name": self.name,
+            "total_ms": self.elapsed_ms(),
+            "stages": sorted(self._stages, key=lambda s: s["start_ms"]),
+        }
+
+    def log(self) -> None:
+        summary = self.summary()
+        stages = " ".join(
+            f"{s['stage']}=+{s['start_ms']:.0f}/{s['duration_ms']:.0f}ms"
+            for s in summary["stages"]
+        )
+        logger.info(f"⏱️ {self.name} total={summary['total_ms']:.0f}ms {stages}")
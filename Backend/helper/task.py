@@ -6,12 +6,13 @@ from datetime import datetime, timedelta
 from sqlalchemy import select
 from models.knowledge_base import KnowledgeBase
 from models.chat import ChatSession, Message
-from config.redis_cache import cache_set
+from config.redis_cache import async_cache_set
 from config.database import AsyncSessionLocal
 import gspread
 from sqlalchemy.ext.asyncio import AsyncSession
 from llm.help_llm import generate_response_prompt, get_current_model
 
+LLM_STREAMING_ENABLED = os.getenv("LLM_STREAMING_ENABLED", "true").lower() == "true"
     
 
 
@@ -62,7 +63,7 @@ async def update_session_admin_background(chat_session_id: int, sender_name: str
                     'previous_receiver': db_session.previous_receiver,
                     'time': db_session.time.isoformat() if db_session.time else None
                 }
-                cache_set(session_cache_key, session_data, ttl=300)
+                await async_cache_set(session_cache_key, session_data, ttl=300)
                 print(f"✅ [Background] Đã cập nhật session {chat_session_id}")
                 
         except Exception as e:
@@ -127,7 +128,8 @@ async def notify_missing_information(chat_session_id: int, user_question: str, b
 async def _generate_bot_response_common(
     user_content: str,
     chat_session_id: int,
-    new_db: AsyncSession
+    new_db: AsyncSession,
+    on_delta=None
 ) -> dict:
    
     # Lấy thông tin model và cấu hình từ LLM
@@ -144,6 +146,8 @@ async def _generate_bot_response_common(
     # Mặc định nếu không có
     topk = llm.topk if llm and llm.topk else 5
     custom_prompt = llm.prompt if llm and llm.prompt else ""
+    rerank_enabled = bool(llm and llm.rerank_enabled)
+    rerank_candidates = llm.rerank_candidates if llm else None
     
     
     bot_key = model_info["bot"]["key"]
@@ -161,7 +165,12 @@ async def _generate_bot_response_common(
         embedding_key=embedding_key,
         embedding_model_name=embedding_model_name,
         topk=topk,
-        custom_prompt=custom_prompt
+        custom_prompt=custom_prompt,
+        on_delta=on_delta,
+        rerank_enabled=rerank_enabled,
+        rerank_candidates=rerank_candidates,
+        bot_keys=model_info["bot"].get("keys"),
+        embedding_keys=model_info["embedding"].get("keys")
     )
     
     message_bot = Message(
@@ -205,9 +214,19 @@ async def generate_and_send_bot_response_background(
 ):
     async with AsyncSessionLocal() as new_db:
         try:
+            # Stream từng đoạn câu trả lời tới customer, tin nhắn đầy đủ vẫn gửi ở cuối
+            async def send_delta(delta: str):
+                await manager.send_to_customer(chat_session_id, {
+                    "type": "bot_delta",
+                    "chat_session_id": chat_session_id,
+                    "sender_type": "bot",
+                    "delta": delta
+                })
+            
             # Generate response sử dụng hàm chung
             bot_message_data = await _generate_bot_response_common(
-                user_content, chat_session_id, new_db
+                user_content, chat_session_id, new_db,
+                on_delta=send_delta if LLM_STREAMING_ENABLED else None
             )
             
             # Tạo bot message để gửi qua websocket
@@ -0,0 +1,156 @@
+"""
+Đóng gói ngữ cảnh cho prompt theo ngân sách token
+- Kiến thức: bỏ metadata / distance, loại chunk trùng và phần chồng lấp giữa các chunk
+  liền nhau của cùng tài liệu (text splitter dùng chunk_overlap), lấy theo thứ tự điểm
+  cho tới khi hết PROMPT_CONTEXT_TOKEN_BUDGET
+- Lịch sử: giữ các tin nhắn mới nhất trong PROMPT_HISTORY_TOKEN_BUDGET, tin của bot chỉ
+  lấy phần "message" (bỏ JSON / links)
+- Đếm token bằng tiktoken nếu có, không thì ước lượng theo số ký tự
+"""
+
+import json
+import logging
+import os
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+PROMPT_CONTEXT_TOKEN_BUDGET = int(os.getenv("PROMPT_CONTEXT_TOKEN_BUDGET", 3000))
+PROMPT_HISTORY_TOKEN_BUDGET = int(os.getenv("PROMPT_HISTORY_TOKEN_BUDGET", 800))
+
+# Phần chồng lấp ngắn hơn ngưỡng này coi như trùng ngẫu nhiên, không cắt
+MIN_OVERLAP_CHARS = 20
+# Còn ít hơn số token này thì không cắt thêm 1 chunk dở dang vào prompt
+MIN_PARTIAL_TOKENS = 60
+# Tiếng Việt: trung bình ~3 ký tự / token với tokenizer của OpenAI
+CHARS_PER_TOKEN = 3
+
+HISTORY_TRUNCATED_MARKER = "(...các tin nhắn trước đã được lược bớt)"
+
+try:
+    import tiktoken
+
+    _encoding = tiktoken.get_encoding("o200k_base")
+except Exception:
+    _encoding = None
+
+
+def count_tokens(text: str) -> int:
+    if not text:
+        return 0
+    if _encoding is not None:
+        return len(_encoding.encode(text, disallowed_special=()))
+    return max(1, len(text) // CHARS_PER_TOKEN)
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    if max_tokens <= 0:
+        return ""
+    if _encoding is not None:
+        tokens = _encoding.encode(text, disallowed_special=())
+        return text if len(tokens) <= max_tokens else _encoding.decode(tokens[:max_tokens])
+    return text[:max_tokens * CHARS_PER_TOKEN]
+
+
+# ================== KIẾN THỨC ==================
+def _strip_overlap(previous: str, text: str) -> str:
+    """Bỏ phần đầu của text trùng với phần cuối của previous (overlap của splitter)"""
+    for size in range(min(len(previous), len(text)), MIN_OVERLAP_CHARS - 1, -1):
+        if previous.endswith(text[:size]):
+            return text[size:].lstrip()
+    return text
+
+
+def _strip_overlap_tail(text: str, following: str) -> str:
+    """Bỏ phần cuối của text trùng với phần đầu của following"""
+    for size in range(min(len(following), len(text)), MIN_OVERLAP_CHARS - 1, -1):
+        if following.startswith(text[-size:]):
+            return text[:-size].rstrip()
+    return text
+
+
+def dedupe_chunks(chunks: List[Dict]) -> List[str]:
+    """Giữ thứ tự điểm, trả về text đã loại trùng / chồng lấp"""
+    passages: List[str] = []
+    by_document: Dict[str, List[str]] = {}
+
+    for chunk in chunks:
+        text = (chunk.get("text") or "").strip()
+        if not text:
+            continue
+
+        knowledge_id = str((chunk.get("metadata") or {}).get("knowledge_id", ""))
+        seen = by_document.setdefault(knowledge_id, [])
+        if any(text in other for other in seen):
+            continue
+
+        # Chunk liền nhau trong cùng tài liệu: overlap ở đầu hoặc ở cuối
+        for other in seen:
+            text = _strip_overlap_tail(_strip_overlap(other, text), other)
+        if len(text) < MIN_OVERLAP_CHARS:
+            continue
+
+        seen.append(text)
+        passages.append(text)
+
+    return passages
+
+
+def pack_knowledge(chunks: List[Dict], token_budget: Optional[int] = None) -> str:
+    token_budget = PROMPT_CONTEXT_TOKEN_BUDGET if token_budget is None else token_budget
+    passages = dedupe_chunks(chunks or [])
+
+    packed = []
+    used = 0
+    for passage in passages:
+        header = f"[{len(packed) + 1}] "
+        tokens = count_tokens(header + passage)
+        remaining = token_budget - used
+        if tokens <= remaining:
+            packed.append(header + passage)
+            used += tokens
+            continue
+        if remaining >= MIN_PARTIAL_TOKENS or not packed:
+            packed.append(header + truncate_to_tokens(passage, remaining - count_tokens(header)))
+            used = token_budget
+        break
+
+    logger.debug(f"Context packing: {len(chunks or [])} chunks -> {len(packed)} đoạn, ~{used} tokens")
+    return "\n\n".join(packed)
+
+
+# ================== LỊCH SỬ ==================
+def _message_text(sender_type: str, content: Optional[str]) -> str:
+    content = content or ""
+    if sender_type == "bot":
+        try:
+            data = json.loads(content)
+            if isinstance(data, dict) and data.get("message"):
+                return data["message"]
+        except (TypeError, ValueError):
+            pass
+    return content
+
+
+def format_history(messages: List[Dict], token_budget: Optional[int] = None) -> str:
+    """messages theo thứ tự cũ -> mới: [{"sender_type", "content"}]"""
+    token_budget = PROMPT_HISTORY_TOKEN_BUDGET if token_budget is None else token_budget
+
+    lines: List[str] = []
+    used = 0
+    for msg in reversed(messages):
+        line = f"{msg['sender_type']}: {_message_text(msg['sender_type'], msg.get('content'))}"
+        tokens = count_tokens(line)
+        if lines and used + tokens > token_budget:
+            lines.append(HISTORY_TRUNCATED_MARKER)
+            break
+        if not lines and tokens > token_budget:
+            # Tin nhắn mới nhất (câu hỏi hiện tại) luôn giữ nguyên
+            lines.append(line)
+            if len(messages) > 1:
+                lines.append(HISTORY_TRUNCATED_MARKER)
+            break
+        lines.append(line)
+        used += tokens
+
+    return "\n".join(reversed(lines))
@@ -1,47 +1,85 @@
 import os
-import json
-import re
-from typing import Optional
-import google.generativeai as genai
+import asyncio
+import time
+from typing import Awaitable, Callable, Optional
+from google.ai import generativelanguage as glm
+from config.llm_clients import llm_clients
+from llm.stream_message import MessageStream, to_json_response, error_response
+from llm.key_health import report_key_result
 
+# Giới hạn số request Gemini chạy song song trong 1 worker
+GEMINI_MAX_CONCURRENCY = int(os.getenv("GEMINI_MAX_CONCURRENCY", 16))
+_gemini_semaphore = asyncio.Semaphore(GEMINI_MAX_CONCURRENCY)
+
+
+def _build_request(prompt: str, model_name: str, system_prompt: Optional[str] = None) -> glm.GenerateContentRequest:
+    options = {}
+    if system_prompt:
+        # system_instruction giống nhau giữa các request -> Gemini implicit caching dùng lại prefix
+        options["system_instruction"] = glm.Content(parts=[glm.Part(text=system_prompt)])
+    return glm.GenerateContentRequest(
+        model=f"models/{model_name}",
+        contents=[glm.Content(role="user", parts=[glm.Part(text=prompt)])],
+        **options
+    )
+
+
+def _response_text(response) -> str:
+    if not response.candidates:
+        return ""
+    return "".join(part.text for part in response.candidates[0].content.parts)
 
 
 async def generate_gemini_response(
     api_key: str,
     prompt: str,
-    model_name: str = "gemini-2.0-flash-001"
+    model_name: str = "gemini-2.0-flash-001",
+    system_prompt: Optional[str] = None
 ) -> str:
     
     try:
-        # Cấu hình GenAI
-        genai.configure(api_key=api_key)
-        model = genai.GenerativeModel(model_name)
+        # Client riêng theo key (không đụng vào cấu hình toàn cục của SDK)
+        client = llm_clients.get_gemini_client(api_key)
 
-        # Sinh response
-        response_text = model.generate_content(prompt).text.strip()
+        # Sinh response (async, không block event loop)
+        async with _gemini_semaphore:
+            started_at = time.perf_counter()
+            response = await client.generate_content(request=_build_request(prompt, model_name, system_prompt))
+        response_text = _response_text(response).strip()
+        if not response_text:
+            raise ValueError("Gemini trả về response rỗng")
+        report_key_result(api_key, ok=True, latency_ms=(time.perf_counter() - started_at) * 1000)
         
         # Parse JSON response
-        try:
-            cleaned_response = re.sub(r'```json\s*|\s*```', '', response_text).strip()
-            json_data = json.loads(cleaned_response)
+        return to_json_response(response_text)
 
+    except Exception as e:
+        print(f"❌ Lỗi khi gọi Gemini API: {e}")
+        report_key_result(api_key, ok=False, error=e)
+        return error_response()
 
-            return json.dumps(json_data, ensure_ascii=False)
 
-        except (json.JSONDecodeError, ValueError) as e:
-            fallback_response = {
-                "message": response_text,
-                "links": []
-            }
-            return json.dumps(fallback_response, ensure_ascii=False)
+async def generate_gemini_response_stream(
+    api_key: str,
+    prompt: str,
+    on_delta: Callable[[str], Awaitable[None]],
+    model_name: str = "gemini-2.0-flash-001",
+    system_prompt: Optional[str] = None
+) -> str:
+    """Giống generate_gemini_response nhưng đẩy từng đoạn message qua on_delta khi nhận được"""
 
-    except Exception as e:
-        print(f"❌ Lỗi khi gọi Gemini API: {e}")
-        error_response = {
-            "message": "Xin lỗi, đã có lỗi xảy ra khi xử lý câu hỏi của bạn.",
-            "links": []
-        }
-        return json.dumps(error_response, ensure_ascii=False)
+    try:
+        client = llm_clients.get_gemini_client(api_key)
+        message_stream = MessageStream(api_key, model_name, on_delta)
 
+        async with _gemini_semaphore:
+            stream = await client.stream_generate_content(request=_build_request(prompt, model_name, system_prompt))
+            async for chunk in stream:
+                await message_stream.feed(_response_text(chunk))
 
+        return message_stream.response()
 
+    except Exception as e:
+        print(f"❌ Lỗi khi gọi Gemini API (stream): {e}")
+        report_key_result(api_key, ok=False, error=e)
+        return error_response()
@@ -1,45 +1,71 @@
-import json
-import re
-from typing import Optional
-from openai import AsyncOpenAI
+import time
+from typing import Awaitable, Callable, Optional
+from config.llm_clients import llm_clients
+from llm.stream_message import MessageStream, to_json_response, error_response
+from llm.key_health import report_key_result
+
+
+def _build_messages(prompt: str, system_prompt: Optional[str] = None) -> list:
+    # System prompt cố định đặt trước -> OpenAI tự cache prefix (>= 1024 tokens)
+    messages = []
+    if system_prompt:
+        messages.append({"role": "system", "content": system_prompt})
+    messages.append({"role": "user", "content": prompt})
+    return messages
 
 
 async def generate_gpt_response(
     api_key: str,
     prompt: str,
-    model_name: str = "gpt-4o-mini"
+    model_name: str = "gpt-4o-mini",
+    system_prompt: Optional[str] = None
 ) -> str:
 
     try:
-        client = AsyncOpenAI(api_key=api_key)
+        client = llm_clients.get_openai_client(api_key)
+        started_at = time.perf_counter()
         response = await client.chat.completions.create(
             model=model_name,
-            messages=[{"role": "user", "content": prompt}],
+            messages=_build_messages(prompt, system_prompt),
             temperature=0.7
         )
-        await client.close()
+        report_key_result(api_key, ok=True, latency_ms=(time.perf_counter() - started_at) * 1000)
 
         response_text = response.choices[0].message.content.strip()
 
-        try:
-            cleaned_response = re.sub(r'```json\s*|\s*```', '', response_text).strip()
-            json_data = json.loads(cleaned_response)
+        return to_json_response(response_text)
+
+    except Exception as e:
+        report_key_result(api_key, ok=False, error=e)
+        return error_response()
 
 
-            return json.dumps(json_data, ensure_ascii=False)
+async def generate_gpt_response_stream(
+    api_key: str,
+    prompt: str,
+    on_delta: Callable[[str], Awaitable[None]],
+    model_name: str = "gpt-4o-mini",
+    system_prompt: Optional[str] = None
+) -> str:
+    """Giống generate_gpt_response nhưng đẩy từng đoạn message qua on_delta khi nhận được"""
 
-        except (json.JSONDecodeError, ValueError) as e:
-            fallback_response = {
-                "message": response_text,
-                "links": []
-            }
-            return json.dumps(fallback_response, ensure_ascii=False)
+    try:
+        client = llm_clients.get_openai_client(api_key)
+        message_stream = MessageStream(api_key, model_name, on_delta)
 
-    except Exception as e:
-        error_response = {
-            "message": "Xin lỗi, đã có lỗi xảy ra khi xử lý câu hỏi của bạn.",
-            "links": []
-        }
-        return json.dumps(error_response, ensure_ascii=False)
+        stream = await client.chat.completions.create(
+            model=model_name,
+            messages=_build_messages(prompt, system_prompt),
+            temperature=0.7,
+            stream=True
+        )
+        async for chunk in stream:
+            if not chunk.choices:
+                continue
+            await message_stream.feed(chunk.choices[0].delta.content)
 
+        return message_stream.response()
 
+    except Exception as e:
+        report_key_result(api_key, ok=False, error=e)
+        return error_response()
@@ -1,13 +1,22 @@
-from typing import List, Dict, Tuple, Optional, Any
+import asyncio
+from typing import List, Dict, Tuple, Optional, Any, Awaitable, Callable
 from sqlalchemy import text, select, desc
 from sqlalchemy.orm import selectinload
 from sqlalchemy.ext.asyncio import AsyncSession
-from config.get_embedding import get_embedding_chatgpt, get_embedding_gemini
+from config.get_embedding import get_embedding_chatgpt, get_embedding_gemini, resolve_embedding_model
+from config.embedding_cache import embedding_cache
+from config.kb_version import get_kb_version
+from llm.semantic_cache import semantic_cache, is_context_free
+from llm.reranker import reranker, rerank_candidate_count
 from models.chat import Message
 from models.llm import LLM, LLMKey
-from config.redis_cache import async_cache_get, async_cache_set
+from config.redis_cache import async_cache_get, async_cache_set, async_cache_get_many, async_cache_set_many
+from llm.key_health import select_keys
+from llm.rate_limiter import acquire_key, get_bucket_levels, is_rate_limited, LLM_EXPECTED_OUTPUT_TOKENS
 from llm.prompt import prompt_builder
-from config.chromadb_config import search_chunks
+from llm.context_packer import format_history, count_tokens
+from config.chromadb_config import search_chunks, get_active_index
+from helper.stage_timer import StageTimer
 
 
 async def get_all_key(db_session: AsyncSession, llm_detail_id: int) -> list:
@@ -36,76 +45,117 @@ async def get_all_key(db_session: AsyncSession, llm_detail_id: int) -> list:
     return keys
 
 
-async def get_round_robin_api_key(
-    db_session: AsyncSession,
-    model_info: dict,
-    chat_session_id: int = None
-) -> dict:
-
-    try:
-        keys_result = {}
-
-
-        if chat_session_id is None:
-            # Lấy key của embedding model
-            embedding_detail_id = model_info["embedding"]["id"]
-            llm_keys_all = await get_all_key(db_session, llm_detail_id=embedding_detail_id)
-            embedding_keys = [k for k in llm_keys_all if k["type"] == "embedding"]
-
+async def get_all_keys_many(db_session: AsyncSession, llm_detail_ids: List[int]) -> Dict[int, list]:
+    
+    # Lấy key của nhiều llm_detail trong 1 lần MGET, chỉ query database cho phần thiếu
+    llm_detail_ids = list(dict.fromkeys(llm_detail_ids))
+    cache_keys = {llm_detail_id: f"list_keys:llm_detail_{llm_detail_id}" for llm_detail_id in llm_detail_ids}
+    cached = await async_cache_get_many(list(cache_keys.values()))
+    
+    keys_by_detail = {}
+    missing = {}
+    for llm_detail_id, cache_key in cache_keys.items():
+        if cached.get(cache_key) is not None:
+            keys_by_detail[llm_detail_id] = cached[cache_key]
+            continue
+        
+        query = (
+            select(LLMKey.key, LLMKey.type, LLMKey.llm_detail_id)
+            .where(LLMKey.llm_detail_id == llm_detail_id)
+            .order_by(LLMKey.id)
+        )
+        result = await db_session.execute(query)
+        keys = [{"key": row.key, "type": row.type, "llm_detail_id": row.llm_detail_id} for row in result.all()]
+        keys_by_detail[llm_detail_id] = keys
+        missing[cache_key] = keys
+    
+    if missing:
+        await async_cache_set_many(missing, ttl=3600)
+    
+    return keys_by_detail
 
-            counter_key = f"llm_key_global_counter:llm_detail_{embedding_detail_id}:type_embedding"
-            current_counter = await async_cache_get(counter_key)
-            current_counter = int(current_counter) if current_counter is not None else 0
 
-            selected_index = current_counter % len(embedding_keys)
+async def warmup_llm_clients(db_session: AsyncSession) -> None:
+    
+    from models.llm import LLMDetail
+    from config.llm_clients import llm_clients
+    
+    # Lấy tất cả key của các model GPT để tạo sẵn client + kết nối
+    result = await db_session.execute(
+        select(LLMKey.key)
+        .join(LLMDetail, LLMDetail.id == LLMKey.llm_detail_id)
+        .where(~LLMDetail.name.ilike("%gemini%"))
+    )
+    await llm_clients.warmup([row.key for row in result.all()])
+    
+    # Load sẵn model rerank nếu đang bật (tránh request đầu tiên phải chờ load model)
+    rerank_result = await db_session.execute(select(LLM.id).where(LLM.rerank_enabled.is_(True)).limit(1))
+    if rerank_result.first() is not None:
+        await reranker.warmup()
 
-            # Cập nhật counter
-            await async_cache_set(counter_key, current_counter + 1, ttl=86400)
 
-            # Trả key embedding
-            keys_result["embedding_key"] = embedding_keys[selected_index]["key"]
+async def get_embedding_keys(db_session: AsyncSession) -> Tuple[str, List[str]]:
+    
+    # Tên model embedding + toàn bộ key embedding (dùng cho ingest tài liệu)
+    model_info = await get_llm_model_info_cached(db_session)
+    embedding_detail_id = model_info["embedding"]["id"]
+    llm_keys_all = await get_all_key(db_session, llm_detail_id=embedding_detail_id)
+    embedding_keys = [k["key"] for k in llm_keys_all if k["type"] == "embedding"]
+    
+    return model_info["embedding"]["name"], embedding_keys
 
-            return keys_result
-        
-        
-        
-        for key_type in ["bot", "embedding"]:
-            # Lấy llm_detail_id tương ứng
-            llm_detail_id = model_info[key_type]["id"]
-            
-            # Lấy key theo llm_detail_id và type
-            llm_keys_all = await get_all_key(db_session, llm_detail_id=llm_detail_id)
-            llm_keys = [k for k in llm_keys_all if k["type"] == key_type]
 
-            # Kiểm tra session cache
-            session_key = f"llm_key_session:session_{chat_session_id}:llm_detail_{llm_detail_id}:type_{key_type}"
-            assigned_index = await async_cache_get(session_key)
+async def get_round_robin_api_key(
+    db_session: AsyncSession,
+    model_info: dict,
+    chat_session_id: int = None
+) -> dict:
 
-            if assigned_index is not None:
-                keys_result[f"{key_type}_key"] = llm_keys[int(assigned_index)]["key"]
-                continue
+    # Không có session (ingest tài liệu) -> chỉ cần key embedding, không ghim
+    key_types = ["embedding"] if chat_session_id is None else ["bot", "embedding"]
 
-            # Session mới, Round-Robin
-            counter_key = f"llm_key_global_counter:llm_detail_{llm_detail_id}:type_{key_type}"
-            current_counter = await async_cache_get(counter_key)
-            current_counter = int(current_counter) if current_counter is not None else 0
+    # Key bot + embedding trong 1 round trip
+    keys_by_detail = await get_all_keys_many(db_session, [model_info[key_type]["id"] for key_type in key_types])
 
-            selected_index = current_counter % len(llm_keys)
+    groups = []
+    for key_type in key_types:
+        # Lọc key theo llm_detail_id và type
+        llm_detail_id = model_info[key_type]["id"]
+        llm_keys = [k["key"] for k in keys_by_detail[llm_detail_id] if k["type"] == key_type]
+        if not llm_keys:
+            raise ValueError(f"Không có key {key_type} cho llm_detail_id={llm_detail_id}")
 
-            # Cập nhật counter
-            await async_cache_set(counter_key, current_counter + 1, ttl=86400)
+        groups.append({"llm_detail_id": llm_detail_id, "key_type": key_type, "keys": llm_keys})
 
-            # Lưu session -> index
-            await async_cache_set(session_key, selected_index, ttl=3600)
+    # Chọn key theo sức khỏe (bỏ qua key đang ngắt, ưu tiên key ít lỗi / nhanh)
+    # và ghim session cho mọi loại key trong 1 round trip
+    indexes = await select_keys(groups, chat_session_id)
 
-            # Lưu key vào kết quả
-            keys_result[f"{key_type}_key"] = llm_keys[selected_index]["key"]
+    # Kèm toàn bộ key cùng loại: rate limiter chuyển sang key khác khi key được chọn hết lượt
+    keys_result = {}
+    for group, index in zip(groups, indexes):
+        keys_result[f"{group['key_type']}_key"] = group["keys"][index]
+        keys_result[f"{group['key_type']}_keys"] = group["keys"]
+    return keys_result
 
-        return keys_result
 
-    except Exception as e:
-        raise
 
+async def get_rate_limit_status(db_session: AsyncSession) -> dict:
+    
+    # Mức bucket RPM/TPM của từng key thuộc model bot / embedding đang dùng
+    model_info = await get_llm_model_info_cached(db_session)
+    
+    status = {}
+    for key_type in ["bot", "embedding"]:
+        llm_detail_id = model_info[key_type]["id"]
+        llm_keys_all = await get_all_key(db_session, llm_detail_id=llm_detail_id)
+        api_keys = [k["key"] for k in llm_keys_all if k["type"] == key_type]
+        status[key_type] = {
+            "model": model_info[key_type]["name"],
+            "keys": await get_bucket_levels(key_type, api_keys)
+        }
+    
+    return status
 
 
 async def get_llm_model_info_cached(db_session: AsyncSession) -> dict:
@@ -129,11 +179,20 @@ async def get_llm_model_info_cached(db_session: AsyncSession) -> dict:
     )
     bot_row = bot_result.first()
     
-    embedding_result = await db_session.execute(
-        select(LLMDetail.id, LLMDetail.name, LLMDetail.key_free)
-        .join(LLM, LLM.embedding_model_detail_id == LLMDetail.id)
-        .where(LLM.id == 1)
-    )
+    # Embedding: dùng model đã tạo ra collection đang active (không phải model vừa chọn
+    # trong LLM) -> vector câu hỏi luôn cùng không gian với vector tài liệu trong lúc re-index
+    active_detail_id = get_active_index().get("embedding_model_detail_id")
+    if active_detail_id:
+        embedding_result = await db_session.execute(
+            select(LLMDetail.id, LLMDetail.name, LLMDetail.key_free)
+            .where(LLMDetail.id == active_detail_id)
+        )
+    else:
+        embedding_result = await db_session.execute(
+            select(LLMDetail.id, LLMDetail.name, LLMDetail.key_free)
+            .join(LLM, LLM.embedding_model_detail_id == LLMDetail.id)
+            .where(LLM.id == 1)
+        )
     
     
     embedding_row = embedding_result.first()
@@ -169,7 +228,8 @@ async def get_current_model(db_session: AsyncSession, chat_session_id: int = Non
             return {
                 "embedding": {
                     "name": model_info["embedding"]["name"],
-                    "key": keys_result["embedding_key"]
+                    "key": keys_result["embedding_key"],
+                    "keys": keys_result["embedding_keys"]
                 }
             }
 
@@ -181,12 +241,14 @@ async def get_current_model(db_session: AsyncSession, chat_session_id: int = Non
         
         result["bot"] = {
                 "name":model_info["embedding"]["name"],
-                "key": keys["bot_key"]
+                "key": keys["bot_key"],
+                "keys": keys["bot_keys"]
             }
         
         result["embedding"] = {
             "name": model_info["embedding"]["name"],
-            "key": keys["embedding_key"]
+            "key": keys["embedding_key"],
+            "keys": keys["embedding_keys"]
         }
         return result
             
@@ -232,18 +294,38 @@ async def get_latest_messages(
         for m in reversed(messages) 
     ]
 
-    conversation = []
-    for msg in results:
-        line = f"{msg['sender_type']}: {msg['content']}"
-        conversation.append(line)
-    
-    conversation_text = "\n".join(conversation)
-    
-    return conversation_text
+    # Giữ các tin mới nhất trong ngân sách token (PROMPT_HISTORY_TOKEN_BUDGET)
+    return format_history(results)
 
 
 
 
+async def embed_query(
+    query: str,
+    embedding_key: str,
+    embedding_model_name: str,
+    embedding_keys: Optional[List[str]] = None
+) -> List[float]:
+    
+    # Câu hỏi lặp lại -> lấy embedding từ cache, bỏ qua round trip tới API
+    model = resolve_embedding_model(embedding_model_name)
+    cached_vector = await embedding_cache.get(query, model)
+    if cached_vector is not None:
+        return cached_vector
+    
+    # Key hết lượt (RPM/TPM) -> chờ ngắn hoặc chuyển sang key embedding khác
+    if is_rate_limited("embedding"):
+        embedding_key = await acquire_key("embedding", embedding_key, count_tokens(query), embedding_keys)
+    
+    if "gemini" in embedding_model_name.lower():
+        vector = await get_embedding_gemini(text_input=query, api_key=embedding_key)
+    else:
+        vector = await get_embedding_chatgpt(text_input=query, api_key=embedding_key)
+    
+    await embedding_cache.set(query, model, vector)
+    return vector
+
+
 async def search_similar_documents(
     query: str, 
     top_k: int,
@@ -254,16 +336,14 @@ async def search_similar_documents(
     
     try:
         
-        if "gemini" in embedding_model_name.lower():
-            all_vector = await get_embedding_gemini(text_input = query,api_key=embedding_key)
-        else:
-            all_vector = await get_embedding_chatgpt(text_input = query, api_key=embedding_key)
+        all_vector = await embed_query(query, embedding_key, embedding_model_name)
         
         
         
         data = await search_chunks(
             query_embedding=all_vector,
-            top_k=top_k
+            top_k=top_k,
+            query_text=query
         )
         
         
@@ -288,81 +368,156 @@ async def generate_response_prompt(
     embedding_key: str,
     embedding_model_name: str,
     topk: int = 5,
-    custom_prompt: str = ""
+    custom_prompt: str = "",
+    on_delta: Optional[Callable[[str], Awaitable[None]]] = None,
+    rerank_enabled: bool = False,
+    rerank_candidates: Optional[int] = None,
+    bot_keys: Optional[List[str]] = None,
+    embedding_keys: Optional[List[str]] = None
 ) -> dict:
     
+    timer = StageTimer(f"reply session={chat_session_id}")
+    tasks: List[asyncio.Task] = []
     try:
         
-        # Lấy lịch sử
-        history = await get_latest_messages(db_session, chat_session_id, limit=10)
-        
-                
-        # Tìm kiếm tài liệu - sử dụng topk từ tham số
-        knowledge = await search_similar_documents(
-            query, 
-            top_k=topk,
-            embedding_key=embedding_key,
-            embedding_model_name=embedding_model_name
+        # Các stage độc lập chạy song song:
+        #   history (DB)  ||  embedding câu hỏi -> retrieval (vector + BM25)
+        history_task = asyncio.create_task(
+            timer.run("history", get_latest_messages(db_session, chat_session_id, limit=10))
         )
+        embed_task = asyncio.create_task(
+            timer.run("embed", embed_query(query, embedding_key, embedding_model_name, embedding_keys))
+        )
+        # Version KB đọc trước khi retrieval bắt đầu (chạy song song với embedding): câu trả lời lưu vào
+        # semantic cache mang version của đúng tập chunk đã dùng để sinh ra nó
+        kb_version = await get_kb_version()
+        
+        async def _retrieve():
+            query_vector = await embed_task
+            # Tìm kiếm tài liệu - sử dụng topk từ tham số
+            # (bật rerank -> lấy rộng hơn rồi để cross-encoder chọn lại topk)
+            candidates = await timer.run("retrieval", search_chunks(
+                query_embedding=query_vector,
+                top_k=rerank_candidate_count(topk, rerank_candidates) if rerank_enabled else topk,
+                query_text=query
+            ))
+            if not rerank_enabled:
+                return candidates
+            return await timer.run("rerank", reranker.rerank(query, candidates, topk))
+        
+        retrieval_task = asyncio.create_task(_retrieve())
+        tasks = [history_task, embed_task, retrieval_task]
+        embedding_model = resolve_embedding_model(embedding_model_name)
+        
+        history = await history_task
+        
+        # Semantic cache: chỉ áp dụng khi câu hỏi không phụ thuộc ngữ cảnh hội thoại
+        use_semantic_cache = is_context_free(history, query)
+        if use_semantic_cache:
+            query_vector = await embed_task
+            cached_response = await timer.run(
+                "semantic_lookup", semantic_cache.lookup(query_vector, embedding_model, kb_version)
+            )
+            if cached_response is not None:
+                return cached_response
         
+        knowledge = await retrieval_task
+        query_vector = embed_task.result()
         
-        
-        # Tạo prompt - truyền custom_prompt để thêm vào cuối
-        prompt = await prompt_builder(
+        # Tạo prompt: system (cố định, provider cache được) + user (kiến thức, lịch sử, câu hỏi)
+        system_prompt, prompt = await timer.run("prompt", prompt_builder(
             knowledge=knowledge,
             history=history,
             query=query,
             custom_prompt=custom_prompt
-        )
-        
-        
-        
-        if "gemini" in bot_model_name.lower():
-            from llm.gemini import generate_gemini_response
-            response_json = await generate_gemini_response(
-                api_key=bot_key,
-                prompt=prompt
-            )
-        else:
-            from llm.gpt import generate_gpt_response
-            response_json = await generate_gpt_response(
-                api_key=bot_key,
-                prompt=prompt
+        ))
+        
+        
+        
+        # Key hết lượt (RPM/TPM) -> chờ ngắn hoặc chuyển sang key bot khác
+        if is_rate_limited("bot"):
+            tokens = count_tokens(system_prompt) + count_tokens(prompt) + LLM_EXPECTED_OUTPUT_TOKENS
+            bot_key = await timer.run("rate_limit", acquire_key("bot", bot_key, tokens, bot_keys))
+        
+        # on_delta != None -> stream từng đoạn câu trả lời tới người dùng
+        async with timer.stage("llm"):
+            if "gemini" in bot_model_name.lower():
+                from llm.gemini import generate_gemini_response, generate_gemini_response_stream
+                if on_delta is not None:
+                    response_json = await generate_gemini_response_stream(
+                        api_key=bot_key,
+                        prompt=prompt,
+                        on_delta=on_delta,
+                        system_prompt=system_prompt
+                    )
+                else:
+                    response_json = await generate_gemini_response(
+                        api_key=bot_key,
+                        prompt=prompt,
+                        system_prompt=system_prompt
+                    )
+            else:
+                from llm.gpt import generate_gpt_response, generate_gpt_response_stream
+                if on_delta is not None:
+                    response_json = await generate_gpt_response_stream(
+                        api_key=bot_key,
+                        prompt=prompt,
+                        on_delta=on_delta,
+                        system_prompt=system_prompt
+                    )
+                else:
+                    response_json = await generate_gpt_response(
+                        api_key=bot_key,
+                        prompt=prompt,
+                        system_prompt=system_prompt
+                    )
+
+        if use_semantic_cache:
+            await timer.run(
+                "semantic_store",
+                semantic_cache.store(query, query_vector, embedding_model, response_json, kb_version)
             )
 
-
         return response_json
         
         
     except Exception as e:
         return f"Xin lỗi, đã có lỗi xảy ra khi xử lý câu hỏi của bạn: {str(e)}"
+    
+    finally:
+        # Semantic cache hit / lỗi -> hủy các stage còn đang chạy
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+        timer.log()
 
 
 
 async def clear_llm_keys_cache(llm_detail_id: int = None, key_type: str = None) -> bool:
     
-    from config.redis_cache import async_cache_delete
+    from config.redis_cache import async_cache_delete, async_cache_delete_prefix
+    from llm.key_health import key_state_key
     
     try:
-        # 1. Luôn xóa cache danh sách keys
-        await async_cache_delete("list_keys")
+        # 1. Luôn xóa cache danh sách keys (publish invalidation -> L1 của mọi worker cũng bị xóa)
+        if llm_detail_id is not None:
+            await async_cache_delete(f"list_keys:llm_detail_{llm_detail_id}")
+        else:
+            await async_cache_delete_prefix("list_keys:")
         print(f"🗑️ Đã xóa cache 'list_keys'")
         
         # 2. Luôn xóa cache model info
         await async_cache_delete("model_info")
         print(f"🗑️ Đã xóa cache 'model_info'")
         
-        # 3. Reset counters cho round-robin nếu cần
-        if key_type:
-            counter_key = f"llm_key_global_counter:type_{key_type}"
-            await async_cache_delete(counter_key)
-            print(f"🗑️ Đã xóa counter '{counter_key}'")
-        else:
-            # Xóa tất cả counters
-            for ktype in ["bot", "embedding"]:
-                counter_key = f"llm_key_global_counter:type_{ktype}"
-                await async_cache_delete(counter_key)
-                print(f"🗑️ Đã xóa counter '{counter_key}'")
+        # 3. Reset trạng thái chọn key (weighted round-robin) nếu cần
+        if llm_detail_id is not None:
+            for ktype in ([key_type] if key_type else ["bot", "embedding"]):
+                state_key = key_state_key(llm_detail_id, ktype)
+                await async_cache_delete(state_key)
+                print(f"🗑️ Đã xóa trạng thái chọn key '{state_key}'")
         
         print(f"✅ Đã xóa cache LLM keys thành công")
         return True
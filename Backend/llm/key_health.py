@@ -0,0 +1,292 @@
+"""
+Theo dõi sức khỏe từng API key + chọn key có trọng số (thay cho counter % len(keys))
+- Mỗi key 1 hash Redis llm_key_health:{key_id} (key_id = sha256 rút gọn, không lưu key thật):
+  err (EWMA tỉ lệ lỗi), lat (EWMA latency ms), fails (số lỗi liên tiếp),
+  trips (số lần ngắt liên tiếp), open_until (epoch giây)
+- Circuit breaker: 429 ngắt ngay, lỗi khác ngắt sau KEY_FAILURE_THRESHOLD lần liên tiếp;
+  thời gian nghỉ tăng gấp đôi sau mỗi lần ngắt (tối đa KEY_COOLDOWN_MAX); 1 lần thành công đóng lại
+- Chọn key: smooth weighted round-robin (trọng số bằng nhau = round-robin tuyệt đối),
+  trọng số = (1 - err) * latency tham chiếu / latency, key đang ngắt có trọng số 0
+- Session đang ghim vào key bị ngắt được ghim lại sang key khác ngay trong script
+"""
+
+import asyncio
+import hashlib
+import logging
+import os
+from typing import Dict, List, Optional, Set
+
+from config.redis_cache import async_cache_eval
+
+logger = logging.getLogger(__name__)
+
+KEY_SESSION_TTL = 3600
+KEY_STATE_TTL = 86400
+KEY_HEALTH_TTL = 86400
+
+KEY_FAILURE_THRESHOLD = int(os.getenv("KEY_FAILURE_THRESHOLD", 3))
+KEY_COOLDOWN_BASE = int(os.getenv("KEY_COOLDOWN_BASE", 30))
+KEY_COOLDOWN_MAX = int(os.getenv("KEY_COOLDOWN_MAX", 900))
+# Hệ số EWMA: càng lớn càng phản ứng nhanh với lỗi / latency mới
+KEY_HEALTH_ALPHA = float(os.getenv("KEY_HEALTH_ALPHA", 0.2))
+# Key có latency <= mức này coi như nhanh ngang nhau
+KEY_LATENCY_REF_MS = float(os.getenv("KEY_LATENCY_REF_MS", 1000))
+# Key vừa hết thời gian nghỉ (half-open) chỉ nhận 1 phần nhỏ traffic để thử lại
+KEY_HALF_OPEN_WEIGHT = 0.2
+# Trọng số tối thiểu cho key còn mở (tránh key lỗi nhiều bị bỏ đói hoàn toàn)
+KEY_MIN_WEIGHT = 0.05
+
+
+def key_id(api_key: str) -> str:
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:16]
+
+
+def key_health_key(api_key: str) -> str:
+    return f"llm_key_health:{key_id(api_key)}"
+
+
+def key_state_key(llm_detail_id: int, key_type: str) -> str:
+    return f"llm_key_scheduler:llm_detail_{llm_detail_id}:type_{key_type}"
+
+
+def key_session_key(chat_session_id: int, llm_detail_id: int, key_type: str) -> str:
+    return f"llm_key_session:session_{chat_session_id}:llm_detail_{llm_detail_id}:type_{key_type}"
+
+
+# ================== CHỌN KEY ==================
+# ARGV: session_ttl, state_ttl, pin (1/0), latency_ref_ms, half_open_weight, min_weight,
+#       số loại key, rồi số key của từng loại (thời gian lấy từ TIME của Redis, cùng đồng hồ với open_until)
+# KEYS: với từng loại key: state_key, session_key, health_key của từng key (theo thứ tự danh sách)
+# Trả về index key (0-based) của từng loại
+KEY_SELECT_SCRIPT = """
+-- Redis < 5: cho phép ghi sau lệnh không tất định (TIME)
+if redis.replicate_commands then redis.replicate_commands() end
+local now = tonumber(redis.call('TIME')[1])
+local session_ttl = tonumber(ARGV[1])
+local state_ttl = tonumber(ARGV[2])
+local pin = ARGV[3] == '1'
+local latency_ref = tonumber(ARGV[4])
+local half_open_weight = tonumber(ARGV[5])
+local min_weight = tonumber(ARGV[6])
+local n_types = tonumber(ARGV[7])
+
+local result = {}
+local offset = 0
+for t = 1, n_types do
+    local n_keys = tonumber(ARGV[7 + t])
+    local state_key = KEYS[offset + 1]
+    local session_key = KEYS[offset + 2]
+    local health_base = offset + 2
+
+    local weights = {}
+    local total = 0
+    local soonest, soonest_until = 0, nil
+    for i = 1, n_keys do
+        local h = redis.call('HMGET', KEYS[health_base + i], 'err', 'lat', 'trips', 'open_until')
+        local err = tonumber(h[1]) or 0
+        local lat = tonumber(h[2]) or 0
+        local trips = tonumber(h[3]) or 0
+        local open_until = tonumber(h[4]) or 0
+        local w = 0
+        if open_until > now then
+            if soonest_until == nil or open_until < soonest_until then
+                soonest, soonest_until = i - 1, open_until
+            end
+        else
+            w = math.max(1 - err, min_weight)
+            if lat > latency_ref then
+                w = w * latency_ref / lat
+            end
+            if trips > 0 then
+                w = w * half_open_weight
+            end
+        end
+        weights[i] = w
+        total = total + w
+    end
+
+    local index = nil
+    if pin then
+        index = tonumber(redis.call('GET', session_key))
+        if index ~= nil and (index >= n_keys or weights[index + 1] == 0) then
+            index = nil
+        end
+    end
+
+    if index == nil then
+        if total == 0 then
+            -- Tất cả key đang ngắt: dùng key sắp hết thời gian nghỉ nhất
+            index = soonest
+        else
+            -- Smooth weighted round-robin
+            local best, best_current = nil, nil
+            for i = 1, n_keys do
+                local field = KEYS[health_base + i]
+                local current = tonumber(redis.call('HGET', state_key, field)) or 0
+                current = current + weights[i]
+                if weights[i] > 0 and (best_current == nil or current > best_current) then
+                    best, best_current = i, current
+                end
+                weights[i] = current
+            end
+            weights[best] = weights[best] - total
+            for i = 1, n_keys do
+                redis.call('HSET', state_key, KEYS[health_base + i], tostring(weights[i]))
+            end
+            redis.call('EXPIRE', state_key, state_ttl)
+            index = best - 1
+        end
+        if pin then
+            redis.call('SET', session_key, index, 'EX', session_ttl)
+        end
+    end
+
+    result[t] = index
+    offset = offset + 2 + n_keys
+end
+return result
+"""
+
+# Dự phòng khi Redis không dùng được: round-robin trong process
+_local_key_counters: Dict[str, int] = {}
+
+
+def _local_round_robin(state_keys: List[str], key_counts: List[int]) -> List[int]:
+    indexes = []
+    for state_key, n_keys in zip(state_keys, key_counts):
+        counter = _local_key_counters.get(state_key, 0)
+        _local_key_counters[state_key] = counter + 1
+        indexes.append(counter % n_keys)
+    return indexes
+
+
+async def select_keys(groups: List[Dict], chat_session_id: Optional[int] = None) -> List[int]:
+    """
+    groups: [{"llm_detail_id", "key_type", "keys": [api_key, ...]}]
+    Chọn (và ghim theo session nếu có) 1 key cho mỗi nhóm trong 1 round trip, trả về index
+    """
+    keys: List[str] = []
+    state_keys: List[str] = []
+    key_counts: List[int] = []
+    for group in groups:
+        state_key = key_state_key(group["llm_detail_id"], group["key_type"])
+        session_key = (
+            key_session_key(chat_session_id, group["llm_detail_id"], group["key_type"])
+            if chat_session_id is not None else f"{state_key}:no_session"
+        )
+        keys += [state_key, session_key] + [key_health_key(api_key) for api_key in group["keys"]]
+        state_keys.append(state_key)
+        key_counts.append(len(group["keys"]))
+
+    indexes = await async_cache_eval(
+        KEY_SELECT_SCRIPT,
+        keys=keys,
+        args=[
+            KEY_SESSION_TTL, KEY_STATE_TTL,
+            1 if chat_session_id is not None else 0,
+            KEY_LATENCY_REF_MS, KEY_HALF_OPEN_WEIGHT, KEY_MIN_WEIGHT,
+            len(groups), *key_counts
+        ]
+    )
+    if indexes is None:
+        return _local_round_robin(state_keys, key_counts)
+    return [int(index) for index in indexes]
+
+
+# ================== GHI NHẬN KẾT QUẢ ==================
+# KEYS: health_key
+# ARGV: ok (1/0), latency_ms (-1 = không ghi), rate_limited (1/0), alpha,
+#       failure_threshold, cooldown_base, cooldown_max, ttl (open_until theo TIME của Redis)
+# Trả về 1 nếu lần gọi này làm breaker ngắt
+KEY_RECORD_SCRIPT = """
+if redis.replicate_commands then redis.replicate_commands() end
+local now = tonumber(redis.call('TIME')[1])
+local key = KEYS[1]
+local ok = ARGV[1] == '1'
+local latency = tonumber(ARGV[2])
+local rate_limited = ARGV[3] == '1'
+local alpha = tonumber(ARGV[4])
+local threshold = tonumber(ARGV[5])
+local cooldown_base = tonumber(ARGV[6])
+local cooldown_max = tonumber(ARGV[7])
+
+local h = redis.call('HMGET', key, 'err', 'lat', 'fails', 'trips')
+local err = tonumber(h[1]) or 0
+local lat = tonumber(h[2])
+local fails = tonumber(h[3]) or 0
+local trips = tonumber(h[4]) or 0
+local tripped = 0
+
+if ok then
+    err = err * (1 - alpha)
+    if latency >= 0 then
+        lat = lat and (lat * (1 - alpha) + latency * alpha) or latency
+        redis.call('HSET', key, 'lat', tostring(lat))
+    end
+    redis.call('HSET', key, 'err', tostring(err), 'fails', 0, 'trips', 0, 'open_until', 0)
+else
+    err = err * (1 - alpha) + alpha
+    fails = fails + 1
+    if rate_limited or fails >= threshold then
+        trips = trips + 1
+        local cooldown = math.min(cooldown_base * 2 ^ (trips - 1), cooldown_max)
+        redis.call('HSET', key, 'trips', trips, 'open_until', now + math.floor(cooldown), 'fails', 0)
+        tripped = 1
+    else
+        redis.call('HSET', key, 'fails', fails)
+    end
+    redis.call('HSET', key, 'err', tostring(err))
+end
+redis.call('EXPIRE', key, tonumber(ARGV[8]))
+return tripped
+"""
+
+# Giữ tham chiếu tới task ghi nhận (tránh bị GC khi chưa chạy xong)
+_record_tasks: Set[asyncio.Task] = set()
+
+
+def is_rate_limit_error(error: Exception) -> bool:
+    status = getattr(error, "status_code", None) or getattr(error, "code", None)
+    if status == 429 or getattr(status, "value", None) == 429:
+        return True
+    message = str(error)
+    return "429" in message or "RESOURCE_EXHAUSTED" in message or "rate limit" in message.lower()
+
+
+async def record_key_result(
+    api_key: str,
+    ok: bool,
+    latency_ms: Optional[float] = None,
+    error: Optional[Exception] = None
+) -> None:
+    rate_limited = error is not None and is_rate_limit_error(error)
+    tripped = await async_cache_eval(
+        KEY_RECORD_SCRIPT,
+        keys=[key_health_key(api_key)],
+        args=[
+            1 if ok else 0,
+            -1 if latency_ms is None else round(latency_ms, 1),
+            1 if rate_limited else 0,
+            KEY_HEALTH_ALPHA,
+            KEY_FAILURE_THRESHOLD, KEY_COOLDOWN_BASE, KEY_COOLDOWN_MAX, KEY_HEALTH_TTL
+        ]
+    )
+    if tripped:
+        logger.warning(
+            f"🔌 Ngắt key {key_id(api_key)} ({'429' if rate_limited else 'lỗi liên tiếp'}): {error}"
+        )
+
+
+def report_key_result(
+    api_key: str,
+    ok: bool,
+    latency_ms: Optional[float] = None,
+    error: Optional[Exception] = None
+) -> None:
+    """Ghi nhận kết quả gọi provider ở background (không chặn response)"""
+    try:
+        task = asyncio.get_running_loop().create_task(record_key_result(api_key, ok, latency_ms, error))
+    except RuntimeError:
+        return
+    _record_tasks.add(task)
+    task.add_done_callback(_record_tasks.discard)
@@ -0,0 +1,184 @@
+"""
+Token bucket theo từng API key (RPM + TPM), dùng chung giữa mọi worker qua Redis
+- Mỗi key 1 hash llm_rate:{key_type}:{key_id}: req / tok còn lại + ts (ms) lần cập nhật cuối,
+  nạp lại liên tục theo giới hạn mỗi phút (bucket đầy = đúng giới hạn / phút)
+- acquire_key: thử key được chọn trước, hết lượt thì chuyển sang key khác cùng loại còn lượt
+  (1 Lua script, nguyên tử); tất cả đều hết thì chờ tối đa LLM_RATE_LIMIT_MAX_WAIT giây
+- Key thay thế đang bị circuit breaker ngắt (llm_key_health open_until) bị bỏ qua: bucket của
+  nó đầy vì scheduler không gửi traffic, không được dùng để lách breaker
+- Giới hạn cấu hình qua env theo loại key, 0 = không giới hạn (không gọi Redis)
+"""
+
+import asyncio
+import logging
+import os
+import time
+from typing import Dict, List, Optional
+
+from config.redis_cache import async_cache_eval
+from llm.key_health import key_id, key_health_key
+
+logger = logging.getLogger(__name__)
+
+RATE_LIMITS = {
+    "bot": {
+        "rpm": int(os.getenv("LLM_BOT_RPM", 0)),
+        "tpm": int(os.getenv("LLM_BOT_TPM", 0)),
+    },
+    "embedding": {
+        "rpm": int(os.getenv("LLM_EMBEDDING_RPM", 0)),
+        "tpm": int(os.getenv("LLM_EMBEDDING_TPM", 0)),
+    },
+}
+
+LLM_RATE_LIMIT_MAX_WAIT = float(os.getenv("LLM_RATE_LIMIT_MAX_WAIT", 2.0))
+# Ước lượng số token câu trả lời khi trừ TPM (chưa biết trước độ dài output)
+LLM_EXPECTED_OUTPUT_TOKENS = int(os.getenv("LLM_EXPECTED_OUTPUT_TOKENS", 512))
+RATE_BUCKET_TTL = 600
+
+
+def rate_limit_key(key_type: str, api_key: str) -> str:
+    return f"llm_rate:{key_type}:{key_id(api_key)}"
+
+
+def is_rate_limited(key_type: str) -> bool:
+    limits = RATE_LIMITS.get(key_type) or {}
+    return bool(limits.get("rpm") or limits.get("tpm"))
+
+
+# KEYS: bucket của từng key ứng viên (theo thứ tự ưu tiên), rồi health_key của từng key (cùng thứ tự)
+# ARGV: rpm, tpm, tokens, ttl (thời gian lấy từ TIME của Redis: các worker / host lệch đồng hồ vẫn nạp đúng)
+# Key đầu tiên (do scheduler chọn) luôn được xét; key thay thế đang ngắt (open_until > now) bị bỏ qua
+# Trả về {index key lấy được (0-based, -1 = không key nào còn lượt), số ms cần chờ}
+RATE_ACQUIRE_SCRIPT = """
+-- Redis < 5: cho phép ghi sau lệnh không tất định (TIME)
+if redis.replicate_commands then redis.replicate_commands() end
+local t = redis.call('TIME')
+local now = tonumber(t[1]) * 1000 + math.floor(tonumber(t[2]) / 1000)
+local rpm = tonumber(ARGV[1])
+local tpm = tonumber(ARGV[2])
+local tokens = tonumber(ARGV[3])
+local ttl = tonumber(ARGV[4])
+local n = #KEYS / 2
+local min_wait = nil
+
+for i = 1, n do
+    local open_until = 0
+    if i > 1 then
+        open_until = tonumber(redis.call('HGET', KEYS[n + i], 'open_until')) or 0
+    end
+
+    if open_until * 1000 <= now then
+        local h = redis.call('HMGET', KEYS[i], 'req', 'tok', 'ts')
+        local req = tonumber(h[1]) or rpm
+        local tok = tonumber(h[2]) or tpm
+        local elapsed = math.max(now - (tonumber(h[3]) or now), 0)
+        req = math.min(rpm, req + elapsed * rpm / 60000)
+        tok = math.min(tpm, tok + elapsed * tpm / 60000)
+
+        local wait = 0
+        if rpm > 0 and req < 1 then
+            wait = math.max(wait, (1 - req) * 60000 / rpm)
+        end
+        if tpm > 0 and tok < tokens then
+            wait = math.max(wait, (tokens - tok) * 60000 / tpm)
+        end
+
+        if wait == 0 then
+            if rpm > 0 then req = req - 1 end
+            if tpm > 0 then tok = tok - tokens end
+            redis.call('HSET', KEYS[i], 'req', tostring(req), 'tok', tostring(tok), 'ts', now)
+            redis.call('EXPIRE', KEYS[i], ttl)
+            return {i - 1, 0}
+        end
+        if min_wait == nil or wait < min_wait then
+            min_wait = wait
+        end
+    end
+end
+return {-1, math.ceil(min_wait)}
+"""
+
+# KEYS: bucket của từng key; ARGV: rpm, tpm (thời gian lấy từ TIME của Redis)
+# Trả về [req, tok, req, tok, ...] (chuỗi) sau khi tính phần nạp lại, không ghi
+RATE_PEEK_SCRIPT = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) * 1000 + math.floor(tonumber(t[2]) / 1000)
+local rpm = tonumber(ARGV[1])
+local tpm = tonumber(ARGV[2])
+local result = {}
+for i = 1, #KEYS do
+    local h = redis.call('HMGET', KEYS[i], 'req', 'tok', 'ts')
+    local elapsed = math.max(now - (tonumber(h[3]) or now), 0)
+    result[2 * i - 1] = tostring(math.min(rpm, (tonumber(h[1]) or rpm) + elapsed * rpm / 60000))
+    result[2 * i] = tostring(math.min(tpm, (tonumber(h[2]) or tpm) + elapsed * tpm / 60000))
+end
+return result
+"""
+
+
+async def acquire_key(
+    key_type: str,
+    api_key: str,
+    tokens: int = 0,
+    alternatives: Optional[List[str]] = None
+) -> str:
+    """
+    Lấy 1 lượt gọi cho api_key (hoặc key thay thế còn lượt), trả về key sẽ dùng.
+    Quá thời gian chờ vẫn trả về api_key (để provider quyết định, breaker xử lý 429)
+    """
+    if not is_rate_limited(key_type):
+        return api_key
+
+    limits = RATE_LIMITS[key_type]
+    candidates = [api_key] + [key for key in dict.fromkeys(alternatives or []) if key != api_key]
+    # Không để 1 request lớn hơn cả bucket chờ mãi
+    tokens = min(tokens, limits["tpm"]) if limits["tpm"] else 0
+    deadline = time.monotonic() + LLM_RATE_LIMIT_MAX_WAIT
+
+    while True:
+        result = await async_cache_eval(
+            RATE_ACQUIRE_SCRIPT,
+            keys=[rate_limit_key(key_type, key) for key in candidates] + [key_health_key(key) for key in candidates],
+            args=[limits["rpm"], limits["tpm"], tokens, RATE_BUCKET_TTL]
+        )
+        if result is None:
+            # Redis không dùng được -> không giới hạn
+            return api_key
+
+        index, wait_ms = int(result[0]), int(result[1])
+        if index >= 0:
+            if index > 0:
+                logger.info(
+                    f"🚦 Key {key_type} {key_id(api_key)} hết lượt, chuyển sang {key_id(candidates[index])}"
+                )
+            return candidates[index]
+
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            logger.warning(f"🚦 Tất cả key {key_type} hết lượt, gọi tiếp bằng key {key_id(api_key)}")
+            return api_key
+        await asyncio.sleep(min(wait_ms / 1000, remaining))
+
+
+async def get_bucket_levels(key_type: str, api_keys: List[str]) -> List[Dict]:
+    """Mức bucket hiện tại của từng key (dùng cho monitoring)"""
+    limits = RATE_LIMITS.get(key_type) or {"rpm": 0, "tpm": 0}
+    levels = [{"key_id": key_id(key), "rpm_limit": limits["rpm"], "tpm_limit": limits["tpm"]} for key in api_keys]
+    if not api_keys or not is_rate_limited(key_type):
+        return levels
+
+    result = await async_cache_eval(
+        RATE_PEEK_SCRIPT,
+        keys=[rate_limit_key(key_type, key) for key in api_keys],
+        args=[limits["rpm"], limits["tpm"]]
+    )
+    if result is None:
+        return levels
+
+    for i, level in enumerate(levels):
+        if limits["rpm"]:
+            level["requests_available"] = round(float(result[2 * i]), 2)
+        if limits["tpm"]:
+            level["tokens_available"] = int(float(result[2 * i + 1]))
+    return levels
@@ -0,0 +1,126 @@
+"""
+Rerank chunk bằng cross-encoder chạy local trên CPU
+- search_chunks lấy nhiều ứng viên hơn, cross-encoder chấm điểm từng cặp (câu hỏi, chunk)
+  rồi chỉ giữ lại top_k chunk tốt nhất -> prompt ngắn hơn, ít chunk nhiễu hơn
+- Model mặc định hỗ trợ tiếng Việt (đa ngôn ngữ), load 1 lần lúc dùng lần đầu
+- Điểm được cache theo cặp (câu hỏi, chunk) trong RAM (LRU)
+- Model lỗi / chưa cài sentence-transformers -> giữ nguyên thứ tự retrieval
+"""
+
+import asyncio
+import hashlib
+import logging
+import os
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+from config.embedding_cache import normalize_query
+
+logger = logging.getLogger(__name__)
+
+RERANKER_MODEL = os.getenv("RERANKER_MODEL", "cross-encoder/mmarco-mMiniLMv2-L12-H384-v1")
+RERANKER_BATCH_SIZE = int(os.getenv("RERANKER_BATCH_SIZE", 32))
+RERANKER_MAX_LENGTH = int(os.getenv("RERANKER_MAX_LENGTH", 512))
+RERANKER_CACHE_SIZE = int(os.getenv("RERANKER_CACHE_SIZE", 20000))
+# Số chunk ứng viên mặc định = topk * hệ số này (khi LLM.rerank_candidates chưa thiết lập)
+RERANKER_CANDIDATE_MULTIPLIER = int(os.getenv("RERANKER_CANDIDATE_MULTIPLIER", 4))
+
+
+class CrossEncoderReranker:
+    def __init__(self):
+        self._model = None
+        self._load_failed = False
+        # 1 thread: torch tự chia core cho batch, tránh nhiều batch tranh CPU
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="reranker")
+        self._scores: "OrderedDict[str, float]" = OrderedDict()
+        self._stats = {"scored": 0, "cache_hits": 0}
+
+    # ================== MODEL ==================
+    def _load_model(self):
+        if self._model is None and not self._load_failed:
+            try:
+                from sentence_transformers import CrossEncoder
+
+                started = time.perf_counter()
+                self._model = CrossEncoder(RERANKER_MODEL, max_length=RERANKER_MAX_LENGTH, device="cpu")
+                logger.info(f"✅ Loaded reranker {RERANKER_MODEL} in {(time.perf_counter() - started):.1f}s")
+            except Exception as e:
+                self._load_failed = True
+                logger.error(f"❌ Không load được reranker {RERANKER_MODEL}: {e}")
+        return self._model
+
+    def _predict(self, pairs: List[List[str]]) -> List[float]:
+        model = self._load_model()
+        if model is None:
+            raise RuntimeError("Reranker model không khả dụng")
+        scores = model.predict(pairs, batch_size=RERANKER_BATCH_SIZE, show_progress_bar=False)
+        return [float(score) for score in scores]
+
+    async def warmup(self) -> None:
+        await asyncio.get_running_loop().run_in_executor(self._executor, self._load_model)
+
+    # ================== CACHE ==================
+    def _cache_key(self, query: str, chunk: Dict) -> str:
+        text = chunk.get("text") or ""
+        raw = f"{RERANKER_MODEL}|{normalize_query(query)}|{text}"
+        return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+    def _cache_get(self, key: str) -> Optional[float]:
+        score = self._scores.get(key)
+        if score is not None:
+            self._scores.move_to_end(key)
+        return score
+
+    def _cache_set(self, key: str, score: float) -> None:
+        self._scores[key] = score
+        self._scores.move_to_end(key)
+        while len(self._scores) > RERANKER_CACHE_SIZE:
+            self._scores.popitem(last=False)
+
+    # ================== PUBLIC API ==================
+    async def rerank(self, query: str, chunks: List[Dict], top_k: int) -> List[Dict]:
+        """Trả về top_k chunk theo điểm cross-encoder (kèm "rerank_score")"""
+        if not chunks or self._load_failed:
+            return chunks[:top_k]
+
+        keys = [self._cache_key(query, chunk) for chunk in chunks]
+        scores = [self._cache_get(key) for key in keys]
+        missing = [i for i, score in enumerate(scores) if score is None]
+        self._stats["cache_hits"] += len(chunks) - len(missing)
+
+        if missing:
+            pairs = [[query, chunks[i].get("text") or ""] for i in missing]
+            try:
+                new_scores = await asyncio.get_running_loop().run_in_executor(
+                    self._executor, self._predict, pairs
+                )
+            except Exception as e:
+                logger.error(f"Rerank error, giữ thứ tự retrieval: {e}")
+                return chunks[:top_k]
+
+            for i, score in zip(missing, new_scores):
+                scores[i] = score
+                self._cache_set(keys[i], score)
+            self._stats["scored"] += len(missing)
+
+        ranked = sorted(zip(chunks, scores), key=lambda item: item[1], reverse=True)
+        return [{**chunk, "rerank_score": score} for chunk, score in ranked[:top_k]]
+
+    def stats(self) -> Dict:
+        return {
+            **self._stats,
+            "model": RERANKER_MODEL,
+            "loaded": self._model is not None,
+            "cached_pairs": len(self._scores),
+        }
+
+
+def rerank_candidate_count(topk: int, rerank_candidates: Optional[int]) -> int:
+    """Số chunk lấy từ retrieval khi bật rerank (luôn >= topk)"""
+    return max(rerank_candidates or topk * RERANKER_CANDIDATE_MULTIPLIER, topk)
+
+
+# ================== SINGLETON ==================
+reranker = CrossEncoderReranker()
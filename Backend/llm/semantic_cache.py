@@ -0,0 +1,208 @@
+"""
+Semantic cache cho câu trả lời của bot
+Câu hỏi mới có embedding đủ gần (cosine distance) một câu hỏi đã trả lời -> trả lại
+câu trả lời cũ {"message", "links"}, bỏ qua retrieval + generation.
+
+Lưu trữ trên Redis:
+- semantic_cache:index        ZSET (member = entry id, score = thời điểm tạo) để eviction
+- semantic_cache:entry:{id}   JSON entry, có TTL riêng
+- kb_version                  version của knowledge base (config/kb_version.py), đổi mỗi khi KB thay đổi
+Mỗi worker giữ 1 snapshot vector trong RAM, đồng bộ tăng dần theo score của index.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import time
+from typing import Dict, Optional
+
+import numpy as np
+
+from config.embedding_cache import normalize_query, encode_vector, decode_vector
+from config.redis_cache import redis_cache
+
+logger = logging.getLogger(__name__)
+
+INDEX_KEY = "semantic_cache:index"
+ENTRY_KEY_PREFIX = "semantic_cache:entry:"
+
+ERROR_MESSAGE_PREFIX = "Xin lỗi, đã có lỗi xảy ra"
+
+
+def is_context_free(history: str, query: str) -> bool:
+    """Hội thoại không có ngữ cảnh trước đó (ngoài chính câu hỏi hiện tại)"""
+    remaining = (history or "").replace(f"customer: {query}", "", 1)
+    return not remaining.strip()
+
+
+def is_cacheable_response(response_json: str) -> bool:
+    try:
+        data = json.loads(response_json)
+    except (TypeError, json.JSONDecodeError):
+        return False
+    message = data.get("message") if isinstance(data, dict) else None
+    return bool(message) and not message.startswith(ERROR_MESSAGE_PREFIX)
+
+
+class SemanticCache:
+    def __init__(self):
+        self.enabled = os.getenv("SEMANTIC_CACHE_ENABLED", "true").lower() == "true"
+        self.max_distance = float(os.getenv("SEMANTIC_CACHE_MAX_DISTANCE", 0.08))
+        self.ttl = int(os.getenv("SEMANTIC_CACHE_TTL", 86400))
+        self.max_entries = int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", 2000))
+        self.full_sync_interval = int(os.getenv("SEMANTIC_CACHE_SYNC_INTERVAL", 60))
+
+        # Snapshot local: entry id -> (model, kb_version, created_at, vector)
+        self._entries: Dict[str, tuple] = {}
+        self._last_score = 0.0
+        self._last_full_sync = 0.0
+        self._kb_version: Optional[str] = None
+        self._stats = {"hits": 0, "misses": 0}
+
+    def _entry_id(self, query: str, model: str) -> str:
+        return hashlib.sha1(f"{model}|{normalize_query(query)}".encode("utf-8")).hexdigest()
+
+    # ================== SYNC SNAPSHOT ==================
+    async def _sync(self, client, kb_version: Optional[str]) -> None:
+        now = time.time()
+
+        if kb_version != self._kb_version:
+            self._entries.clear()
+            self._last_score = 0.0
+            self._kb_version = kb_version
+
+        if now - self._last_full_sync > self.full_sync_interval:
+            # Đồng bộ toàn bộ: loại bỏ các entry đã bị evict/purge ở worker khác
+            live_ids = set(await client.zrange(INDEX_KEY, 0, -1))
+            for entry_id in list(self._entries):
+                if entry_id not in live_ids:
+                    del self._entries[entry_id]
+            self._last_full_sync = now
+
+        new_items = await client.zrangebyscore(INDEX_KEY, f"({self._last_score}", "+inf", withscores=True)
+        new_ids = [entry_id for entry_id, _ in new_items if entry_id not in self._entries]
+        if new_ids:
+            values = await client.mget([ENTRY_KEY_PREFIX + entry_id for entry_id in new_ids])
+            for entry_id, raw in zip(new_ids, values):
+                if raw is None:
+                    continue
+                entry = json.loads(raw)
+                self._entries[entry_id] = (entry["m"], entry["kb"], entry["t"], decode_vector(entry["v"]))
+        if new_items:
+            self._last_score = max(self._last_score, new_items[-1][1])
+
+    # ================== PUBLIC API ==================
+    async def lookup(self, query_vector, model: str, kb_version: Optional[str]) -> Optional[str]:
+        """kb_version: version KB đọc trước khi bắt đầu retrieval (get_kb_version)"""
+        if not self.enabled or not query_vector:
+            return None
+
+        try:
+            client = await redis_cache.get_async_client()
+            if client is None:
+                return None
+
+            await self._sync(client, kb_version)
+
+            now = time.time()
+            candidates = [
+                (entry_id, vector)
+                for entry_id, (entry_model, entry_kb, created_at, vector) in self._entries.items()
+                if entry_model == model and entry_kb == kb_version and now - created_at < self.ttl
+            ]
+            if not candidates:
+                self._stats["misses"] += 1
+                return None
+
+            query = np.asarray(query_vector, dtype=np.float32)
+            matrix = np.stack([vector for _, vector in candidates])
+            norms = np.linalg.norm(matrix, axis=1) * (np.linalg.norm(query) or 1.0)
+            distances = 1.0 - (matrix @ query) / np.where(norms == 0, 1.0, norms)
+            best = int(np.argmin(distances))
+
+            if distances[best] > self.max_distance:
+                self._stats["misses"] += 1
+                return None
+
+            entry_id = candidates[best][0]
+            raw = await client.get(ENTRY_KEY_PREFIX + entry_id)
+            if raw is None:
+                # Entry đã hết TTL trên Redis
+                self._entries.pop(entry_id, None)
+                self._stats["misses"] += 1
+                return None
+
+            self._stats["hits"] += 1
+            logger.info(f"Semantic cache hit {entry_id} (distance={distances[best]:.4f})")
+            return json.loads(raw)["r"]
+
+        except Exception as e:
+            logger.error(f"Semantic cache lookup error: {e}")
+            return None
+
+    async def store(self, query: str, query_vector, model: str, response_json: str, kb_version: Optional[str]) -> None:
+        """
+        kb_version: version KB đọc trước khi bắt đầu retrieval, không đọc lại lúc lưu
+        (KB đổi trong lúc sinh câu trả lời -> câu trả lời từ chunk cũ mang version cũ, không bị dùng lại)
+        """
+        if not self.enabled or not query_vector or not is_cacheable_response(response_json):
+            return
+
+        try:
+            client = await redis_cache.get_async_client()
+            if client is None:
+                return
+
+            entry_id = self._entry_id(query, model)
+            now = time.time()
+            entry = {
+                "q": query,
+                "m": model,
+                "kb": kb_version,
+                "t": now,
+                "v": encode_vector(query_vector),
+                "r": response_json,
+            }
+
+            pipe = client.pipeline()
+            pipe.setex(ENTRY_KEY_PREFIX + entry_id, self.ttl, json.dumps(entry, ensure_ascii=False))
+            pipe.zadd(INDEX_KEY, {entry_id: now})
+            pipe.zcard(INDEX_KEY)
+            results = await pipe.execute()
+
+            # Eviction: bỏ các entry cũ nhất khi vượt quá giới hạn
+            overflow = results[-1] - self.max_entries
+            if overflow > 0:
+                evicted = await client.zpopmin(INDEX_KEY, overflow)
+                if evicted:
+                    await client.delete(*[ENTRY_KEY_PREFIX + entry_id for entry_id, _ in evicted])
+
+        except Exception as e:
+            logger.error(f"Semantic cache store error: {e}")
+
+    async def purge(self) -> int:
+        client = await redis_cache.get_async_client()
+        self._entries.clear()
+        self._last_score = 0.0
+        if client is None:
+            return 0
+
+        entry_ids = await client.zrange(INDEX_KEY, 0, -1)
+        if entry_ids:
+            await client.delete(*[ENTRY_KEY_PREFIX + entry_id for entry_id in entry_ids])
+        await client.delete(INDEX_KEY)
+        logger.info(f"Semantic cache purged {len(entry_ids)} entries")
+        return len(entry_ids)
+
+    def stats(self) -> Dict:
+        total = self._stats["hits"] + self._stats["misses"]
+        return {
+            **self._stats,
+            "local_entries": len(self._entries),
+            "hit_ratio": round(self._stats["hits"] / total, 4) if total else 0.0,
+        }
+
+
+# ================== SINGLETON ==================
+semantic_cache = SemanticCache()
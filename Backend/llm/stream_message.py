@@ -0,0 +1,144 @@
+"""
+Tách nội dung trường "message" từ JSON mà LLM đang stream về
+Model trả về dạng {"message": "...", "links": [...]} -> chỉ đẩy phần text của "message"
+tới người dùng, từng đoạn một, ngay khi nhận được.
+Dùng chung cho mọi provider (gpt.py, gemini.py): chuẩn hoá response JSON + gom stream.
+"""
+
+import json
+import logging
+import re
+import time
+from typing import Awaitable, Callable, List, Optional
+
+from llm.key_health import report_key_result
+
+logger = logging.getLogger(__name__)
+
+_MESSAGE_KEY = re.compile(r'"message"\s*:\s*"')
+_ESCAPES = {'"': '"', '\\': '\\', '/': '/', 'b': '\b', 'f': '\f', 'n': '\n', 'r': '\r', 't': '\t'}
+
+
+class MessageStreamExtractor:
+    def __init__(self):
+        self._buffer = ""       # Text thô đã nhận
+        self._pos = None        # Vị trí đang đọc trong chuỗi "message" (None = chưa tìm thấy)
+        self._plain_text = False
+        self.done = False
+
+    def feed(self, chunk: str) -> str:
+        """Nhận 1 đoạn text thô từ LLM, trả về phần message mới giải mã được"""
+        if not chunk or self.done:
+            return ""
+        self._buffer += chunk
+
+        if self._plain_text:
+            return chunk
+
+        if self._pos is None:
+            stripped = re.sub(r'^\s*(```json)?\s*', '', self._buffer)
+            if stripped and not stripped.startswith("{") and not "```".startswith(stripped[:3]):
+                # Model không trả về JSON -> stream nguyên văn
+                self._plain_text = True
+                return self._buffer
+
+            match = _MESSAGE_KEY.search(self._buffer)
+            if not match:
+                return ""
+            self._pos = match.end()
+
+        return self._decode()
+
+    def _decode(self) -> str:
+        out = []
+        buf = self._buffer
+        i = self._pos
+        while i < len(buf):
+            ch = buf[i]
+            if ch == '"':
+                self.done = True
+                i += 1
+                break
+            if ch != '\\':
+                out.append(ch)
+                i += 1
+                continue
+
+            # Escape sequence: đợi đủ ký tự rồi mới giải mã
+            if i + 1 >= len(buf):
+                break
+            code = buf[i + 1]
+            if code == 'u':
+                if i + 6 > len(buf):
+                    break
+                hex_value = buf[i + 2:i + 6]
+                value = int(hex_value, 16)
+                # Surrogate pair (emoji...): cần thêm \uXXXX thứ 2
+                if 0xD800 <= value <= 0xDBFF:
+                    if i + 12 > len(buf):
+                        break
+                    out.append(json.loads(f'"{buf[i:i + 12]}"'))
+                    i += 12
+                    continue
+                out.append(chr(value))
+                i += 6
+                continue
+            out.append(_ESCAPES.get(code, code))
+            i += 2
+
+        self._pos = i
+        return "".join(out)
+
+
+def to_json_response(response_text: str) -> str:
+    """Text LLM trả về -> JSON {"message", "links"} (bỏ ```json, không phải JSON thì bọc vào message)"""
+    try:
+        cleaned_response = re.sub(r'```json\s*|\s*```', '', response_text).strip()
+        json_data = json.loads(cleaned_response)
+        return json.dumps(json_data, ensure_ascii=False)
+
+    except (json.JSONDecodeError, ValueError):
+        fallback_response = {
+            "message": response_text,
+            "links": []
+        }
+        return json.dumps(fallback_response, ensure_ascii=False)
+
+
+def error_response() -> str:
+    return json.dumps({
+        "message": "Xin lỗi, đã có lỗi xảy ra khi xử lý câu hỏi của bạn.",
+        "links": []
+    }, ensure_ascii=False)
+
+
+class MessageStream:
+    """
+    Gom các đoạn text provider stream về: đẩy phần message mới qua on_delta,
+    log TTFT + báo latency của key ở token đầu tiên (không phụ thuộc độ dài câu trả lời)
+    """
+
+    def __init__(self, api_key: str, model_name: str, on_delta: Callable[[str], Awaitable[None]]):
+        self.api_key = api_key
+        self.model_name = model_name
+        self.on_delta = on_delta
+        self.started_at = time.perf_counter()
+        self.first_token_at: Optional[float] = None
+        self._extractor = MessageStreamExtractor()
+        self._parts: List[str] = []
+
+    async def feed(self, text: str) -> None:
+        if not text:
+            return
+        if self.first_token_at is None:
+            self.first_token_at = time.perf_counter()
+            ttft_ms = (self.first_token_at - self.started_at) * 1000
+            logger.info(f"⏱️ LLM TTFT model={self.model_name} ttft_ms={ttft_ms:.0f}")
+            report_key_result(self.api_key, ok=True, latency_ms=ttft_ms)
+        self._parts.append(text)
+        delta = self._extractor.feed(text)
+        if delta:
+            await self.on_delta(delta)
+
+    def response(self) -> str:
+        return to_json_response("".join(self._parts).strip())
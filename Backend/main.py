@@ -1,5 +1,11 @@
 from fastapi import FastAPI, Request
-from config.database import create_tables
+from config.database import create_tables, AsyncSessionLocal
+from config.llm_clients import llm_clients
+from config.redis_cache import redis_cache
+from llm.help_llm import warmup_llm_clients
+from services.knowledge_base_service import sync_chunk_metadata_service
+from config.chromadb_config import warmup_collections
+from services.reindex_service import init_vector_index_service
 from datetime import datetime
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
@@ -33,6 +39,40 @@ app = FastAPI()
 @app.on_event("startup")
 async def startup_event():
     await create_tables()
+    
+    # L1 cache trong process: bật sau khi đã subscribe kênh invalidation
+    await redis_cache.start_invalidation_listener()
+    
+    # Tạo sẵn client LLM + kết nối tới provider
+    try:
+        async with AsyncSessionLocal() as db:
+            await warmup_llm_clients(db)
+    except Exception as e:
+        print(f"⚠️ LLM client warmup failed: {e}")
+    
+    # Ghi nhận collection active lần đầu + chạy tiếp job re-index dở dang
+    try:
+        async with AsyncSessionLocal() as db:
+            await init_vector_index_service(db)
+    except Exception as e:
+        print(f"⚠️ Vector index init failed: {e}")
+    
+    # Bổ sung category_id / is_active cho các chunk cũ
+    try:
+        async with AsyncSessionLocal() as db:
+            await sync_chunk_metadata_service(db)
+    except Exception as e:
+        print(f"⚠️ Chunk metadata sync failed: {e}")
+    
+    # Load sẵn HNSW / BM25 index của vector store
+    await warmup_collections()
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await redis_cache.stop_invalidation_listener()
+    await redis_cache.async_close()
+    await llm_clients.close()
 
 app.include_router(user_router.router)
 app.include_router(company_router.router)
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, ForeignKey, Integer, String, Text, DateTime
+from sqlalchemy import Boolean, Column, ForeignKey, Integer, String, Text, DateTime
 from sqlalchemy.orm import relationship
 from datetime import datetime
 from config.database import Base
@@ -19,6 +19,10 @@ class LLM(Base):
     chunkoverlap = Column(Integer, nullable=True)
     topk = Column(Integer, nullable=True)
     
+    # Rerank: lấy rerank_candidates chunk rồi dùng cross-encoder chọn lại topk chunk tốt nhất
+    rerank_enabled = Column(Boolean, nullable=False, default=False, server_default="false")
+    rerank_candidates = Column(Integer, nullable=True)
+    
     
     bot_model_detail_id = Column(Integer, nullable=True)  # ID của llm_detail dùng cho bot (1=gemini, 2=gpt)
     embedding_model_detail_id = Column(Integer, nullable=True)  # ID của llm_detail dùng cho embedding
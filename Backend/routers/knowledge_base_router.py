@@ -67,6 +67,17 @@ async def delete_kb_detail(
 
     return await knowledge_base_controller.delete_kb_detail_controller(detail_id, db)
 
+@router.patch("/detail/{detail_id}/status")
+async def update_kb_detail_status(
+    detail_id: int,
+    data: dict = Body(...),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Bật/tắt tài liệu (chỉ cập nhật metadata chunk, không embed lại)
+    """
+    return await knowledge_base_controller.update_kb_detail_status_controller(detail_id, data, db)
+
 @router.post("/rich-text/{kb_id}")
 async def add_kb_rich_text(
     data: dict = Body(...),
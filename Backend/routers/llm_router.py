@@ -1,12 +1,19 @@
-from fastapi import APIRouter, Request, Depends
+from fastapi import APIRouter, Request, Depends, HTTPException
 from sqlalchemy.ext.asyncio import AsyncSession
 from config.database import get_db
+from middleware.jwt import get_current_user
+from models.user import User
 from controllers.llm_controller import (
     create_llm_controller,
     update_llm_controller,
     delete_llm_controller,
     get_llm_by_id_controller,
-    get_all_llms_controller
+    get_all_llms_controller,
+    purge_semantic_cache_controller,
+    get_reindex_status_controller,
+    start_reindex_controller,
+    get_rate_limits_controller,
+    get_cache_stats_controller
 )
 from controllers.llm_key_controller import (
     create_llm_key_controller,
@@ -17,6 +24,52 @@ from controllers.llm_key_controller import (
 
 router = APIRouter(prefix="/llms", tags=["LLMs"])
 
+# Thao tác ảnh hưởng toàn bộ bot (xóa cache câu trả lời, embed lại toàn bộ tài liệu)
+ADMIN_ROLES = ["root", "superadmin", "admin"]
+
+
+def require_admin(current_user: User) -> None:
+    if current_user.role not in ADMIN_ROLES:
+        raise HTTPException(status_code=403, detail="Bạn không có quyền thực hiện thao tác này")
+
+
+# Đặt trước các route /{llm_id} để không bị match nhầm
+@router.delete("/semantic-cache")
+async def purge_semantic_cache(current_user: User = Depends(get_current_user)):
+    """Xóa toàn bộ câu trả lời trong semantic cache"""
+    require_admin(current_user)
+    return await purge_semantic_cache_controller()
+
+@router.get("/reindex/status")
+async def get_reindex_status(current_user: User = Depends(get_current_user)):
+    """Tiến độ re-index + collection đang active"""
+    return await get_reindex_status_controller()
+
+@router.post("/reindex")
+async def start_reindex(
+    request: Request,
+    db: AsyncSession = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """Bắt đầu / chạy tiếp re-index theo model embedding đang chọn ({"force": true} để re-index lại cùng model)"""
+    require_admin(current_user)
+    body = await request.body()
+    data = await request.json() if body else {}
+    return await start_reindex_controller(data, db)
+
+@router.get("/rate-limits")
+async def get_rate_limits(
+    db: AsyncSession = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """Mức token bucket (RPM/TPM) còn lại của từng key đang dùng"""
+    return await get_rate_limits_controller(db)
+
+@router.get("/cache-stats")
+async def get_cache_stats(current_user: User = Depends(get_current_user)):
+    """Hit ratio theo namespace của L1 Redis cache + embedding / semantic / rerank cache (worker hiện tại)"""
+    return await get_cache_stats_controller()
+
 @router.post("/")
 async def create_llm(request: Request, db: AsyncSession = Depends(get_db)):
     data = await request.json()
@@ -11,7 +11,7 @@ from datetime import datetime, timedelta
 import random
 import json
 import traceback
-from config.redis_cache import cache_delete
+from helper.help_redis import async_clear_session_cache
 
 async def create_session_service(url_channel: str, db):
     session = ChatSession(
@@ -140,12 +140,9 @@ async def get_all_history_chat_service(db):
         traceback.print_exc()
 
 
-def clear_session_cache(session_id: int):
-    """Clear cache cho session và check_repply"""
-    session_cache_key = f"session:{session_id}"
-    repply_cache_key = f"check_repply:{session_id}"
-    cache_delete(session_cache_key)
-    cache_delete(repply_cache_key)
+async def clear_session_cache(session_id: int):
+    """Clear cache cho session và check_repply (1 round trip)"""
+    await async_clear_session_cache(session_id)
 
 def get_expire_time(option: str):
     now = datetime.now()
@@ -183,7 +180,7 @@ async def update_chat_session(id: int, data: dict, user, db: Session):
         await db.refresh(chatSession)
         
         # Clear cache sau khi update
-        clear_session_cache(id)
+        await clear_session_cache(id)
         
         return {
             "chat_session_id": chatSession.id,
@@ -206,7 +203,7 @@ async def delete_chat_session(ids: list[int], db):
     
     # Clear cache cho từng session trước khi xóa
     for s in sessions:
-        clear_session_cache(s.id)
+        await clear_session_cache(s.id)
         await db.delete(s)
     await db.commit()
     return len(sessions)
@@ -103,8 +103,8 @@ async def toggle_page_status_service(page_id: int, db: AsyncSession):
     await db.refresh(page)
     
     # Clear cache để force check lại trạng thái
-    from helper.help_redis import clear_page_active_cache
-    clear_page_active_cache("facebook", page.page_id)
+    from helper.help_redis import async_clear_page_active_cache
+    await async_clear_page_active_cache("facebook", page.page_id)
     
     return page
         
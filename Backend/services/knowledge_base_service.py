@@ -7,10 +7,12 @@ from models.llm import LLM
 from fastapi import UploadFile
 from helper.file_processor import (
     process_uploaded_file, 
-    process_rich_text 
+    process_rich_text,
+    update_rich_text_chunks
 )
 
-from config.chromadb_config import delete_chunks
+from config.chromadb_config import delete_chunks, delete_chunks_bulk, update_chunks_metadata, async_list_chunks
+from config.kb_version import bump_kb_version
 
 from typing import Optional, List
 import logging
@@ -169,7 +171,8 @@ async def create_kb_with_files_service(
                     db=db,
                     chunk_size=chunk_size,
                     chunk_overlap=chunk_overlap,
-                    detail_id=detail.id
+                    detail_id=detail.id,
+                    category_id=category_id
                 )
                 
                 if success:
@@ -202,6 +205,7 @@ async def create_kb_with_files_service(
                         pass
                 continue
         
+        await bump_kb_version()
         
         return True
         
@@ -248,10 +252,13 @@ async def add_kb_rich_text_service(
             db=db,
             chunk_size=chunk_size,
             chunk_overlap=chunk_overlap,
-            detail_id=detail.id
+            detail_id=detail.id,
+            category_id=detail.category_id,
+            is_active=detail.is_active
         )
         
         if success:
+            await bump_kb_version()
             return detail
         
         else:
@@ -306,18 +313,16 @@ async def update_kb_with_rich_text_service(
         
         logger.info(f"Đã cập nhật thuộc tính cho detail_id={detail_id}")
 
-        # Bước 4: Xóa chunks cũ
-        logger.info(f"Đang xóa các chunks cũ của detail_id={detail.id}")
-        await delete_chunks(str(detail_id))
-
-        # Bước 5: Tạo chunks mới
-        logger.info(f"Đang tạo chunks mới cho detail_id={detail.id}")
-        success = await process_rich_text(
+        # Bước 4 + 5: Cập nhật chunks tăng dần (chỉ embed lại các chunk đã thay đổi)
+        logger.info(f"Đang cập nhật chunks cho detail_id={detail.id}")
+        success = await update_rich_text_chunks(
             raw_content=raw_content,
             db=db,
             chunk_size=chunk_size,
             chunk_overlap=chunk_overlap,
-            detail_id=detail.id
+            detail_id=detail.id,
+            category_id=detail.category_id,
+            is_active=detail.is_active
         )
 
         if not success:
@@ -326,11 +331,12 @@ async def update_kb_with_rich_text_service(
             await db.rollback()
             raise Exception(error_msg)
         
-        logger.info(f"Đã tạo chunks mới thành công")
+        logger.info(f"Đã cập nhật chunks thành công")
 
         # Bước 6: Commit
         await db.commit()
         logger.info(f"Đã commit thành công toàn bộ thay đổi cho detail_id={detail_id}")
+        await bump_kb_version()
         
         # Refresh detail để trả về
         await db.refresh(detail)
@@ -405,12 +411,69 @@ async def delete_kb_detail_service(detail_id: int, db: AsyncSession):
         detail = await db.get(KnowledgeBaseDetail, detail_id)
         await db.delete(detail)
         await db.commit()
+        await bump_kb_version()
         return True
     except Exception as e:
         await db.rollback()
         return False
     
 
+async def update_kb_detail_status_service(detail_id: int, is_active: bool, db: AsyncSession):
+    """
+    Bật/tắt 1 tài liệu: cập nhật DB + metadata is_active của các chunk (không embed lại)
+    """
+    try:
+        detail = await db.get(KnowledgeBaseDetail, detail_id)
+        if not detail:
+            return None
+        
+        detail.is_active = is_active
+        await db.commit()
+        await db.refresh(detail)
+        
+        await update_chunks_metadata(str(detail_id), {"is_active": bool(is_active)})
+        await bump_kb_version()
+        
+        logger.info(f"Đã cập nhật is_active={is_active} cho detail_id={detail_id}")
+        return detail
+        
+    except Exception as e:
+        await db.rollback()
+        logger.error(f"Lỗi khi cập nhật trạng thái detail_id={detail_id}: {str(e)}")
+        raise
+
+
+async def sync_chunk_metadata_service(db: AsyncSession):
+    """
+    Bổ sung category_id / is_active cho các chunk cũ (tạo trước khi metadata có 2 trường này)
+    """
+    chunks = await async_list_chunks()
+    missing_ids = {
+        str(meta.get("knowledge_id"))
+        for meta in (chunks.get("metadatas") or [])
+        if meta and "is_active" not in meta
+    }
+    if not missing_ids:
+        return 0
+    
+    result = await db.execute(
+        select(KnowledgeBaseDetail.id, KnowledgeBaseDetail.category_id, KnowledgeBaseDetail.is_active)
+        .filter(KnowledgeBaseDetail.id.in_([int(i) for i in missing_ids if i.isdigit()]))
+    )
+    rows = result.all()
+    for row in rows:
+        await update_chunks_metadata(str(row.id), {
+            "category_id": row.category_id,
+            "is_active": bool(row.is_active) if row.is_active is not None else True
+        })
+    
+    if rows:
+        await bump_kb_version()
+    
+    logger.info(f"Đã đồng bộ metadata chunk cho {len(rows)} tài liệu")
+    return len(rows)
+
+
 async def search_kb_service(query: str, db: AsyncSession):
    
     try:
@@ -577,19 +640,20 @@ async def delete_category_service(category_id: int, db: AsyncSession):
         if not category:
             return False
         
-        # Xóa tất cả chunks của các details thuộc category này
+        # Xóa tất cả chunks của các details thuộc category này (1 lệnh delete hàng loạt)
         details_result = await db.execute(
-            select(KnowledgeBaseDetail).filter(KnowledgeBaseDetail.category_id == category_id)
+            select(KnowledgeBaseDetail.id).filter(KnowledgeBaseDetail.category_id == category_id)
         )
-        details = details_result.scalars().all()
+        detail_ids = [str(detail_id) for detail_id in details_result.scalars().all()]
         
-        for detail in details:
-            await delete_chunks(str(detail.id))
-            logger.info(f"Đã xóa chunks của detail_id={detail.id}")
+        if not await delete_chunks_bulk(detail_ids):
+            raise Exception(f"Không xóa được chunks của category ID {category_id}")
+        logger.info(f"Đã xóa chunks của {len(detail_ids)} details")
         
         # Xóa category (cascade sẽ xóa các details)
         await db.delete(category)
         await db.commit()
+        await bump_kb_version()
         
         logger.info(f"Đã xóa category ID {category_id}")
         return True
@@ -13,7 +13,9 @@ async def create_llm_service(data: dict, db: AsyncSession):
         company_id=data.get("company_id"),
         chunksize=data.get("chunksize"),
         chunkoverlap=data.get("chunkoverlap"),
-        topk=data.get("topk")
+        topk=data.get("topk"),
+        rerank_enabled=bool(data.get("rerank_enabled", False)),
+        rerank_candidates=data.get("rerank_candidates")
     )
     db.add(llm_instance)
     await db.commit()
@@ -43,6 +45,10 @@ async def update_llm_service(llm_id: int, data: dict, db: AsyncSession):
         llm_instance.chunkoverlap = data.get('chunkoverlap')
     if 'topk' in data:
         llm_instance.topk = data.get('topk')
+    if 'rerank_enabled' in data:
+        llm_instance.rerank_enabled = bool(data.get('rerank_enabled'))
+    if 'rerank_candidates' in data:
+        llm_instance.rerank_candidates = data.get('rerank_candidates')
     
     # Cập nhật model được chọn cho bot và embedding
     if 'bot_model_detail_id' in data:
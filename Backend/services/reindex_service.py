@@ -0,0 +1,410 @@
+"""
+Re-index blue/green khi đổi model embedding
+- Collection đang active tiếp tục phục vụ search (với model embedding cũ) trong lúc
+  job embed lại toàn bộ KnowledgeBaseDetail (file + rich text) sang collection mới
+- Tiến độ lưu sau mỗi tài liệu (CHROMA_DATA_PATH/reindex_job.json) -> crash thì chạy tiếp
+- Catch-up: tài liệu thêm / sửa / xóa / bật tắt trong lúc re-index được đồng bộ lại
+  (so sánh updated_at) trước khi chuyển active sang collection mới (atomic)
+- Redis lock: nhiều worker chỉ có 1 worker chạy job
+"""
+
+import asyncio
+import json
+import logging
+import os
+import uuid
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from config.chromadb_config import (
+    CHROMA_DATA_PATH,
+    ACTIVE_INDEX_PATH,
+    DEFAULT_COLLECTION,
+    get_active_index,
+    set_active_index,
+    get_or_create_collection,
+    list_collection_names,
+    drop_collection,
+    delete_chunks,
+    run_in_chroma,
+    write_json_atomic,
+)
+from config.database import AsyncSessionLocal
+from config.get_embedding import resolve_embedding_model
+from config.redis_cache import redis_cache
+from helper.file_processor import extract_file_text, extract_rich_text, index_document_text
+from llm.help_llm import get_all_key, clear_llm_keys_cache
+from config.kb_version import bump_kb_version
+from models.knowledge_base import KnowledgeBaseDetail
+from models.llm import LLM, LLMDetail
+
+logger = logging.getLogger(__name__)
+
+REINDEX_JOB_PATH = os.path.join(CHROMA_DATA_PATH, "reindex_job.json")
+# Throttle: số batch embedding song song + nghỉ giữa 2 tài liệu (không tranh quota với chat)
+REINDEX_EMBEDDING_CONCURRENCY = int(os.getenv("REINDEX_EMBEDDING_CONCURRENCY", 2))
+REINDEX_DOCUMENT_DELAY = float(os.getenv("REINDEX_DOCUMENT_DELAY", 0.2))
+REINDEX_PAGE_SIZE = int(os.getenv("REINDEX_PAGE_SIZE", 50))
+REINDEX_MAX_CATCHUP_PASSES = int(os.getenv("REINDEX_MAX_CATCHUP_PASSES", 3))
+
+LOCK_KEY = "reindex:lock"
+LOCK_TTL = 120
+LOCK_RETRY_INTERVAL = 5
+
+# job_id -> task đang chạy trong worker này
+_job_tasks: Dict[str, asyncio.Task] = {}
+
+
+class ReindexCancelled(Exception):
+    pass
+
+
+# ================== JOB STATE ==================
+def _load_job() -> Optional[Dict]:
+    try:
+        with open(REINDEX_JOB_PATH, encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        logger.error(f"❌ Không đọc được {REINDEX_JOB_PATH}: {e}")
+        return None
+
+
+def _save_job(job: Dict) -> None:
+    job["updated_at"] = datetime.now().isoformat()
+    write_json_atomic(REINDEX_JOB_PATH, job)
+
+
+def _job_summary(job: Optional[Dict]) -> Optional[Dict]:
+    if not job:
+        return None
+    total = job.get("total") or 0
+    done = len(job.get("indexed", {}))
+    return {
+        "job_id": job["job_id"],
+        "status": job["status"],
+        "collection": job["collection"],
+        "embedding_model_detail_id": job["embedding_model_detail_id"],
+        "phase": job.get("phase"),
+        "total": total,
+        "done": done,
+        "failed": job.get("failed", {}),
+        "chunks": job.get("chunks", 0),
+        "percent": round(done * 100 / total, 1) if total else 0.0,
+        "error": job.get("error"),
+        "started_at": job.get("started_at"),
+        "updated_at": job.get("updated_at"),
+        "finished_at": job.get("finished_at"),
+    }
+
+
+def _check_not_cancelled(job_id: str) -> None:
+    # Job có thể bị hủy / thay thế từ worker khác -> đọc lại file trạng thái
+    current = _load_job()
+    if not current or current["job_id"] != job_id or current["status"] == "cancelled":
+        raise ReindexCancelled(job_id)
+
+
+# ================== REDIS LOCK ==================
+async def _acquire_lock(token: str) -> bool:
+    client = await redis_cache.get_async_client()
+    if client is None:
+        return True
+    return bool(await client.set(LOCK_KEY, token, nx=True, ex=LOCK_TTL))
+
+
+async def _refresh_lock(token: str) -> None:
+    client = await redis_cache.get_async_client()
+    if client is not None and await client.get(LOCK_KEY) == token:
+        await client.expire(LOCK_KEY, LOCK_TTL)
+
+
+async def _release_lock(token: str) -> None:
+    client = await redis_cache.get_async_client()
+    if client is not None and await client.get(LOCK_KEY) == token:
+        await client.delete(LOCK_KEY)
+
+
+# ================== INDEX 1 TÀI LIỆU ==================
+async def _index_detail(detail: KnowledgeBaseDetail, job: Dict, config: Dict) -> int:
+    # Xóa chunk cũ trong collection đích trước (tài liệu đã sửa / job bị crash giữa chừng)
+    await delete_chunks(str(detail.id), collection_name=job["collection"])
+
+    if detail.source_type == "RICH_TEXT":
+        text_content = extract_rich_text(detail.raw_content)
+    else:
+        if not detail.file_path or not os.path.exists(detail.file_path):
+            raise FileNotFoundError(f"Không tìm thấy file: {detail.file_path}")
+        text_content = await extract_file_text(detail.file_path, detail.file_name or detail.file_path)
+
+    if not text_content:
+        raise ValueError("Không đọc được nội dung tài liệu")
+
+    return await index_document_text(
+        text_content,
+        detail_id=detail.id,
+        category_id=detail.category_id,
+        is_active=detail.is_active if detail.is_active is not None else True,
+        chunk_size=config["chunk_size"],
+        chunk_overlap=config["chunk_overlap"],
+        embedding_model_name=config["embedding_model_name"],
+        embedding_keys=config["embedding_keys"],
+        collection_name=job["collection"],
+        max_concurrency=REINDEX_EMBEDDING_CONCURRENCY
+    )
+
+
+async def _sync_pass(db: AsyncSession, job: Dict, config: Dict, token: str) -> int:
+    """
+    Đồng bộ collection đích với DB: index tài liệu mới / đã sửa (updated_at khác),
+    xóa chunk của tài liệu đã bị xóa. Trả về số tài liệu đã thay đổi thành công.
+    """
+    # Kết thúc transaction cũ -> thấy được các thay đổi mới commit từ request khác
+    await db.rollback()
+    result = await db.execute(select(KnowledgeBaseDetail.id, KnowledgeBaseDetail.updated_at))
+    current = {
+        str(row.id): row.updated_at.isoformat() if row.updated_at else ""
+        for row in result.all()
+    }
+    job["total"] = len(current)
+
+    changed = 0
+    for knowledge_id in [kid for kid in job["indexed"] if kid not in current]:
+        await delete_chunks(knowledge_id, collection_name=job["collection"])
+        del job["indexed"][knowledge_id]
+        changed += 1
+    for knowledge_id in [kid for kid in job["failed"] if kid not in current]:
+        del job["failed"][knowledge_id]
+
+    todo = sorted(
+        (int(kid) for kid, updated_at in current.items() if job["indexed"].get(kid) != updated_at)
+    )
+    _save_job(job)
+
+    for start in range(0, len(todo), REINDEX_PAGE_SIZE):
+        page = await db.execute(
+            select(KnowledgeBaseDetail).filter(KnowledgeBaseDetail.id.in_(todo[start:start + REINDEX_PAGE_SIZE]))
+        )
+        for detail in page.scalars().all():
+            _check_not_cancelled(job["job_id"])
+            knowledge_id = str(detail.id)
+            try:
+                job["chunks"] = job.get("chunks", 0) + await _index_detail(detail, job, config)
+                job["indexed"][knowledge_id] = detail.updated_at.isoformat() if detail.updated_at else ""
+                job["failed"].pop(knowledge_id, None)
+                changed += 1
+            except ReindexCancelled:
+                raise
+            except Exception as e:
+                logger.error(f"❌ Re-index detail_id={detail.id} lỗi: {e}")
+                job["indexed"].pop(knowledge_id, None)
+                job["failed"][knowledge_id] = str(e)
+
+            _save_job(job)
+            await _refresh_lock(token)
+            if REINDEX_DOCUMENT_DELAY > 0:
+                await asyncio.sleep(REINDEX_DOCUMENT_DELAY)
+
+        # Không giữ cả nghìn object trong identity map
+        db.expunge_all()
+
+    return changed
+
+
+async def _load_job_config(db: AsyncSession, job: Dict) -> Dict:
+    llm_result = await db.execute(select(LLM).filter(LLM.id == 1))
+    llm = llm_result.scalar_one_or_none()
+
+    detail_result = await db.execute(select(LLMDetail).filter(LLMDetail.id == job["embedding_model_detail_id"]))
+    embedding_detail = detail_result.scalar_one_or_none()
+    if not embedding_detail:
+        raise ValueError(f"Không tìm thấy llm_detail id={job['embedding_model_detail_id']}")
+
+    keys = await get_all_key(db, llm_detail_id=embedding_detail.id)
+    embedding_keys = [k["key"] for k in keys if k["type"] == "embedding"]
+    if not embedding_keys:
+        raise ValueError(f"Model '{embedding_detail.name}' chưa có key embedding")
+
+    return {
+        "chunk_size": llm.chunksize if llm and llm.chunksize else 500,
+        "chunk_overlap": llm.chunkoverlap if llm and llm.chunkoverlap else 50,
+        "embedding_model_name": embedding_detail.name,
+        "embedding_keys": embedding_keys,
+    }
+
+
+def _drop_stale_collections(keep: List[str]) -> None:
+    # Collection của các lần re-index trước (đã bị thay thế / job bị hủy)
+    for name in list_collection_names():
+        if name.startswith(f"{DEFAULT_COLLECTION}_v") and name not in keep:
+            try:
+                drop_collection(name)
+            except Exception as e:
+                logger.warning(f"⚠️ Không xóa được collection '{name}': {e}")
+
+
+# ================== JOB ==================
+async def _run_job(job_id: str) -> None:
+    token = uuid.uuid4().hex
+    # Chờ lock: job cũ vừa bị hủy / worker cũ crash (lock tự hết hạn sau LOCK_TTL)
+    while not await _acquire_lock(token):
+        current = _load_job()
+        if not current or current["job_id"] != job_id or current["status"] != "running":
+            return
+        await asyncio.sleep(LOCK_RETRY_INTERVAL)
+
+    job = _load_job()
+    try:
+        if not job or job["job_id"] != job_id or job["status"] != "running":
+            return
+        logger.info(f"🔄 Bắt đầu re-index {job_id} -> '{job['collection']}'")
+
+        async with AsyncSessionLocal() as db:
+            config = await _load_job_config(db, job)
+            await run_in_chroma(_drop_stale_collections, [get_active_index()["collection"], job["collection"]])
+            await run_in_chroma(get_or_create_collection, job["collection"])
+
+            # Lượt đầu: toàn bộ tài liệu; các lượt sau: catch-up thay đổi trong lúc re-index
+            for catchup_pass in range(REINDEX_MAX_CATCHUP_PASSES + 1):
+                job["phase"] = "full" if catchup_pass == 0 else f"catch-up {catchup_pass}"
+                changed = await _sync_pass(db, job, config, token)
+                if catchup_pass > 0 and changed == 0:
+                    break
+
+            if job["failed"]:
+                job["status"] = "failed"
+                job["error"] = f"{len(job['failed'])} tài liệu lỗi, gọi lại POST /llms/reindex để thử lại"
+                _save_job(job)
+                logger.error(f"❌ Re-index {job_id}: {job['error']}")
+                return
+
+            _check_not_cancelled(job_id)
+
+            # Chuyển active sang collection mới + model embedding mới
+            set_active_index(
+                job["collection"],
+                job["embedding_model_detail_id"],
+                resolve_embedding_model(config["embedding_model_name"])
+            )
+            await clear_llm_keys_cache()
+            await bump_kb_version()
+
+            # Catch-up lần cuối: thay đổi ghi vào collection cũ ngay trước lúc chuyển
+            job["phase"] = "post-switch"
+            await _sync_pass(db, job, config, token)
+
+        job["status"] = "completed"
+        job["phase"] = None
+        job["finished_at"] = datetime.now().isoformat()
+        _save_job(job)
+        logger.info(f"✅ Re-index {job_id} hoàn tất: {len(job['indexed'])} tài liệu, {job.get('chunks', 0)} chunks")
+
+    except ReindexCancelled:
+        logger.info(f"ℹ️ Re-index {job_id} đã bị hủy")
+    except asyncio.CancelledError:
+        logger.info(f"ℹ️ Re-index {job_id} dừng (shutdown), sẽ chạy tiếp ở lần khởi động sau")
+        raise
+    except Exception as e:
+        logger.error(f"❌ Re-index {job_id} lỗi: {e}")
+        if job:
+            job["status"] = "failed"
+            job["error"] = str(e)
+            _save_job(job)
+    finally:
+        await _release_lock(token)
+
+
+def _launch(job: Dict) -> None:
+    for job_id, task in list(_job_tasks.items()):
+        if task.done():
+            del _job_tasks[job_id]
+    if job["job_id"] not in _job_tasks:
+        _job_tasks[job["job_id"]] = asyncio.create_task(_run_job(job["job_id"]))
+
+
+# ================== PUBLIC API ==================
+async def init_vector_index_service(db: AsyncSession) -> None:
+    """
+    Gọi lúc startup:
+    - Lần đầu: ghi nhận collection hiện tại + model embedding đang cấu hình là active
+    - Job re-index đang chạy dở (crash / restart) -> chạy tiếp
+    """
+    if not os.path.exists(ACTIVE_INDEX_PATH):
+        result = await db.execute(
+            select(LLMDetail.id, LLMDetail.name)
+            .join(LLM, LLM.embedding_model_detail_id == LLMDetail.id)
+            .where(LLM.id == 1)
+        )
+        row = result.first()
+        set_active_index(
+            DEFAULT_COLLECTION,
+            row.id if row else None,
+            resolve_embedding_model(row.name) if row else None
+        )
+
+    job = _load_job()
+    if job and job["status"] == "running":
+        logger.info(f"🔄 Tiếp tục re-index {job['job_id']} ({len(job.get('indexed', {}))}/{job.get('total')})")
+        _launch(job)
+
+
+def get_reindex_status_service() -> Dict:
+    return {
+        "active": get_active_index(),
+        "job": _job_summary(_load_job()),
+    }
+
+
+async def start_reindex_service(db: AsyncSession, force: bool = False) -> Dict:
+    """
+    Bắt đầu re-index nếu model embedding đã chọn (LLM.embedding_model_detail_id)
+    khác model của collection đang active. Job cũ dở dang cùng model -> chạy tiếp.
+    """
+    result = await db.execute(select(LLM.embedding_model_detail_id).filter(LLM.id == 1))
+    target_detail_id = result.scalar_one_or_none()
+    if not target_detail_id:
+        return get_reindex_status_service()
+
+    active = get_active_index()
+    job = _load_job()
+
+    if job and job["status"] in ("running", "failed") and job["embedding_model_detail_id"] == target_detail_id:
+        # Chạy tiếp (sau crash) hoặc thử lại các tài liệu lỗi
+        job["status"] = "running"
+        job["error"] = None
+        _save_job(job)
+        _launch(job)
+        return get_reindex_status_service()
+
+    if job and job["status"] == "running":
+        # Đổi sang model khác khi job cũ chưa xong -> hủy job cũ
+        # (job cũ tự dừng ở tài liệu kế tiếp khi thấy trạng thái cancelled)
+        job["status"] = "cancelled"
+        job["finished_at"] = datetime.now().isoformat()
+        _save_job(job)
+
+    if target_detail_id == active.get("embedding_model_detail_id") and not force:
+        return get_reindex_status_service()
+
+    job = {
+        "job_id": uuid.uuid4().hex,
+        "status": "running",
+        "phase": "full",
+        "collection": f"{DEFAULT_COLLECTION}_v{datetime.now().strftime('%Y%m%d%H%M%S')}",
+        "embedding_model_detail_id": target_detail_id,
+        "total": 0,
+        "indexed": {},
+        "failed": {},
+        "chunks": 0,
+        "error": None,
+        "started_at": datetime.now().isoformat(),
+        "finished_at": None,
+    }
+    _save_job(job)
+    logger.info(f"🔄 Tạo job re-index {job['job_id']} cho embedding_model_detail_id={target_detail_id}")
+    _launch(job)
+    return get_reindex_status_service()
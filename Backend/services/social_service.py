@@ -12,14 +12,15 @@ from helper.task import (
 )
 from helper.help_chat import (
     get_session_by_id_cached,
-    get_or_create_session_by_name_cached,
+    get_page_session_state,
     build_session_name,
     check_repply_cached,
     check_page_active_status
 )
 from helper.help_redis import (
-    cache_session_data,
-    clear_check_reply_cache
+    async_cache_session_data,
+    async_clear_check_reply_cache,
+    async_get_session_cache_bundle
 )
 
 # ✅ Get ConnectionManager singleton instance
@@ -43,8 +44,9 @@ async def send_message_fast_service(data: dict, user, db):
             print("❌ Error saving images:", e) 
             traceback.print_exc()
     
-    # Lấy session từ cache hoặc database (sử dụng helper)
-    session_data = await get_session_by_id_cached(chat_session_id, db)
+    # Session + check reply trong 1 round trip, thiếu session thì lấy từ database (sử dụng helper)
+    cached = await async_get_session_cache_bundle(chat_session_id)
+    session_data = await get_session_by_id_cached(chat_session_id, db, cached=cached)
     
     if not session_data:
         return []
@@ -78,10 +80,10 @@ async def send_message_fast_service(data: dict, user, db):
         session_data["time"] = new_time.isoformat()
         
         # Lưu lại cache với status mới (sử dụng helper)
-        cache_session_data(chat_session_id, session_data, ttl=300)
+        await async_cache_session_data(chat_session_id, session_data, ttl=300)
         
         # ✅ XÓA cache check_reply để force check lại (sử dụng helper)
-        clear_check_reply_cache(chat_session_id)
+        await async_clear_check_reply_cache(chat_session_id)
         
         
         # 🚀 Cập nhật database trong background (không block)
@@ -114,7 +116,7 @@ async def send_message_fast_service(data: dict, user, db):
         return response_messages
     
     # 🚀 Xử lý bot reply
-    should_reply = await check_repply_cached(chat_session_id, db)
+    should_reply = await check_repply_cached(chat_session_id, db, cached=cached)
     if should_reply:
         asyncio.create_task(generate_and_send_bot_response_background(
             data.get("content"),
@@ -131,8 +133,8 @@ async def send_message_page_service(data: dict, db):
     # Tạo session name từ platform và sender_id (sử dụng helper)
     session_name = build_session_name(data["platform"], data["sender_id"])
     
-    # Lấy hoặc tạo session (sử dụng helper)
-    session_data = await get_or_create_session_by_name_cached(
+    # Lấy hoặc tạo session + đọc sẵn check reply / page active (sử dụng helper)
+    session_data, cached = await get_page_session_state(
         session_name,
         data["platform"],
         data.get("page_id", ""),
@@ -165,7 +167,7 @@ async def send_message_page_service(data: dict, db):
     
     # 🚀 Xử lý bot reply trong background (không block webhook response)
     # Bước 1: Kiểm tra trạng thái page/bot trước
-    page_is_active = await check_page_active_status(data["platform"], data.get("page_id"), db)
+    page_is_active = await check_page_active_status(data["platform"], data.get("page_id"), db, cached=cached)
     
     if not page_is_active:
         # Page/bot bị tắt, không reply
@@ -173,7 +175,7 @@ async def send_message_page_service(data: dict, db):
         return response_messages
     
     # Bước 2: Nếu page/bot active, kiểm tra tiếp should_reply theo session
-    should_reply = await check_repply_cached(session_data['id'], db)
+    should_reply = await check_repply_cached(session_data['id'], db, cached=cached)
     if should_reply:
         asyncio.create_task(generate_and_send_platform_bot_response_background(
             data["message"],
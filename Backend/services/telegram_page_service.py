@@ -91,7 +91,7 @@ async def toggle_bot_status_service(bot_id: int, db: AsyncSession):
     await db.refresh(bot)
     
     # Clear cache để force check lại trạng thái
-    from helper.help_redis import clear_page_active_cache
-    clear_page_active_cache("telegram", bot.bot_token)
+    from helper.help_redis import async_clear_page_active_cache
+    await async_clear_page_active_cache("telegram", bot.bot_token)
     
     return bot
\ No newline at end of file
@@ -0,0 +1,96 @@
+"""
+🧪 TEST GEMINI MULTI-KEY CONCURRENCY
+=====================================
+Kiểm tra mỗi request Gemini chạy đúng API key được round-robin gán cho nó,
+kể cả khi 50 request (generation + embedding) chạy chồng lên nhau.
+
+Client Gemini thật được thay bằng client giả ghi lại key của nó,
+nên test không gọi ra ngoài mạng (khôi phục lại llm_clients sau khi chạy).
+
+Chạy: python test/test_gemini_key_isolation.py  (hoặc pytest test/test_gemini_key_isolation.py)
+"""
+
+import asyncio
+import json
+import os
+import random
+import sys
+from types import SimpleNamespace
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config.llm_clients import llm_clients
+from config.get_embedding import get_embedding_gemini
+from llm.gemini import generate_gemini_response
+
+NUM_CALLS = 50
+NUM_KEYS = 5
+
+
+class FakeGeminiClient:
+    """Client giả: trả về chính API key của nó trong response"""
+
+    in_flight = 0
+    max_in_flight = 0
+
+    def __init__(self, api_key: str):
+        self.api_key = api_key
+
+    async def _simulate_latency(self):
+        FakeGeminiClient.in_flight += 1
+        FakeGeminiClient.max_in_flight = max(FakeGeminiClient.max_in_flight, FakeGeminiClient.in_flight)
+        await asyncio.sleep(random.uniform(0.01, 0.05))
+        FakeGeminiClient.in_flight -= 1
+
+    async def generate_content(self, request):
+        await self._simulate_latency()
+        prompt = request.contents[0].parts[0].text
+        text = json.dumps({"message": f"{self.api_key}|{prompt}", "links": []})
+        part = SimpleNamespace(text=text)
+        return SimpleNamespace(candidates=[SimpleNamespace(content=SimpleNamespace(parts=[part]))])
+
+    async def embed_content(self, request):
+        await self._simulate_latency()
+        key_index = int(self.api_key.split("-")[1])
+        return SimpleNamespace(embedding=SimpleNamespace(values=[float(key_index)]))
+
+
+async def run_overlapping_calls():
+    original_clients = llm_clients._gemini_clients
+    llm_clients._gemini_clients = {}
+    llm_clients._create_gemini_client = FakeGeminiClient
+    FakeGeminiClient.max_in_flight = 0
+
+    async def generation_call(i: int):
+        api_key = f"key-{i % NUM_KEYS}"
+        response = json.loads(await generate_gemini_response(api_key=api_key, prompt=f"call-{i}"))
+        return api_key, response["message"] == f"{api_key}|call-{i}"
+
+    async def embedding_call(i: int):
+        api_key = f"key-{i % NUM_KEYS}"
+        vector = await get_embedding_gemini(f"call-{i}", api_key=api_key)
+        return api_key, vector == [float(i % NUM_KEYS)]
+
+    calls = [generation_call(i) if i % 2 == 0 else embedding_call(i) for i in range(NUM_CALLS)]
+    try:
+        results = await asyncio.gather(*calls)
+        return results, len(llm_clients._gemini_clients)
+    finally:
+        # Bỏ factory giả (thuộc tính instance che method của class) + trả lại client thật
+        del llm_clients._create_gemini_client
+        llm_clients._gemini_clients = original_clients
+
+
+def test_each_call_uses_assigned_key():
+    results, client_count = asyncio.run(run_overlapping_calls())
+
+    mismatches = [api_key for api_key, ok in results if not ok]
+    assert not mismatches, f"{len(mismatches)}/{NUM_CALLS} request chạy sai key: {mismatches}"
+    assert FakeGeminiClient.max_in_flight > 1, "Các request không chạy chồng lên nhau"
+    assert client_count == NUM_KEYS
+
+    print(f"✅ {NUM_CALLS} request, tối đa {FakeGeminiClient.max_in_flight} request song song, tất cả đúng key")
+
+
+if __name__ == "__main__":
+    test_each_call_uses_assigned_key()
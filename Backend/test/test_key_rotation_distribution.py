@@ -0,0 +1,179 @@
+"""
+🧪 TEST KEY ROTATION DISTRIBUTION
+==================================
+100 session mới gọi get_round_robin_api_key đồng thời, kiểm tra:
+- Key bot / embedding chia đều tuyệt đối giữa các key (chọn key nguyên tử trong Lua script, không trùng)
+- Session đã ghim key thì lần gọi sau vẫn nhận đúng key cũ
+- Key bị 429 (circuit breaker ngắt) không nhận session mới, session đang ghim vào nó được ghim lại
+
+Cần Redis đang chạy (REDIS_URL). Danh sách key được nạp sẵn vào cache list_keys
+với llm_detail_id giả nên không cần database.
+
+Chạy: python test/test_key_rotation_distribution.py  (hoặc pytest test/test_key_rotation_distribution.py)
+"""
+
+import asyncio
+import os
+import sys
+from collections import Counter
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config.redis_cache import redis_cache
+from llm.help_llm import get_round_robin_api_key
+from llm.key_health import key_health_key, key_state_key, key_session_key, record_key_result
+
+NUM_SESSIONS = 100
+NUM_BOT_KEYS = 4
+NUM_EMBEDDING_KEYS = 5
+
+# llm_detail_id / session_id giả, không đụng dữ liệu thật
+BOT_DETAIL_ID = 990001
+EMBEDDING_DETAIL_ID = 990002
+SESSION_ID_START = 990000000
+
+MODEL_INFO = {
+    "bot": {"id": BOT_DETAIL_ID, "name": "gpt-4o-mini"},
+    "embedding": {"id": EMBEDDING_DETAIL_ID, "name": "text-embedding-3-small"},
+}
+
+BOT_KEYS = [f"bot-{i}" for i in range(NUM_BOT_KEYS)]
+EMBEDDING_KEYS = [f"emb-{i}" for i in range(NUM_EMBEDDING_KEYS)]
+
+
+class RateLimitError(Exception):
+    status_code = 429
+
+
+def _test_keys():
+    session_keys = [
+        key_session_key(SESSION_ID_START + i, detail_id, key_type)
+        for i in range(NUM_SESSIONS)
+        for key_type, detail_id in (("bot", BOT_DETAIL_ID), ("embedding", EMBEDDING_DETAIL_ID))
+    ]
+    return [
+        f"list_keys:llm_detail_{BOT_DETAIL_ID}",
+        f"list_keys:llm_detail_{EMBEDDING_DETAIL_ID}",
+        key_state_key(BOT_DETAIL_ID, "bot"),
+        key_state_key(EMBEDDING_DETAIL_ID, "embedding"),
+        *[key_health_key(api_key) for api_key in BOT_KEYS + EMBEDDING_KEYS],
+        *session_keys,
+    ]
+
+
+async def _prepare_redis():
+    client = await redis_cache.get_async_client()
+    if client is None:
+        return None
+
+    await client.delete(*_test_keys())
+    await redis_cache.async_set(f"list_keys:llm_detail_{BOT_DETAIL_ID}", [
+        {"key": key, "type": "bot", "llm_detail_id": BOT_DETAIL_ID} for key in BOT_KEYS
+    ])
+    await redis_cache.async_set(f"list_keys:llm_detail_{EMBEDDING_DETAIL_ID}", [
+        {"key": key, "type": "embedding", "llm_detail_id": EMBEDDING_DETAIL_ID} for key in EMBEDDING_KEYS
+    ])
+    return client
+
+
+async def _assign_all(session_ids):
+    return await asyncio.gather(*[
+        get_round_robin_api_key(None, MODEL_INFO, session_id) for session_id in session_ids
+    ])
+
+
+async def run_concurrent_sessions():
+    client = await _prepare_redis()
+    if client is None:
+        return None
+
+    try:
+        session_ids = [SESSION_ID_START + i for i in range(NUM_SESSIONS)]
+        first = await _assign_all(session_ids)
+        second = await _assign_all(session_ids)
+        return first, second
+    finally:
+        await client.delete(*_test_keys())
+
+
+async def run_with_rate_limited_key():
+    client = await _prepare_redis()
+    if client is None:
+        return None
+
+    try:
+        half = NUM_SESSIONS // 2
+        pinned = await _assign_all([SESSION_ID_START + i for i in range(half)])
+
+        # bot-0 bị 429 -> breaker ngắt ngay
+        await record_key_result("bot-0", ok=False, error=RateLimitError("429 Too Many Requests"))
+
+        repinned = await _assign_all([SESSION_ID_START + i for i in range(half)])
+        fresh = await _assign_all([SESSION_ID_START + i for i in range(half, NUM_SESSIONS)])
+        return pinned, repinned, fresh
+    finally:
+        await client.delete(*_test_keys())
+
+
+def _run(scenario):
+    """Mỗi test 1 event loop riêng: đóng client Redis async trước khi loop đóng"""
+    async def runner():
+        try:
+            return await scenario()
+        finally:
+            await redis_cache.async_close()
+
+    return asyncio.run(runner())
+
+
+def _skip_without_redis():
+    try:
+        import pytest
+        pytest.skip("Redis không chạy")
+    except ImportError:
+        print("⚠️  Redis không chạy, bỏ qua test")
+
+
+def test_concurrent_new_sessions_are_evenly_distributed():
+    results = _run(run_concurrent_sessions)
+    if results is None:
+        return _skip_without_redis()
+
+    first, second = results
+
+    bot_counts = Counter(r["bot_key"] for r in first)
+    embedding_counts = Counter(r["embedding_key"] for r in first)
+
+    assert bot_counts == Counter({f"bot-{i}": NUM_SESSIONS // NUM_BOT_KEYS for i in range(NUM_BOT_KEYS)}), bot_counts
+    assert embedding_counts == Counter(
+        {f"emb-{i}": NUM_SESSIONS // NUM_EMBEDDING_KEYS for i in range(NUM_EMBEDDING_KEYS)}
+    ), embedding_counts
+    assert first == second, "Session đã ghim key nhưng lần gọi sau nhận key khác"
+
+    print(f"✅ {NUM_SESSIONS} session đồng thời")
+    print(f"  🔑 Bot: {dict(sorted(bot_counts.items()))}")
+    print(f"  🔑 Embedding: {dict(sorted(embedding_counts.items()))}")
+
+
+def test_rate_limited_key_is_skipped_and_sessions_repinned():
+    results = _run(run_with_rate_limited_key)
+    if results is None:
+        return _skip_without_redis()
+
+    pinned, repinned, fresh = results
+
+    assert all(r["bot_key"] != "bot-0" for r in repinned + fresh), "Key đang ngắt vẫn nhận traffic"
+    for before, after in zip(pinned, repinned):
+        if before["bot_key"] != "bot-0":
+            assert before == after, "Session ghim vào key khỏe bị ghim lại không cần thiết"
+
+    fresh_counts = Counter(r["bot_key"] for r in fresh)
+    assert max(fresh_counts.values()) - min(fresh_counts.values()) <= 1, fresh_counts
+
+    moved = sum(1 for r in pinned if r["bot_key"] == "bot-0")
+    print(f"✅ bot-0 bị ngắt: {moved} session được ghim lại, session mới: {dict(sorted(fresh_counts.items()))}")
+
+
+if __name__ == "__main__":
+    test_concurrent_new_sessions_are_evenly_distributed()
+    test_rate_limited_key_is_skipped_and_sessions_repinned()
@@ -0,0 +1,136 @@
+"""
+🧪 TEST TOKEN BUCKET THEO KEY
+==============================
+Kiểm tra llm/rate_limiter.py trên Redis thật:
+- Key hết lượt RPM -> request chuyển sang key còn lượt cùng loại
+- Tất cả key hết lượt -> chờ bucket nạp lại (không vượt LLM_RATE_LIMIT_MAX_WAIT)
+- 50 request đồng thời không lấy quá số lượt của bucket
+- Key thay thế đang bị circuit breaker ngắt không nhận request dù bucket còn đầy
+
+Cần Redis đang chạy (REDIS_URL).
+
+Chạy: python test/test_rate_limiter.py  (hoặc pytest test/test_rate_limiter.py)
+"""
+
+import asyncio
+import os
+import sys
+import time
+from collections import Counter
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config.redis_cache import redis_cache
+from llm import rate_limiter
+from llm.rate_limiter import acquire_key, get_bucket_levels, rate_limit_key
+from llm.key_health import key_health_key, record_key_result
+
+# 60 RPM = nạp lại 1 lượt / giây
+TEST_RPM = 60
+KEYS = ["rate-test-a", "rate-test-b"]
+
+
+class RateLimitError(Exception):
+    status_code = 429
+
+
+async def run_acquire():
+    client = await redis_cache.get_async_client()
+    if client is None:
+        return None
+
+    bucket_keys = [rate_limit_key("bot", key) for key in KEYS]
+    await client.delete(*bucket_keys)
+
+    original_limits = rate_limiter.RATE_LIMITS["bot"]
+    rate_limiter.RATE_LIMITS["bot"] = {"rpm": TEST_RPM, "tpm": 0}
+    try:
+        # 2 bucket đầy = 2 * TEST_RPM lượt, gọi đồng thời từ key a
+        burst = await asyncio.gather(*[
+            acquire_key("bot", KEYS[0], alternatives=KEYS) for _ in range(TEST_RPM + 50)
+        ])
+        levels = await get_bucket_levels("bot", KEYS)
+
+        # Hết sạch cả 2 bucket -> lần gọi sau phải chờ nạp lại
+        await asyncio.gather(*[acquire_key("bot", KEYS[1], alternatives=KEYS) for _ in range(TEST_RPM)])
+        started = time.perf_counter()
+        await acquire_key("bot", KEYS[0], alternatives=KEYS)
+        waited = time.perf_counter() - started
+
+        return Counter(burst), levels, waited
+    finally:
+        rate_limiter.RATE_LIMITS["bot"] = original_limits
+        await client.delete(*bucket_keys)
+
+
+async def run_acquire_with_tripped_alternative():
+    client = await redis_cache.get_async_client()
+    if client is None:
+        return None
+
+    test_keys = [rate_limit_key("bot", key) for key in KEYS] + [key_health_key(key) for key in KEYS]
+    await client.delete(*test_keys)
+
+    original_limits = rate_limiter.RATE_LIMITS["bot"]
+    rate_limiter.RATE_LIMITS["bot"] = {"rpm": TEST_RPM, "tpm": 0}
+    try:
+        # Key b bị 429 -> breaker ngắt, bucket của b vẫn đầy
+        await record_key_result(KEYS[1], ok=False, error=RateLimitError("429 Too Many Requests"))
+        burst = await asyncio.gather(*[
+            acquire_key("bot", KEYS[0], alternatives=KEYS) for _ in range(TEST_RPM + 10)
+        ])
+        return Counter(burst)
+    finally:
+        rate_limiter.RATE_LIMITS["bot"] = original_limits
+        await client.delete(*test_keys)
+
+
+def _run(scenario):
+    """Mỗi test 1 event loop riêng: đóng client Redis async trước khi loop đóng"""
+    async def runner():
+        try:
+            return await scenario()
+        finally:
+            await redis_cache.async_close()
+
+    return asyncio.run(runner())
+
+
+def _skip_without_redis():
+    try:
+        import pytest
+        pytest.skip("Redis không chạy")
+    except ImportError:
+        print("⚠️  Redis không chạy, bỏ qua test")
+
+
+def test_bucket_moves_to_other_key_then_waits():
+    results = _run(run_acquire)
+    if results is None:
+        return _skip_without_redis()
+
+    burst, levels, waited = results
+
+    assert burst == Counter({KEYS[0]: TEST_RPM, KEYS[1]: 50}), burst
+    assert levels[0]["requests_available"] < 1, levels
+    assert 0 < waited <= rate_limiter.LLM_RATE_LIMIT_MAX_WAIT + 0.5, waited
+
+    print(f"✅ Burst {TEST_RPM + 50} request: {dict(burst)}")
+    print(f"  🚦 Bucket sau burst: {levels}")
+    print(f"  ⏱️  Chờ khi cả 2 key hết lượt: {waited:.2f}s")
+
+
+def test_tripped_alternative_is_not_used():
+    burst = _run(run_acquire_with_tripped_alternative)
+    if burst is None:
+        return _skip_without_redis()
+
+    # Hết lượt key a thì chờ nạp lại / gọi tiếp bằng a, không chuyển sang key b đang ngắt
+    assert burst == Counter({KEYS[0]: TEST_RPM + 10}), burst
+
+    print(f"✅ Key {KEYS[1]} đang ngắt không nhận request: {dict(burst)}")
+
+
+if __name__ == "__main__":
+    test_bucket_moves_to_other_key_then_waits()
+    test_tripped_alternative_is_not_used()
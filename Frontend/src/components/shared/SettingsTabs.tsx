@@ -10,6 +10,7 @@ import {
 } from "@/components/ui/card";
 import { Input, type InputProps } from "@/components/ui/input";
 import { Label } from "@/components/ui/label";
+import { Switch } from "@/components/ui/switch";
 import { Tabs, TabsList, TabsTrigger, TabsContent } from "@/components/ui/tabs";
 import {
     Dialog,
@@ -205,6 +206,8 @@ export function SettingsTabs() {
     const [chunksize, setChunksize] = useState<number | "">("");
     const [chunkoverlap, setChunkoverlap] = useState<number | "">("");
     const [topk, setTopk] = useState<number | "">("");
+    const [rerankEnabled, setRerankEnabled] = useState(false);
+    const [rerankCandidates, setRerankCandidates] = useState<number | "">("");
     const [aiKeys, setAiKeys] = useState<
         Array<{ id: number; value: string; keyId?: number; name: string }>
     >([]);
@@ -289,6 +292,8 @@ export function SettingsTabs() {
             setChunksize(llmConfig.chunksize ?? "");
             setChunkoverlap(llmConfig.chunkoverlap ?? "");
             setTopk(llmConfig.topk ?? "");
+            setRerankEnabled(llmConfig.rerank_enabled ?? false);
+            setRerankCandidates(llmConfig.rerank_candidates ?? "");
 
             const botModelName = getModelNameById(llmConfig.bot_model_detail_id);
             const embeddingModelName = getModelNameById(llmConfig.embedding_model_detail_id);
@@ -393,6 +398,8 @@ export function SettingsTabs() {
                 chunksize: chunksize === "" ? undefined : Number(chunksize),
                 chunkoverlap: chunkoverlap === "" ? undefined : Number(chunkoverlap),
                 topk: topk === "" ? undefined : Number(topk),
+                rerankEnabled,
+                rerankCandidates: rerankCandidates === "" ? null : Number(rerankCandidates),
             });
             success("Cấu hình chatbot trả lời đã được lưu thành công!");
         } catch (err) {
@@ -909,6 +916,32 @@ export function SettingsTabs() {
                                         Số lượng đoạn văn bản liên quan nhất sẽ được sử dụng để tạo câu trả lời.
                                     </p>
                                 </div>
+                                <div className="grid gap-3">
+                                    <div className="flex items-center justify-between">
+                                        <Label htmlFor="rerank_enabled">
+                                            Rerank
+                                            <span className="text-sm text-gray-500 ml-2">(Sắp xếp lại kết quả tìm kiếm)</span>
+                                        </Label>
+                                        <Switch
+                                            id="rerank_enabled"
+                                            checked={rerankEnabled}
+                                            onCheckedChange={setRerankEnabled}
+                                        />
+                                    </div>
+                                    {rerankEnabled && (
+                                        <Input
+                                            id="rerank_candidates"
+                                            type="number"
+                                            value={rerankCandidates}
+                                            onChange={(e) => setRerankCandidates(e.target.value === "" ? "" : Number(e.target.value))}
+                                            placeholder="Số đoạn ứng viên, ví dụ: 20"
+                                            min="1"
+                                        />
+                                    )}
+                                    <p className="text-sm text-gray-500">
+                                        Lấy nhiều đoạn văn bản ứng viên rồi chấm điểm lại bằng model rerank, chỉ giữ Top K đoạn phù hợp nhất. Để trống số ứng viên sẽ dùng mặc định (Top K × 4).
+                                    </p>
+                                </div>
 
                                 {/* Hiển thị giá trị hiện tại */}
                                 {llmConfig && (
@@ -927,6 +960,14 @@ export function SettingsTabs() {
                                                 <span className="text-gray-700">Top K:</span>
                                                 <span className="font-medium">{llmConfig.topk ?? "Chưa thiết lập"}</span>
                                             </div>
+                                            <div className="flex justify-between">
+                                                <span className="text-gray-700">Rerank:</span>
+                                                <span className="font-medium">
+                                                    {llmConfig.rerank_enabled
+                                                        ? `Bật (${llmConfig.rerank_candidates ?? "mặc định"} ứng viên)`
+                                                        : "Tắt"}
+                                                </span>
+                                            </div>
                                         </div>
                                     </div>
                                 )}
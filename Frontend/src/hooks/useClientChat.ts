@@ -9,6 +9,8 @@ import {
 } from "@/services/chatService"; // Đảm bảo đường dẫn này đúng
 import type { MessageData } from "@/types/message";
 
+const STREAMING_MESSAGE_ID = "bot-streaming";
+
 export const useClientChat = () => {
   // --- State ---
   const [messages, setMessages] = useState<MessageData[]>([]);
@@ -77,6 +79,31 @@ export const useClientChat = () => {
 
         // Định nghĩa hàm callback khi có tin nhắn mới
         const handleNewMessage = (data: MessageData) => {
+          // Bot đang stream: nối delta vào tin nhắn tạm
+          if (data.type === "bot_delta") {
+            setMessages((prevMessages) => {
+              const last = prevMessages[prevMessages.length - 1];
+              if (last && last.id === STREAMING_MESSAGE_ID) {
+                return [
+                  ...prevMessages.slice(0, -1),
+                  { ...last, content: last.content + (data.delta || "") },
+                ];
+              }
+              return [
+                ...prevMessages,
+                {
+                  id: STREAMING_MESSAGE_ID,
+                  chat_session_id: data.chat_session_id,
+                  sender_type: "bot",
+                  content: data.delta || "",
+                  created_at: new Date().toISOString(),
+                  image: null,
+                },
+              ];
+            });
+            return;
+          }
+
           // Normalize dữ liệu - đảm bảo created_at luôn có giá trị hợp lệ
           const normalizedMessage: MessageData = {
             ...data,
@@ -84,8 +111,13 @@ export const useClientChat = () => {
             id: data.id || `msg-${Date.now()}`,
           };
           console.log("Tin nhắn sau khi normalize:", normalizedMessage);
-          // Cập nhật state tin nhắn
-          setMessages((prevMessages) => [...prevMessages, normalizedMessage]);
+          // Cập nhật state tin nhắn (tin nhắn bot đầy đủ thay thế tin nhắn đang stream)
+          setMessages((prevMessages) => [
+            ...(normalizedMessage.sender_type === "bot"
+              ? prevMessages.filter((m) => m.id !== STREAMING_MESSAGE_ID)
+              : prevMessages),
+            normalizedMessage,
+          ]);
         };
 
         // Kết nối WebSocket
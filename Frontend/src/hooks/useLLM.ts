@@ -48,6 +48,8 @@ export const useLLM = () => {
       chunksize?: number;
       chunkoverlap?: number;
       topk?: number;
+      rerankEnabled?: boolean;
+      rerankCandidates?: number | null;
     }) => {
       try {
         setLoading(true);
@@ -63,6 +65,8 @@ export const useLLM = () => {
           chunksize: data.chunksize,
           chunkoverlap: data.chunkoverlap,
           topk: data.topk,
+          rerank_enabled: data.rerankEnabled,
+          rerank_candidates: data.rerankCandidates,
         };
 
         let updatedLLM: LLMData;
@@ -35,6 +35,8 @@ export interface LLM {
   chunksize?: number;
   chunkoverlap?: number;
   topk?: number;
+  rerank_enabled?: boolean;
+  rerank_candidates?: number | null;
 }
 
 // Interface cho LLM data từ API response
@@ -49,6 +51,8 @@ export interface LLMData {
   chunksize?: number;
   chunkoverlap?: number;
   topk?: number;
+  rerank_enabled?: boolean;
+  rerank_candidates?: number | null;
   llm_details: LLMDetailResponse[];
 }
 
@@ -6,6 +6,8 @@ export interface MessageData {
   content: string;
   created_at: string;
   image?: string | null; // Hoặc string[] nếu là mảng ảnh
+  type?: "bot_delta"; // Đoạn câu trả lời bot đang stream
+  delta?: string;
   // Bổ sung các trường khác nếu cần
 }
 export interface SendMessagePayload {